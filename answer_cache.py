@@ -0,0 +1,153 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from document_processor import get_embeddings
+from resources import shared_resource
+from metrics import record_cache
+
+from config import ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def normalize_question(question: str) -> str:
+    """Canonical form used for exact-match lookups."""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+class CachedAnswer(NamedTuple):
+    """A previously generated answer and how it matched the incoming question."""
+
+    answer: str
+    question: str
+    similarity: float
+
+class _Entry(NamedTuple):
+    question: str
+    vector: np.ndarray
+    answer: str
+    created_at: float
+
+class AnswerCache:
+    """Process-wide cache of answers to standalone questions, matched by embedding similarity.
+
+    Only answers generated without any session history belong here, and no
+    per-user signal such as the asker's tone is kept with them.
+
+    Entries expire after `ttl_seconds`, the least recently used entry is evicted
+    beyond `max_entries`, and the whole cache is dropped when the knowledge-base
+    index version changes.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: list = []
+        self._lock = threading.Lock()
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync_version(self, version: Optional[str]) -> None:
+        if version != self.version:
+            if self._entries:
+                logger.info(f"Knowledge base changed to {version}; dropping {len(self._entries)} cached answers")
+            self._entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def _purge_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry.created_at < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, question: str, version: Optional[str]) -> Optional[CachedAnswer]:
+        """Return a cached answer for the question or a near-duplicate of it."""
+        start = time.perf_counter()
+        key = normalize_question(question)
+        with self._lock:
+            self._sync_version(version)
+            self._purge_expired()
+            if not self._entries:
+                self.misses += 1
+                record_cache("answer", hit=False)
+                return None
+            match = self._entries.get(key)
+            similarity = 1.0
+        if match is None:
+            vector = self._embed(question)
+            with self._lock:
+                if not self._entries:
+                    self.misses += 1
+                    record_cache("answer", hit=False)
+                    return None
+                if self._matrix is None:
+                    self._matrix_keys = list(self._entries)
+                    self._matrix = np.stack([self._entries[entry_key].vector for entry_key in self._matrix_keys])
+                scores = self._matrix @ vector
+                best = int(np.argmax(scores))
+                similarity = float(scores[best])
+                if similarity >= self.threshold:
+                    key = self._matrix_keys[best]
+                    match = self._entries[key]
+        with self._lock:
+            if match is None:
+                self.misses += 1
+                record_cache("answer", hit=False)
+                logger.info(f"Answer cache miss ({(time.perf_counter() - start) * 1000:.1f} ms, best similarity {similarity:.3f})")
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache("answer", hit=True)
+        logger.info(
+            f"Answer cache hit ({(time.perf_counter() - start) * 1000:.1f} ms, similarity {similarity:.3f}): "
+            f"'{question[:60]}' matched '{match.question[:60]}'"
+        )
+        return CachedAnswer(match.answer, match.question, similarity)
+
+    def store(self, question: str, answer: str, version: Optional[str]) -> None:
+        """Cache a freshly generated answer for the given index version."""
+        if not answer:
+            return
+        vector = self._embed(question)
+        with self._lock:
+            self._sync_version(version)
+            key = normalize_question(question)
+            self._entries[key] = _Entry(question, vector, answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+@shared_resource("answer_cache", close=AnswerCache.clear)
+def get_answer_cache() -> AnswerCache:
+    """Return the answer cache shared by every session in this process."""
+    return AnswerCache(get_embeddings())
@@ -0,0 +1,113 @@
+import json
+import asyncio
+import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.concurrency import run_in_threadpool
+import uvicorn
+from helpdesk_engine import get_engine
+from resources import registry
+from metrics import METRICS
+
+from config import API_HOST, API_PORT, API_WORKERS, API_TURN_THREADS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def health(request: Request) -> JSONResponse:
+    engine = get_engine()
+    knowledge_base = await run_in_threadpool(lambda: engine.knowledge_base)
+    return JSONResponse({
+        "status": "ok",
+        "company_name": knowledge_base.company_name,
+        "index_version": knowledge_base.version,
+    })
+
+async def create_session(request: Request) -> JSONResponse:
+    return JSONResponse({"session_id": get_engine().new_session_id()}, status_code=201)
+
+async def get_messages(request: Request) -> JSONResponse:
+    """GET /sessions/{session_id}/messages?limit=N&offset=M"""
+    try:
+        limit = int(request.query_params["limit"]) if "limit" in request.query_params else None
+        offset = int(request.query_params.get("offset", 0))
+    except ValueError:
+        return JSONResponse({"error": "limit and offset must be integers"}, status_code=400)
+    messages = await run_in_threadpool(get_engine().get_history, request.path_params["session_id"], limit, offset)
+    return JSONResponse({"messages": messages})
+
+async def post_message(request: Request):
+    """POST /sessions/{session_id}/messages with {"message": "..."}.
+
+    Streams server-sent events when the client accepts text/event-stream,
+    otherwise returns the assistant messages once the turn is complete.
+    """
+    session_id = request.path_params["session_id"]
+    try:
+        message = (await request.json()).get("message", "")
+    except (ValueError, AttributeError):
+        return JSONResponse({"error": "Expected a JSON body with a 'message' field"}, status_code=400)
+    if not isinstance(message, str) or not message.strip():
+        return JSONResponse({"error": "Message must be a non-empty string"}, status_code=400)
+    events = get_engine().astream_turn(session_id, message)
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        async def stream():
+            async for event in events:
+                yield sse_event(event.event, event.data)
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    messages = [event.data async for event in events if event.event in ("message", "error")]
+    return JSONResponse({"session_id": session_id, "messages": messages})
+
+async def get_support_requests(request: Request) -> JSONResponse:
+    requests = await run_in_threadpool(get_engine().poll_support_requests, request.path_params["session_id"])
+    return JSONResponse({"support_requests": requests})
+
+async def refresh_knowledge_base(request: Request) -> JSONResponse:
+    try:
+        knowledge_base = await run_in_threadpool(get_engine().refresh_knowledge_base)
+    except Exception as e:
+        logger.error(f"Error refreshing knowledge base: {e}")
+        return JSONResponse({"error": f"Error refreshing knowledge base: {e}"}, status_code=500)
+    return JSONResponse({"company_name": knowledge_base.company_name, "index_version": knowledge_base.version})
+
+async def metrics(request: Request):
+    """Prometheus text exposition, or a JSON snapshot with ?format=json. Metrics are per worker process."""
+    if request.query_params.get("format") == "json":
+        return JSONResponse(METRICS.to_dict())
+    return PlainTextResponse(METRICS.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    # Turns block on retrieval and the LLM, so they run on a dedicated pool sized for concurrent sessions.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=API_TURN_THREADS, thread_name_prefix="turn"))
+    yield
+    # Let background memory folds finish before the stores they write to are closed
+    registry.close("helpdesk_engine")
+    registry.close_all()
+
+app = Starlette(
+    routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/sessions", create_session, methods=["POST"]),
+        Route("/sessions/{session_id}/messages", get_messages, methods=["GET"]),
+        Route("/sessions/{session_id}/messages", post_message, methods=["POST"]),
+        Route("/sessions/{session_id}/support-requests", get_support_requests, methods=["GET"]),
+        Route("/knowledge-base/refresh", refresh_knowledge_base, methods=["POST"]),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    uvicorn.run("api:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
@@ -1,34 +1,29 @@
 import streamlit as st
-from ui_components import initialize_ui, display_chat_messages, handle_user_input, handle_voice_input
-from chat_history import ChatHistoryManager
+from ui_components import initialize_ui, display_chat_messages, chat_panel, handle_user_input, handle_voice_input
+from helpdesk_engine import get_engine
 from config import GOOGLE_API_KEY
 import logging
-import google.generativeai as genai
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini client
-genai.configure(api_key=GOOGLE_API_KEY)
-
 def main():
     """Main function to run the Streamlit app."""
     if not GOOGLE_API_KEY:
         st.error("Please set the GOOGLE_API_KEY environment variable.")
         return
-    # Initialize chat history manager
-    chat_manager = ChatHistoryManager()
-    initialize_ui(chat_manager)
+    # Process-wide help-desk engine; this script only renders its events
+    engine = get_engine()
+    initialize_ui(engine)
     # Display title after initialization
     if "company_name" in st.session_state:
         st.title(f"🏢 {st.session_state.company_name} Help Desk")
-    display_chat_messages()
+    display_chat_messages(engine, st.session_state.session_id)
     if voice_prompt := handle_voice_input():
-        handle_user_input(voice_prompt, chat_manager, st.session_state.session_id)
+        handle_user_input(voice_prompt, engine, st.session_state.session_id)
         st.rerun()
-    elif prompt := st.chat_input("Ask me anything about the company!"):
-        handle_user_input(prompt, chat_manager, st.session_state.session_id)
+    chat_panel(engine)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,478 @@
+import os
+
+# config reads credentials at import time. Offline runs need none, and their traces stay out of logs/.
+for _name, _value in {
+    "GEMINI_API_KEY": "offline-benchmark",
+    "EMAIL_SENDER": "helpdesk@benchmark.invalid",
+    "EMAIL_PASSWORD": "",
+    "EMAIL_RECIPIENT": "support@benchmark.invalid",
+    "METRICS_TRACE_LOG_PATH": "",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from fake_backends import (
+    FakeChatModel, FakeEmbeddings, FakeGenerativeModel, SMTPSink, synthetic_questions, write_corpus
+)
+from resources import registry
+from metrics import METRICS, STAGE_SECONDS, CACHE_REQUESTS_TOTAL
+from chat_history import ChatHistoryManager, get_chat_manager
+from document_processor import create_vectorstore, process_documents
+from email_utils import EmailOutbox, SMTPConnection
+from embedding_service import CachedEmbeddings, EmbeddingCache
+from helpdesk_engine import HelpDeskEngine
+from index_manager import KnowledgeBase
+from llm_utils import summarize_support_conversation
+from tone_detector import GeminiToneDetector, ToneDetector
+
+from config import EMBEDDING_MODEL_NAME, MEMORY_RECENT_TURNS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESULTS_SCHEMA_VERSION = 1
+BENCHMARKS = ("startup", "ingestion", "retrieval", "history", "e2e")
+# Cold-import budgets for the entry points, in seconds. Streamlit itself accounts for most of app's.
+IMPORT_BUDGETS = {"app": 1.0, "api": 0.5}
+# Heavy dependencies the entry points must not import until first use.
+LAZY_MODULES = (
+    "langchain", "langchain_core", "langchain_community", "langchain_google_genai", "google.generativeai",
+    "PyPDF2", "docx", "speech_recognition", "faiss", "numpy",
+)
+NEGATIVE_MESSAGES = [
+    "This is useless, the answer is still wrong!!",
+    "Seriously, I am so frustrated, nothing works.",
+    "Terrible help, I'm fed up with this.",
+]
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Offline help-desk benchmarks against fake Gemini, embedding and SMTP backends."
+    )
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before a metric counts as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Parent directory for the scratch stores (default: system temp)")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the corpora, indexes and databases")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the application's logs")
+
+    corpus = parser.add_argument_group("corpus and workload")
+    corpus.add_argument("--startup-runs", type=int, default=5, help="Fresh interpreters per entry point for import timing")
+    corpus.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200], help="Corpus sizes (documents) for ingestion")
+    corpus.add_argument("--pages", type=int, default=5, help="Pages per synthetic document")
+    corpus.add_argument("--queries", type=int, default=50, help="Queries per retrieval mode")
+    corpus.add_argument("--history-sessions", type=int, default=50)
+    corpus.add_argument("--history-messages", type=int, default=40, help="Messages written per history session")
+    corpus.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent sessions per end-to-end run")
+    corpus.add_argument("--turns", type=int, default=4, help="Questions per end-to-end session")
+    corpus.add_argument("--question-pool", type=int, default=40, help="Distinct questions sessions draw from")
+    corpus.add_argument("--escalation-rate", type=float, default=0.1, help="Fraction of sessions that escalate to support")
+
+    fakes = parser.add_argument_group("fake backends")
+    fakes.add_argument("--llm-latency", type=float, default=0.4, help="Seconds to the first generated token")
+    fakes.add_argument("--llm-tokens-per-second", type=float, default=80.0)
+    fakes.add_argument("--answer-tokens", type=int, default=60)
+    fakes.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embedding request")
+    fakes.add_argument("--embedding-seconds-per-text", type=float, default=0.0005)
+    fakes.add_argument("--tone-fallback", action="store_true", help="Enable the Gemini tone fallback")
+    fakes.add_argument("--tone-latency", type=float, default=0.2)
+    fakes.add_argument("--smtp-latency", type=float, default=0.01, help="Seconds the SMTP sink takes per message")
+    return parser.parse_args(argv)
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Count, mean and exact percentiles of latency samples in seconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(q: float) -> float:
+        return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": ordered[-1],
+    }
+
+def stage_breakdown() -> Dict[str, Dict[str, float]]:
+    """Per-stage latency the application's own spans recorded since the last METRICS.reset()."""
+    series = METRICS.to_dict()["histograms"].get(STAGE_SECONDS, [])
+    return {
+        entry["labels"]["stage"]: {key: entry[key] for key in ("count", "mean", "p50", "p95")}
+        for entry in series
+    }
+
+def cache_counts() -> Dict[str, Dict[str, float]]:
+    counts: Dict[str, Dict[str, float]] = {}
+    for entry in METRICS.to_dict()["counters"].get(CACHE_REQUESTS_TOTAL, []):
+        counts.setdefault(entry["labels"]["cache"], {})[entry["labels"]["result"]] = entry["value"]
+    return counts
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def quiet_progress(current: int, total: int, filename: str) -> None:
+    pass
+
+def use_embeddings(args: argparse.Namespace, cache_path: str) -> None:
+    """Swap the shared embeddings for a fake backend over a fresh cache, so each build starts cold."""
+    def factory() -> CachedEmbeddings:
+        backend = FakeEmbeddings(request_latency=args.embedding_latency, seconds_per_text=args.embedding_seconds_per_text)
+        return CachedEmbeddings(backend, model=EMBEDDING_MODEL_NAME, cache=EmbeddingCache(cache_path))
+    registry.register("embeddings", factory)
+    registry.close("embeddings")
+
+def install_fake_backends(args: argparse.Namespace, workdir: str) -> SMTPSink:
+    """Point every shared resource at a fake backend and at scratch storage under `workdir`."""
+    chat_model = FakeChatModel(
+        first_token_latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second, answer_tokens=args.answer_tokens
+    )
+    registry.register("chat_model", lambda: chat_model)
+    use_embeddings(args, os.path.join(workdir, "embeddings.sqlite3"))
+    registry.register("tone_detector", lambda: ToneDetector(
+        fallback=GeminiToneDetector(model=FakeGenerativeModel(args.tone_latency)) if args.tone_fallback else None
+    ))
+    registry.register(
+        "chat_history", lambda: ChatHistoryManager(os.path.join(workdir, "chat_history.sqlite3")), close=ChatHistoryManager.close
+    )
+    sink = SMTPSink(latency=args.smtp_latency).start()
+
+    def outbox_factory() -> EmailOutbox:
+        outbox = EmailOutbox(
+            os.path.join(workdir, "outbox.sqlite3"),
+            connection=SMTPConnection(sink.host, sink.port, use_ssl=False),
+            sends_per_minute=60000,
+            enricher=summarize_support_conversation,
+        )
+        outbox.start()
+        return outbox
+    registry.register("email_outbox", outbox_factory, close=EmailOutbox.stop)
+    return sink
+
+def bench_startup(args: argparse.Namespace) -> Dict[str, Any]:
+    """Cold import time of each entry point in fresh interpreters, against IMPORT_BUDGETS."""
+    results = {}
+    for module, budget in IMPORT_BUDGETS.items():
+        script = (
+            "import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "seconds = time.perf_counter() - start\n"
+            f"print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))"
+        )
+        samples, loaded = [], set()
+        for _ in range(args.startup_runs):
+            completed = subprocess.run(
+                [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            run = json.loads(completed.stdout.strip().splitlines()[-1])
+            samples.append(run["seconds"])
+            loaded.update(run["loaded"])
+        timing = summarize(samples)
+        results[module] = {
+            "import_seconds": timing,
+            "budget_seconds": budget,
+            "eagerly_loaded": sorted(loaded),
+            "within_budget": timing["p50"] <= budget and not loaded,
+        }
+        logger.warning(f"startup[{module}]: {timing['p50']:.2f}s (budget {budget:.2f}s), eagerly loaded: {sorted(loaded) or 'none'}")
+    return results
+
+def bench_ingestion(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    """Extraction and embedding throughput on synthetic corpora of increasing size."""
+    results = {}
+    for size in args.sizes:
+        folder = os.path.join(workdir, f"corpus-{size}")
+        paths = write_corpus(folder, size, args.pages, seed=args.seed)
+        corpus_bytes = sum(os.path.getsize(path) for path in paths)
+        use_embeddings(args, os.path.join(workdir, f"embeddings-{size}.sqlite3"))
+        METRICS.reset()
+        start = time.perf_counter()
+        documents, company_name = process_documents(folder, quiet_progress)
+        extract_seconds = time.perf_counter() - start
+        embed_seconds = timed(create_vectorstore, documents)
+        total_seconds = extract_seconds + embed_seconds
+        results[str(size)] = {
+            "documents": size,
+            "bytes": corpus_bytes,
+            "chunks": len(documents),
+            "company_name": company_name,
+            "extract_seconds": extract_seconds,
+            "embed_seconds": embed_seconds,
+            "total_seconds": total_seconds,
+            "documents_per_second": size / total_seconds,
+            "chunks_per_second": len(documents) / total_seconds,
+            "megabytes_per_second": corpus_bytes / 1e6 / total_seconds,
+            "stages": stage_breakdown(),
+        }
+        logger.warning(f"ingestion[{size}]: {len(documents)} chunks in {total_seconds:.2f}s")
+    return results
+
+def build_knowledge_base(args: argparse.Namespace, workdir: str) -> tuple[KnowledgeBase, Dict[str, Any]]:
+    """Index the largest corpus through KnowledgeBase, timing a cold build and a no-change refresh."""
+    size = max(args.sizes)
+    folder = os.path.join(workdir, f"corpus-{size}")
+    if not os.path.isdir(folder):
+        write_corpus(folder, size, args.pages, seed=args.seed)
+    use_embeddings(args, os.path.join(workdir, "embeddings.sqlite3"))
+    knowledge_base = KnowledgeBase(folder, os.path.join(workdir, "index"))
+    build_seconds = timed(knowledge_base.refresh, quiet_progress)
+    noop_seconds = timed(knowledge_base.refresh, quiet_progress)
+    return knowledge_base, {"documents": size, "build_seconds": build_seconds, "noop_refresh_seconds": noop_seconds}
+
+def bench_retrieval(args: argparse.Namespace, knowledge_base: KnowledgeBase) -> Dict[str, Any]:
+    """Search latency per retrieval mode; each mode gets fresh queries so query embeddings start uncached."""
+    results = {}
+    for offset, mode in enumerate(("hybrid", "dense", "keyword")):
+        queries = synthetic_questions(args.queries, seed=args.seed + 1000 * (offset + 1))
+        METRICS.reset()
+        start = time.perf_counter()
+        latencies = [timed(lambda query: knowledge_base.search(query, mode=mode), query) for query in queries]
+        elapsed = time.perf_counter() - start
+        results[mode] = {
+            "latency": summarize(latencies),
+            "queries_per_second": len(queries) / elapsed,
+            "caches": cache_counts(),
+        }
+    return results
+
+def bench_history(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    """Single and batched writes, recent and full reads, session state, and mixed concurrent load."""
+    manager = ChatHistoryManager(os.path.join(workdir, "history-bench.sqlite3"))
+    rng = random.Random(args.seed)
+    sessions = [f"bench-{i}" for i in range(args.history_sessions)]
+    message = {"role": "user", "content": "How do I reset my password after enabling two-factor authentication?"}
+    results = {}
+
+    def measure(name: str, operations: List, operations_per_call: int = 1) -> None:
+        start = time.perf_counter()
+        latencies = [timed(operation) for operation in operations]
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "latency": summarize(latencies),
+            "operations_per_second": len(operations) * operations_per_call / elapsed,
+        }
+
+    try:
+        measure("write_single", [
+            lambda session=session: manager.save_chat_message(session, message["role"], message["content"])
+            for session in sessions for _ in range(args.history_messages // 2)
+        ])
+        measure("write_batch_10", [
+            lambda session=session: manager.save_chat_messages(session, [message] * 10)
+            for session in sessions for _ in range(max(1, args.history_messages // 20))
+        ], operations_per_call=10)
+        reads = [rng.choice(sessions) for _ in range(len(sessions) * 10)]
+        measure("read_recent", [
+            lambda session=session: manager.get_chat_history(session, limit=2 * MEMORY_RECENT_TURNS + 1) for session in reads
+        ])
+        measure("read_full", [lambda session=session: manager.get_chat_history(session) for session in reads[:len(sessions)]])
+        measure("session_state", [
+            lambda session=session: manager.save_session_state(session, *manager.get_session_state(session)) for session in reads
+        ])
+
+        def mixed(session: str) -> List[float]:
+            latencies = []
+            for _ in range(20):
+                latencies.append(timed(manager.save_chat_message, session, "user", message["content"]))
+                latencies.append(timed(manager.get_chat_history, session, 2 * MEMORY_RECENT_TURNS + 1))
+            return latencies
+        threads = min(32, len(sessions))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = [latency for batch in executor.map(mixed, sessions[:threads]) for latency in batch]
+        results["concurrent_mixed"] = {
+            "threads": threads,
+            "latency": summarize(latencies),
+            "operations_per_second": len(latencies) / (time.perf_counter() - start),
+        }
+    finally:
+        manager.close()
+    return results
+
+def session_script(rng: random.Random, questions: List[str], turns: int, index: int, escalate: bool) -> List[str]:
+    """Messages one simulated user sends: questions, or repeated complaints ending in a support request."""
+    if escalate:
+        return [rng.choice(questions)] + NEGATIVE_MESSAGES + [f"user{index}@example.com", "My invoice is wrong again."]
+    return [rng.choice(questions) for _ in range(turns)]
+
+def run_session(engine: HelpDeskEngine, session_id: str, script: List[str]) -> List[Dict[str, Any]]:
+    turns = []
+    for message in script:
+        start = time.perf_counter()
+        first_event = None
+        kinds = []
+        for event in engine.handle_turn(session_id, message):
+            if first_event is None and event.event in ("token", "message"):
+                first_event = time.perf_counter() - start
+            if event.event == "message":
+                kinds.append(event.data["kind"])
+        turns.append({"seconds": time.perf_counter() - start, "first_event_seconds": first_event, "kinds": kinds})
+    return turns
+
+def bench_end_to_end(args: argparse.Namespace, knowledge_base: KnowledgeBase, sink: SMTPSink) -> Dict[str, Any]:
+    """Turn latency with N sessions talking at once, through the same engine the UI and API use."""
+    results = {}
+    questions = synthetic_questions(args.question_pool, seed=args.seed)
+    for concurrency in args.concurrency:
+        registry.close("answer_cache")
+        engine = HelpDeskEngine(knowledge_base.data_folder, chat_manager=get_chat_manager(), knowledge_base=knowledge_base)
+        try:
+            rng = random.Random(args.seed + concurrency)
+            scripts = {
+                engine.new_session_id(): session_script(rng, questions, args.turns, i, rng.random() < args.escalation_rate)
+                for i in range(concurrency)
+            }
+            emails_before = sink.count
+            METRICS.reset()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                sessions = list(executor.map(lambda item: run_session(engine, *item), scripts.items()))
+            elapsed = time.perf_counter() - start
+            turns = [turn for session in sessions for turn in session]
+            answers = [turn for turn in turns if "answer" in turn["kinds"]]
+            escalations = sum(turn["kinds"].count("support_request") for turn in turns)
+
+            drain_start = time.perf_counter()
+            while sink.count - emails_before < escalations and time.perf_counter() - drain_start < 30:
+                time.sleep(0.01)
+            results[f"concurrency_{concurrency}"] = {
+                "sessions": concurrency,
+                "turns": len(turns),
+                "turn_latency": summarize([turn["seconds"] for turn in turns]),
+                "answer_latency": summarize([turn["seconds"] for turn in answers]),
+                "first_event_latency": summarize([turn["first_event_seconds"] for turn in answers]),
+                "turns_per_second": len(turns) / elapsed,
+                "errors": sum(turn["kinds"].count("error") for turn in turns),
+                "support_requests": escalations,
+                "emails_delivered": sink.count - emails_before,
+                "email_drain_seconds": time.perf_counter() - drain_start,
+                "caches": cache_counts(),
+                "stages": stage_breakdown(),
+            }
+        finally:
+            # Background memory folds write to the chat store, which the teardown closes
+            engine.close()
+        logger.warning(f"e2e[{concurrency}]: {len(turns)} turns in {elapsed:.2f}s")
+    return results
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+    }
+
+def flatten(value: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of nested results keyed by dotted path, skipping the coarse per-stage histograms."""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            if key not in ("stages", "caches"):
+                flat.update(flatten(item, f"{prefix}{key}."))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix.rstrip("."): float(value)}
+    return {}
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every latency or throughput metric that got worse than the baseline by more than `tolerance`."""
+    previous = flatten(baseline.get("results", {}))
+    regressions = []
+    for key, new in flatten(current["results"]).items():
+        old = previous.get(key)
+        if not old or old <= 0:
+            continue
+        leaf = key.rsplit(".", 1)[-1]
+        if leaf.endswith("per_second"):
+            regressed = new < old * (1 - tolerance)
+        elif leaf in ("mean", "p50", "p95", "p99") or leaf.endswith("_seconds"):
+            regressed = new > old * (1 + tolerance)
+        else:
+            continue
+        if regressed:
+            regressions.append(f"{key}: {old:.4g} -> {new:.4g} ({(new - old) / old:+.0%})")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="helpdesk-bench-", dir=args.workdir)
+    sink = install_fake_backends(args, workdir)
+    report = {
+        "schema_version": RESULTS_SCHEMA_VERSION,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "options": vars(args),
+        "results": {},
+    }
+    try:
+        if "startup" in args.only:
+            report["results"]["startup"] = bench_startup(args)
+        if "ingestion" in args.only:
+            report["results"]["ingestion"] = bench_ingestion(args, workdir)
+        if "history" in args.only:
+            report["results"]["history"] = bench_history(args, workdir)
+        if "retrieval" in args.only or "e2e" in args.only:
+            knowledge_base, index = build_knowledge_base(args, workdir)
+            report["results"]["index"] = index
+            if "retrieval" in args.only:
+                report["results"]["retrieval"] = bench_retrieval(args, knowledge_base)
+            if "e2e" in args.only:
+                report["results"]["end_to_end"] = bench_end_to_end(args, knowledge_base, sink)
+    finally:
+        registry.close_all()
+        sink.stop()
+        if args.keep_workdir:
+            print(f"Scratch data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}")
+
+    over_budget = [module for module, result in report["results"].get("startup", {}).items() if not result["within_budget"]]
+    for module in over_budget:
+        print(f"OVER BUDGET importing {module}: {report['results']['startup'][module]}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_results(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 1 if over_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
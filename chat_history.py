@@ -1,76 +1,175 @@
-import chromadb
-import uuid
-from typing import List, Dict
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, List, Dict, Optional, Tuple
 import logging
-from chromadb.config import Settings
+from resources import shared_resource
 
-from config import CHROMA_PERSIST_DIR
+from config import CHAT_HISTORY_DB_PATH
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ChatHistoryManager:
-    """Manages chat history storage and retrieval using ChromaDB."""
-    
-    def __init__(self, persist_directory: str = CHROMA_PERSIST_DIR):
-        """Initialize ChromaDB client."""
-        try:
-            self.client = chromadb.PersistentClient(
-                path=persist_directory,
-                settings=Settings(anonymized_telemetry=False)
-            )
-            self.collection = self._get_or_create_collection()
-            logger.info("ChromaDB client initialized successfully")
-        except Exception as e:
-            logger.error(f"Error initializing ChromaDB client: {e}")
-            raise
+    """Manages chat history storage and retrieval in an append-only SQLite message log."""
 
-    def _get_or_create_collection(self):
-        """Get or create a ChromaDB collection for chat history."""
-        collection_name = "chat_history"
+    def __init__(self, db_path: str = CHAT_HISTORY_DB_PATH):
+        """Open the message log, creating it if needed."""
         try:
-            # Check if collection exists
-            collections = self.client.list_collections()
-            if any(c.name == collection_name for c in collections):
-                return self.client.get_collection(collection_name)
-            return self.client.create_collection(collection_name)
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._lock = threading.Lock()
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "session_id TEXT NOT NULL, "
+                "role TEXT NOT NULL, "
+                "content TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, created_at, id)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_state ("
+                "session_id TEXT PRIMARY KEY, "
+                "state TEXT NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 0, "
+                "updated_at REAL NOT NULL)"
+            )
+            if "version" not in [column[1] for column in self.conn.execute("PRAGMA table_info(session_state)")]:
+                self.conn.execute("ALTER TABLE session_state ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_summary ("
+                "session_id TEXT PRIMARY KEY, "
+                "summary TEXT NOT NULL, "
+                "folded_until INTEGER NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            self.conn.commit()
+            logger.info("Chat history store initialized successfully")
         except Exception as e:
-            logger.error(f"Error getting or creating collection: {e}")
+            logger.error(f"Error initializing chat history store: {e}")
             raise
 
-    def generate_session_id(self) -> str:
-        """Generate a unique session ID."""
-        return str(uuid.uuid4())
-
     def save_chat_message(self, session_id: str, role: str, content: str) -> None:
-        """Save a chat message to ChromaDB."""
+        """Append a chat message to the session's history."""
+        self.save_chat_messages(session_id, [{"role": role, "content": content}])
+
+    def save_chat_messages(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        """Append several chat messages to the session's history in one transaction."""
         try:
-            message_id = str(uuid.uuid4())
-            self.collection.add(
-                documents=[content],
-                metadatas=[{"session_id": session_id, "role": role}],
-                ids=[message_id]
-            )
-            logger.info(f"Saved chat message for session {session_id}")
+            now = time.time()
+            with self._lock, self.conn:
+                self.conn.executemany(
+                    "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    [(session_id, message["role"], message["content"], now) for message in messages]
+                )
+            logger.debug(f"Saved {len(messages)} chat messages for session {session_id}")
         except Exception as e:
             logger.error(f"Error saving chat message: {e}")
             raise
 
-    def get_chat_history(self, session_id: str) -> List[Dict[str, str]]:
-        """Retrieve chat history for a given session ID."""
+    def get_chat_history(self, session_id: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, str]]:
+        """Retrieve chat history for a given session ID in chronological order.
+
+        Args:
+            session_id (str): The session to read.
+            limit (Optional[int]): Return at most this many of the newest messages (all if None).
+            offset (int): Skip this many of the newest messages first, for paging backwards.
+
+        Returns:
+            List[Dict[str, str]]: Messages with "role" and "content" keys, oldest first.
+        """
         try:
-            results = self.collection.query(
-                query_texts=[""],  # Empty query to get all documents
-                where={"session_id": session_id},
-                n_results=1000  # Adjust based on expected history size
-            )
-            history = [
-                {"role": metadata["role"], "content": doc}
-                for doc, metadata in zip(results["documents"][0], results["metadatas"][0])
-            ]
-            logger.info(f"Retrieved {len(history)} messages for session {session_id}")
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT role, content FROM messages WHERE session_id = ? "
+                    "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                    (session_id, -1 if limit is None else limit, offset)
+                ).fetchall()
+            history = [{"role": role, "content": content} for role, content in reversed(rows)]
+            logger.debug(f"Retrieved {len(history)} messages for session {session_id}")
             return history
         except Exception as e:
             logger.error(f"Error retrieving chat history: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    def get_session_state(self, session_id: str) -> Tuple[Dict[str, Any], int]:
+        """Return the session's saved conversation state (escalation flags, support requests), or {}, and its version."""
+        with self._lock:
+            row = self.conn.execute("SELECT state, version FROM session_state WHERE session_id = ?", (session_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else ({}, 0)
+
+    def save_session_state(self, session_id: str, state: Dict[str, Any], version: int) -> bool:
+        """Persist the session's conversation state so any worker process can continue the session.
+
+        The write is a compare-and-set: it only succeeds if the stored state is still at
+        `version` (0 for a session without state), so concurrent writers never lose updates.
+
+        Returns:
+            bool: True if the state was stored, False if another writer got there first.
+        """
+        with self._lock, self.conn:
+            if version:
+                cursor = self.conn.execute(
+                    "UPDATE session_state SET state = ?, version = version + 1, updated_at = ? WHERE session_id = ? AND version = ?",
+                    (json.dumps(state), time.time(), session_id, version)
+                )
+            else:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO session_state (session_id, state, version, updated_at) VALUES (?, ?, 1, ?)",
+                    (session_id, json.dumps(state), time.time())
+                )
+        return cursor.rowcount > 0
+
+    def get_messages_after(self, session_id: str, after_id: int = 0) -> List[Dict[str, Any]]:
+        """Return the session's messages stored after message `after_id`, oldest first, with their "id"."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY created_at, id",
+                (session_id, after_id)
+            ).fetchall()
+        return [{"id": message_id, "role": role, "content": content} for message_id, role, content in rows]
+
+    def get_session_summary(self, session_id: str) -> Tuple[str, int]:
+        """Return the session's conversation summary and the id of the last message it covers."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT summary, folded_until FROM session_summary WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def save_session_summary(self, session_id: str, summary: str, folded_until: int, previous_until: int) -> bool:
+        """Store a new summary unless another fold already moved the session past `previous_until`.
+
+        Returns:
+            bool: True if the summary was stored.
+        """
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE session_summary SET summary = ?, folded_until = ?, updated_at = ? "
+                "WHERE session_id = ? AND folded_until = ?",
+                (summary, folded_until, time.time(), session_id, previous_until)
+            )
+            if not cursor.rowcount and not previous_until:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO session_summary (session_id, summary, folded_until, updated_at) VALUES (?, ?, ?, ?)",
+                    (session_id, summary, folded_until, time.time())
+                )
+        return cursor.rowcount > 0
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self.conn.close()
+
+@shared_resource("chat_history", close=ChatHistoryManager.close)
+def get_chat_manager() -> ChatHistoryManager:
+    """Return the chat history store shared by every session in this process."""
+    return ChatHistoryManager()
@@ -0,0 +1,111 @@
+import re
+import logging
+from collections import Counter
+from typing import Iterable, NamedTuple
+
+from config import COMPANY_NAME_CONFIDENCE_THRESHOLD
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NAME_WORD = r"[A-Z][\w&'\-]*"
+NAME = rf"{NAME_WORD}(?:[ \t]+(?:of[ \t]+|and[ \t]+|&[ \t]+)?{NAME_WORD}){{0,3}}"
+LEGAL_SUFFIXES = r"Inc\.?|LLC|L\.L\.C\.|Ltd\.?|Limited|Corp\.?|Corporation|Co\.|GmbH|PLC|plc|S\.A\.|AG|LLP|Pty Ltd"
+LEGAL_SUFFIX_PATTERN = re.compile(rf"\b({NAME}),?[ \t]+({LEGAL_SUFFIXES})(?=\W|$)")
+BARE_LEGAL_SUFFIX_PATTERN = re.compile(rf"(?:{LEGAL_SUFFIXES})")
+INTRO_PATTERN = re.compile(
+    rf"\b(?:Welcome to|About|Thank you for choosing|Thanks for choosing|founded|Here at|At)[ \t]+({NAME})"
+)
+TITLE_NGRAM_PATTERN = re.compile(rf"\b({NAME_WORD}(?:[ \t]+{NAME_WORD}){{1,2}})\b")
+# Capitalized words that start sentences or headings rather than names.
+COMMON_WORDS = {
+    "the", "this", "that", "these", "our", "your", "we", "you", "if", "for", "please", "welcome", "about", "thank",
+    "thanks", "contact", "support", "customer", "help", "desk", "frequently", "asked", "questions", "faq", "terms",
+    "policy", "privacy", "service", "services", "table", "contents", "introduction", "overview", "chapter", "section",
+    "page", "at", "here", "in", "on", "all", "a", "an", "and", "or", "to", "of", "is", "are",
+}
+LEGAL_SUFFIX_WEIGHT = 3.0
+INTRO_WEIGHT = 2.0
+NGRAM_WEIGHT = 0.25
+
+class CompanyGuess(NamedTuple):
+    """Best local company-name candidate and how sure the heuristics are about it."""
+
+    name: str
+    confidence: float
+    source: str
+
+def clean_name(name: str) -> str:
+    words = name.split()
+    while words and words[0].lower() in COMMON_WORDS:
+        words.pop(0)
+    return " ".join(words).strip(" ,.-")
+
+class CompanyCandidates(NamedTuple):
+    """Company-name evidence from one document: strong cues and plain title-case mentions."""
+
+    cues: Counter
+    mentions: Counter
+
+    def to_dict(self) -> dict:
+        return {"cues": dict(self.cues), "mentions": dict(self.mentions)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CompanyCandidates":
+        return cls(Counter(data.get("cues", {})), Counter(data.get("mentions", {})))
+
+def score_company_candidates(text: str) -> CompanyCandidates:
+    """Find company-name candidates in a document by legal suffixes, introductions and title-case n-grams."""
+    cues: Counter = Counter()
+    mentions: Counter = Counter()
+    for match in LEGAL_SUFFIX_PATTERN.finditer(text):
+        name = clean_name(match.group(1))
+        if name:
+            cues[clean_name(f"{name} {match.group(2)}")] += LEGAL_SUFFIX_WEIGHT
+    for match in INTRO_PATTERN.finditer(text):
+        name = clean_name(match.group(1))
+        if name and name.lower() not in COMMON_WORDS:
+            cues[name] += INTRO_WEIGHT
+    for match in TITLE_NGRAM_PATTERN.finditer(text):
+        name = clean_name(match.group(1))
+        if len(name.split()) >= 2:
+            mentions[name] += NGRAM_WEIGHT
+    return CompanyCandidates(cues, mentions)
+
+def merge_candidates(candidates: Counter) -> Counter:
+    """Credit bare "Acme" mentions to "Acme Inc" so a name and its legal form do not compete."""
+    merged = Counter(candidates)
+    for name in sorted(candidates, key=len):
+        legal_forms = [
+            other for other in merged
+            if other.startswith(name + " ") and BARE_LEGAL_SUFFIX_PATTERN.fullmatch(other[len(name) + 1:])
+        ]
+        if legal_forms:
+            merged[max(legal_forms, key=merged.__getitem__)] += merged.pop(name)
+    return merged
+
+def detect_company_name(
+    candidates: Iterable[CompanyCandidates], threshold: float = COMPANY_NAME_CONFIDENCE_THRESHOLD
+) -> CompanyGuess:
+    """Combine per-document candidates into a single guess.
+
+    Confidence is the winning candidate's share of the total score, and stays
+    below the threshold unless the winner has a strong cue (legal suffix or
+    introduction) somewhere in the corpus.
+    """
+    cues: Counter = Counter()
+    totals: Counter = Counter()
+    for document in candidates:
+        cues.update(document.cues)
+        totals.update(document.cues)
+        totals.update(document.mentions)
+    totals = merge_candidates(totals)
+    if not totals:
+        return CompanyGuess("our company", 0.0, "local")
+    (name, score), = totals.most_common(1)
+    confidence = score / sum(totals.values())
+    if not any(cue == name or name.startswith(cue + " ") for cue in cues):
+        confidence = min(confidence, threshold / 2)
+    logger.info(f"Local company name guess: {name} ({confidence:.2f})")
+    return CompanyGuess(name, confidence, "local")
@@ -8,17 +8,94 @@ GOOGLE_API_KEY = os.environ["GEMINI_API_KEY"]
 # Model configurations
 GEMINI_MODEL_NAME = "gemini-2.0-flash"
 EMBEDDING_MODEL_NAME = "models/embedding-001"
+CONDENSE_QUESTION_WITH_LLM = False
+TONE_CONFIDENCE_THRESHOLD = 0.6
+TONE_CACHE_SIZE = 1024
+TONE_GEMINI_FALLBACK = False
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_TTL_SECONDS = 24 * 60 * 60
+ANSWER_CACHE_MAX_ENTRIES = 512
+MEMORY_RECENT_TURNS = 4
+MEMORY_TOKEN_BUDGET = 1500
+MEMORY_SUMMARY_MAX_WORDS = 150
+MEMORY_FOLD_WORKERS = 2  # Background threads folding old turns into session summaries
+# Every Gemini call is scheduled by llm_utils.LLMGateway; interactive calls are admitted before background ones.
+LLM_MAX_CONCURRENT_REQUESTS = 16
+LLM_REQUESTS_PER_MINUTE = 2000  # Across all models
+LLM_MODEL_LIMITS = {GEMINI_MODEL_NAME: {"requests_per_minute": 2000, "tokens_per_minute": 4_000_000}}
+LLM_DEFAULT_MODEL_LIMITS = {"requests_per_minute": 1000, "tokens_per_minute": 1_000_000}
+LLM_MAX_RETRIES = 4
+LLM_RETRY_BASE_DELAY = 1.0
+LLM_RETRY_MAX_DELAY = 30.0
 
 # App configurations
 INTRODUCTION_MESSAGE = "Hello! Welcome to the company help desk. How can I assist you today?"
 DATA_FOLDER = "data"
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+RETRIEVAL_MODE = "hybrid"
+RETRIEVAL_K = 4
+RETRIEVAL_FETCH_K = 20
+RETRIEVAL_USE_MMR = False
+RETRIEVAL_MMR_LAMBDA = 0.5
+RETRIEVAL_RRF_K = 60
+RETRIEVAL_RERANK = True
+EXTRACTION_WORKERS = os.cpu_count() or 1
+EXTRACTION_MAX_FILE_BYTES = 500 * 1024 * 1024  # Larger files are skipped and reported
+EXTRACTION_MAX_SECONDS_PER_FILE = 600  # Extraction stops at the next page boundary and keeps what it has
+EXTRACTION_MAX_SECTION_CHARS = 64_000  # Long DOCX sections and TXT pages are split into pieces of about this size
+EXTRACTION_CHUNK_BATCH = 256  # Chunks passed from extraction workers to the embedder at a time
+COMPANY_NAME_CONFIDENCE_THRESHOLD = 0.6
+COMPANY_NAME_LLM_SNIPPETS = 3
+COMPANY_NAME_SNIPPET_CHARS = 600
 PAGE_TITLE = "Company Help Desk"
 PAGE_ICON = "🏢"
 CSS_FILE = "style.css"
-CHROMA_PERSIST_DIR = "chroma_db"
+CHAT_HISTORY_DB_PATH = "chat_history.sqlite3"
+CHAT_HISTORY_PAGE_SIZE = 50  # Messages shown when a session opens and loaded per "Load older messages"
+INDEX_DIR = "faiss_index"
+# The web app only loads indexes published by `python ingest.py`; set to build on startup instead (development).
+INDEX_BUILD_IN_APP = os.getenv("INDEX_BUILD_IN_APP", "false").lower() == "true"
+INDEX_RELOAD_INTERVAL_SECONDS = 60
+# Publishing keeps this many previously published versions for `ingest.py publish VERSION` rollbacks. Other
+# versions are deleted only after they have been out of use this long, so every worker has moved off them.
+INDEX_KEEP_VERSIONS = 3
+INDEX_PRUNE_GRACE_SECONDS = 60 * 60
+# Serve searches from a compressed index ("fp16", "int8" or "ivfpq") and re-score the top candidates against the
+# memory-mapped float32 vectors, instead of holding every float32 vector in RAM ("none").
+INDEX_QUANTIZATION = os.getenv("INDEX_QUANTIZATION", "none").lower()
+INDEX_RESCORE_FACTOR = 4  # Candidates fetched from the compressed index per result
+INDEX_IVF_NPROBE = 16
+INDEX_PQ_SUBQUANTIZERS = 96  # Rounded down to a divisor of the embedding dimension
+# Load the index and model clients in the background as soon as the app starts, instead of on the first question.
+WARM_UP_ON_START = os.getenv("WARM_UP_ON_START", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = "cache/embeddings.sqlite3"
+EMBEDDING_BATCH_SIZE = 100
+EMBEDDING_CONCURRENCY = 4
+EMBEDDING_REQUESTS_PER_MINUTE = 1500
+EMBEDDING_MAX_RETRIES = 5
+QUERY_EMBEDDING_CACHE_SIZE = 1024  # User questions are only cached in memory, never on disk
 GMAIL_SENDER_EMAIL = os.environ["EMAIL_SENDER"]
 GMAIL_APP_PASSWORD = os.environ["EMAIL_PASSWORD"]
 EMAIL_RECIPIENT = os.environ["EMAIL_RECIPIENT"]
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_USE_SSL = os.environ.get("SMTP_USE_SSL", "true").lower() == "true"
+SMTP_IDLE_TIMEOUT_SECONDS = 60
+OUTBOX_DB_PATH = "outbox.sqlite3"
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_SEND_LEASE_SECONDS = 300
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+API_TURN_THREADS = 32
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+METRICS_TRACE_LOG_PATH = os.getenv("METRICS_TRACE_LOG_PATH", "logs/traces.jsonl")
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+EMAIL_SENDS_PER_MINUTE = 20
+SUPPORT_TICKET_SUMMARY = True
+SUPPORT_TICKET_CONTEXT_MESSAGES = 20
+SUPPORT_STATUS_POLL_SECONDS = 5  # How often the UI checks queued support emails for delivery
 
@@ -0,0 +1,135 @@
+import logging
+from typing import Any, Dict, List, Optional
+from langchain.prompts import PromptTemplate
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+
+from metrics import record_tokens, span
+
+from config import MEMORY_RECENT_TURNS, MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_MAX_WORDS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = PromptTemplate(
+    template=(
+        "Progressively summarize a help-desk conversation. Fold the new lines into the existing summary, "
+        "keeping the user's goals, details they provided, answers already given and anything still unresolved. "
+        "Use at most {max_words} words.\n\n"
+        "Existing summary:\n{summary}\n\n"
+        "New lines of conversation:\n{new_lines}\n\n"
+        "Updated summary:"
+    ),
+    input_variables=["max_words", "summary", "new_lines"]
+)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (about four characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+class RollingSummaryMemory:
+    """Conversation memory bounded by a token budget.
+
+    The last `max_recent_turns` turns are kept verbatim. Turns that fall out of that
+    window, or that push the history over `token_budget`, are set aside in `pending`
+    and folded into a rolling summary by `fold`, which only sends the previous summary
+    and the evicted turns to the LLM. Recording a turn never calls the LLM, so the
+    fold can run after the reply has been sent.
+    """
+
+    def __init__(
+        self,
+        llm,
+        max_recent_turns: int = MEMORY_RECENT_TURNS,
+        token_budget: int = MEMORY_TOKEN_BUDGET,
+        summary_max_words: int = MEMORY_SUMMARY_MAX_WORDS,
+        memory_key: str = "chat_history"
+    ):
+        self.llm = llm
+        self.max_recent_turns = max_recent_turns
+        self.token_budget = token_budget
+        self.summary_max_words = summary_max_words
+        self.memory_key = memory_key
+        self.summary = ""
+        self.turns: List[tuple[str, str]] = []
+        self.pending: List[tuple[str, str]] = []
+        # Id of the newest stored message in `pending`, when seeded from messages with ids.
+        self.pending_until: Optional[int] = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """The summary (if any) followed by the verbatim recent turns."""
+        messages: List[BaseMessage] = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        for question, answer in self.turns:
+            messages.append(HumanMessage(content=question))
+            messages.append(AIMessage(content=answer))
+        return messages
+
+    def token_count(self) -> int:
+        """Estimated tokens the history contributes to each prompt."""
+        return estimate_tokens(get_buffer_string(self.messages))
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, List[BaseMessage]]:
+        return {self.memory_key: self.messages}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Record a turn, setting the oldest turns aside for folding if over the limits."""
+        self.turns.append((inputs["question"], outputs["answer"]))
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self.turns) > self.max_recent_turns or (len(self.turns) > 1 and self.token_count() > self.token_budget):
+            self.pending.append(self.turns.pop(0))
+
+    def fold(self) -> bool:
+        """Fold the pending turns into the summary. Returns True if there was anything to fold."""
+        if not self.pending:
+            return False
+        try:
+            self.summary = self._summarize(self.pending)
+        except Exception as e:
+            # Keep the pending turns so a later fold can retry them.
+            logger.error(f"Error summarizing conversation history: {e}")
+            return False
+        self.pending = []
+        return True
+
+    def _summarize(self, evicted: List[tuple[str, str]]) -> str:
+        new_lines = get_buffer_string([
+            message for question, answer in evicted for message in (HumanMessage(content=question), AIMessage(content=answer))
+        ])
+        prompt = SUMMARY_PROMPT.format(max_words=self.summary_max_words, summary=self.summary or "(none)", new_lines=new_lines)
+        with span("memory_summary"):
+            summary = self.llm.invoke(prompt).content.strip()
+        record_tokens("memory_summary", estimate_tokens(prompt), estimate_tokens(summary))
+        logger.info(f"Folded {len(evicted)} turns into the conversation summary ({estimate_tokens(summary)} tokens)")
+        return summary
+
+    def seed(self, history: Optional[List[Dict[str, Any]]]) -> None:
+        """Load a stored conversation: the most recent turns verbatim, older ones as pending.
+
+        Messages may carry their stored "id"; `pending_until` is then the id of the
+        newest message set aside, i.e. how far a fold of `pending` reaches.
+        """
+        turns = []
+        question = None
+        self.pending_until = None
+        for message in history or []:
+            if message["role"] == "user":
+                question = message["content"]
+            elif question is not None:
+                turns.append((question, message["content"], message.get("id")))
+                question = None
+        self.turns = [(question, answer) for question, answer, _ in turns]
+        self.pending = []
+        self._evict()
+        if self.pending:
+            self.pending_until = turns[len(self.pending) - 1][2]
+
+    def clear(self) -> None:
+        self.summary = ""
+        self.turns = []
+        self.pending = []
+        self.pending_until = None
@@ -1,78 +1,446 @@
 import os
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
+import time
+import pickle
+import zipfile
+import tempfile
+from xml.etree import ElementTree
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, NamedTuple, Optional
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-import streamlit as st
+from langchain.schema import Document
 import logging
 from llm_utils import extract_company_name  # Import here to avoid circular imports
+from metrics import record_duration, span
+from resources import shared_resource
+from company_detector import CompanyCandidates, CompanyGuess, detect_company_name, score_company_candidates
+from embedding_service import CachedEmbeddings
+
+from config import (
+    GOOGLE_API_KEY, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME, EXTRACTION_WORKERS,
+    EXTRACTION_MAX_FILE_BYTES, EXTRACTION_MAX_SECONDS_PER_FILE, EXTRACTION_MAX_SECTION_CHARS, EXTRACTION_CHUNK_BATCH,
+    COMPANY_NAME_CONFIDENCE_THRESHOLD, COMPANY_NAME_LLM_SNIPPETS, COMPANY_NAME_SNIPPET_CHARS
+)
 
-from config import GOOGLE_API_KEY, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_document_text(file_path: str) -> str:
-    """Extract text from a document file (PDF, DOCX, or TXT)."""
-    text = ""
+if TYPE_CHECKING:
+    from langchain.vectorstores import FAISS
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+class Page(NamedTuple):
+    """A page (PDF), section (DOCX) or form-feed page (TXT) of extracted text.
+
+    DOCX sections and TXT pages longer than EXTRACTION_MAX_SECTION_CHARS are split at
+    paragraph or line boundaries; a TXT page's pieces share its page number.
+    """
+
+    number: Optional[int]
+    text: str
+    headings: list[tuple[int, str]]  # (character offset in text, heading)
+
+class ExtractedDocument(NamedTuple):
+    """Chunks produced from one file, plus its opening text and local company-name candidates.
+
+    The chunks are spooled to a temporary file in batches rather than held in memory;
+    read them back with `iter_chunk_batches` and remove the file with `discard`.
+    """
+
+    file_path: str
+    chunk_file: Optional[str]
+    chunk_count: int
+    preview: str
+    company_candidates: CompanyCandidates
+    seconds: float = 0.0
+    problems: tuple[str, ...] = ()  # Skipped pages, limits hit, or why the file could not be read
+
+    @classmethod
+    def failed(cls, file_path: str, error: Exception) -> "ExtractedDocument":
+        return cls(file_path, None, 0, "", CompanyCandidates(Counter(), Counter()), problems=(f"Could not read file: {error}",))
+
+    def iter_chunk_batches(self) -> Iterator[list[Document]]:
+        """Read the spooled chunks back, at most EXTRACTION_CHUNK_BATCH at a time."""
+        if self.chunk_file is None:
+            return
+        with open(self.chunk_file, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def discard(self) -> None:
+        """Delete the spooled chunks."""
+        if self.chunk_file is not None:
+            try:
+                os.remove(self.chunk_file)
+            except OSError:
+                pass
+
+def is_heading(line: str) -> bool:
+    """Heuristic for heading lines in text without style information."""
+    stripped = line.strip()
+    if not stripped or len(stripped) > 80 or stripped[-1] in ".,;:" or len(stripped.split()) > 10:
+        return False
+    if stripped.startswith("#"):
+        return True
+    letters = [ch for ch in stripped if ch.isalpha()]
+    if letters and all(ch.isupper() for ch in letters) and len(letters) >= 3:
+        return True
+    words = [word for word in stripped.split() if word[0].isalpha()]
+    return len(words) >= 2 and all(word[0].isupper() for word in words if len(word) > 3)
+
+def find_headings(text: str) -> list[tuple[int, str]]:
+    """Locate heading-like lines in extracted text."""
+    headings = []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        if is_heading(line):
+            headings.append((offset, line.strip().lstrip("#").strip()))
+        offset += len(line)
+    return headings
+
+def docx_style_names(archive: zipfile.ZipFile) -> dict[str, str]:
+    """Map paragraph style ids to style names from a DOCX file's (small) styles part."""
     try:
-        if file_path.endswith(".pdf"):
-            with open(file_path, "rb") as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() or ""
-        elif file_path.endswith(".docx"):
-            document = DocxDocument(file_path)
-            for paragraph in document.paragraphs:
-                text += paragraph.text + "\n"
-        elif file_path.endswith(".txt"):
-            with open(file_path, "r", encoding="utf-8") as txt_file:
-                text = txt_file.read()
-    except Exception as e:
-        logger.error(f"Error reading file '{file_path}': {e}")
-        st.error(f"Error reading file '{file_path}': {e}")
-    return text
-
-def process_documents(data_folder: str) -> tuple[str, str]:
-    """Process all documents in the data folder and extract the company name."""
-    
-
-    all_text = ""
-    company_names = set()
-    
-    for filename in os.listdir(data_folder):
-        file_path = os.path.join(data_folder, filename)
-        if filename.endswith((".pdf", ".docx", ".txt")):
-            text = get_document_text(file_path)
-            all_text += text + "\n\n"
-            company_name = extract_company_name(text)
-            if company_name.lower() not in ["", "company", "organization"]:
-                company_names.add(company_name)
-    
-    if company_names:
-        company_name = max(company_names, key=len)
-    else:
-        company_name = "our company"
-    
-    logger.info(f"Extracted company name: {company_name}")
-    return all_text, company_name
-
-def create_text_chunks(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> list[str]:
-    """Split text into chunks for vectorstore creation."""
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    chunks = text_splitter.split_text(text)
-    return chunks
-
-def create_vectorstore(text_chunks: list[str]) -> FAISS:
-    """Create a FAISS vectorstore from text chunks."""
+        root = ElementTree.fromstring(archive.read("word/styles.xml"))
+    except KeyError:
+        return {}
+    names = {}
+    for style in root.iter(f"{WORD_NAMESPACE}style"):
+        name = style.find(f"{WORD_NAMESPACE}name")
+        style_id = style.get(f"{WORD_NAMESPACE}styleId", "")
+        names[style_id] = name.get(f"{WORD_NAMESPACE}val", style_id) if name is not None else style_id
+    return names
+
+def docx_paragraph_text(paragraph: ElementTree.Element) -> str:
+    """Text of a w:p element, with tabs and line breaks mapped the way python-docx does."""
+    parts = []
+    for child in paragraph:
+        if child.tag == f"{WORD_NAMESPACE}r":
+            runs = [child]
+        elif child.tag == f"{WORD_NAMESPACE}hyperlink":
+            runs = child.findall(f"{WORD_NAMESPACE}r")
+        else:
+            continue
+        for run in runs:
+            for element in run:
+                tag = element.tag[len(WORD_NAMESPACE):]
+                if tag == "t":
+                    parts.append(element.text or "")
+                elif tag in ("tab", "ptab"):
+                    parts.append("\t")
+                elif tag == "cr" or (tag == "br" and element.get(f"{WORD_NAMESPACE}type", "textWrapping") == "textWrapping"):
+                    parts.append("\n")
+                elif tag == "noBreakHyphen":
+                    parts.append("-")
+    return "".join(parts)
+
+def iter_docx_paragraphs(file_path: str) -> Iterator[tuple[str, str]]:
+    """Stream (style name, text) for each body paragraph of a DOCX file.
+
+    The document XML is parsed incrementally and each body element is discarded once
+    read, so memory stays flat however long the document is.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        styles = docx_style_names(archive)
+        with archive.open("word/document.xml") as part:
+            depth = 0
+            body = None
+            for event, element in ElementTree.iterparse(part, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if depth == 2 and element.tag == f"{WORD_NAMESPACE}body":
+                        body = element
+                    continue
+                depth -= 1
+                if depth != 2 or body is None:
+                    continue
+                if element.tag == f"{WORD_NAMESPACE}p":
+                    style = element.find(f"{WORD_NAMESPACE}pPr/{WORD_NAMESPACE}pStyle")
+                    style_id = style.get(f"{WORD_NAMESPACE}val", "") if style is not None else ""
+                    yield styles.get(style_id, style_id), docx_paragraph_text(element)
+                body.clear()
+
+def iter_document_pages(
+    file_path: str,
+    problems: Optional[List[str]] = None,
+    max_bytes: int = EXTRACTION_MAX_FILE_BYTES,
+    max_seconds: float = EXTRACTION_MAX_SECONDS_PER_FILE,
+) -> Iterator[Page]:
+    """Yield a document's text page by page so a whole file is never held as one string.
+
+    Unreadable PDF pages are skipped and, like stopping early at the time limit,
+    reported in `problems`. The limit is checked before each page is parsed, so every
+    parsed page is kept. Files over the size limit raise ValueError unread.
+    Parsers are imported per file type, so a folder without PDFs never loads PyPDF2.
+    """
+    problems = problems if problems is not None else []
+    size = os.path.getsize(file_path)
+    if size > max_bytes:
+        raise ValueError(f"File is {size:,} bytes, over the {max_bytes:,}-byte extraction limit")
+    deadline = time.monotonic() + max_seconds
+    pages = _iter_pages(file_path, problems)
+    last = None
+    try:
+        while True:
+            if time.monotonic() > deadline:
+                if last is None:
+                    where = "before the first page"
+                else:
+                    where = f"after page {last.number}" if last.number is not None else "after a section"
+                problems.append(f"Stopped {where}: over the {max_seconds:.0f}s extraction limit")
+                return
+            last = next(pages, None)
+            if last is None:
+                return
+            yield last
+    finally:
+        pages.close()
+
+def _iter_pages(file_path: str, problems: List[str], max_chars: int = EXTRACTION_MAX_SECTION_CHARS) -> Iterator[Page]:
+    if file_path.endswith(".pdf"):
+        from PyPDF2 import PdfReader
+
+        with open(file_path, "rb") as pdf_file:
+            pdf_reader = PdfReader(pdf_file)
+            for number in range(1, len(pdf_reader.pages) + 1):
+                try:
+                    text = pdf_reader.pages[number - 1].extract_text() or ""
+                except Exception as e:
+                    problems.append(f"Skipped page {number}: {e}")
+                    text = ""
+                yield Page(number, text, find_headings(text))
+    elif file_path.endswith(".docx"):
+        parts: list[str] = []
+        headings: list[tuple[int, str]] = []
+        size = 0
+        for style, text in iter_docx_paragraphs(file_path):
+            # Start a new section at each heading so sections stay small and well labelled.
+            is_heading_style = style.lower().startswith(("heading", "title")) and text.strip()
+            if parts and (is_heading_style or size >= max_chars):
+                yield Page(None, "".join(parts), headings)
+                parts, headings, size = [], [], 0
+            if is_heading_style:
+                headings.append((size, text.strip()))
+            parts.append(text + "\n")
+            size += len(text) + 1
+        if parts:
+            yield Page(None, "".join(parts), headings)
+    elif file_path.endswith(".txt"):
+        with open(file_path, "r", encoding="utf-8", newline="") as txt_file:
+            number = 1
+            pending = ""
+            # Read fixed-size blocks rather than lines, so a file without line breaks is still split.
+            for block in iter(lambda: txt_file.read(max_chars), ""):
+                pending += block
+                pages = pending.split("\f")
+                for text in pages[:-1]:
+                    text += "\f"
+                    yield Page(number, text, find_headings(text))
+                    number += 1
+                pending = pages[-1]
+                while len(pending) >= max_chars:
+                    # Cut an over-long page at its last line break (or anywhere, if it has none).
+                    cut = pending.rfind("\n", 0, max_chars) + 1 or max_chars
+                    text, pending = pending[:cut], pending[cut:]
+                    yield Page(number, text, find_headings(text))
+            if pending:
+                yield Page(number, pending, find_headings(pending))
+
+def iter_document_chunks(
+    file_path: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP, problems: Optional[List[str]] = None
+) -> Iterator[Document]:
+    """Split a document page by page, yielding chunks that never straddle pages or files.
+
+    Each chunk carries its source file, page, nearest preceding heading and the
+    UTF-8 byte offsets of the chunk within the document's extracted text (the
+    file itself for TXT).
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    source = os.path.basename(file_path)
+    page_byte_offset = 0
+    current_heading = ""
+    for page in iter_document_pages(file_path, problems):
+        heading_offsets = [offset for offset, _ in page.headings]
+        position = 0
+        position_bytes = 0
+        for chunk in text_splitter.create_documents([page.text]):
+            start = chunk.metadata.get("start_index", -1)
+            if start < 0:
+                start = position
+            if start >= position:
+                position_bytes += len(page.text[position:start].encode("utf-8"))
+            else:
+                position_bytes = len(page.text[:start].encode("utf-8"))
+            position = start
+            heading_index = bisect_right(heading_offsets, start) - 1
+            heading = page.headings[heading_index][1] if heading_index >= 0 else current_heading
+            start_byte = page_byte_offset + position_bytes
+            yield Document(
+                page_content=chunk.page_content,
+                metadata={
+                    "source": source,
+                    "page": page.number,
+                    "heading": heading,
+                    "start_byte": start_byte,
+                    "end_byte": start_byte + len(chunk.page_content.encode("utf-8")),
+                }
+            )
+        if page.headings:
+            current_heading = page.headings[-1][1]
+        page_byte_offset += len(page.text.encode("utf-8"))
+
+def extract_document(file_path: str, batch_size: int = EXTRACTION_CHUNK_BATCH) -> ExtractedDocument:
+    """Chunk one document, raising on parse errors. Runs inside extraction worker processes.
+
+    Chunks are written to a temporary spool file a batch at a time, so neither the worker
+    nor the parent ever holds a whole document's chunks.
+    """
+    start = time.perf_counter()
+    problems: List[str] = []
+    preview = ""
+    count = 0
+    fd, chunk_file = tempfile.mkstemp(prefix="chunks-", suffix=".pkl")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            batch: list[Document] = []
+            for chunk in iter_document_chunks(file_path, problems=problems):
+                if not count:
+                    preview = chunk.page_content
+                batch.append(chunk)
+                count += 1
+                if len(batch) >= batch_size:
+                    pickle.dump(batch, spool, pickle.HIGHEST_PROTOCOL)
+                    batch = []
+            if batch:
+                pickle.dump(batch, spool, pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(chunk_file)
+        raise
+    return ExtractedDocument(
+        file_path, chunk_file, count, preview, score_company_candidates(preview), time.perf_counter() - start, tuple(problems)
+    )
+
+def log_progress(done: int, total: int, file_path: str) -> None:
+    """Default progress callback for document extraction."""
+    logger.info(f"Extracted {done}/{total}: {file_path}")
+
+def report_problems(extracted: ExtractedDocument) -> None:
+    """Log what was skipped while extracting a file that was otherwise read."""
+    for problem in extracted.problems:
+        logger.warning(f"'{extracted.file_path}': {problem}")
+
+def extract_documents(
+    file_paths: list[str],
+    max_workers: int = EXTRACTION_WORKERS,
+    progress_callback: Callable[[int, int, str], None] = log_progress,
+) -> Iterator[ExtractedDocument]:
+    """Chunk documents in a process pool, yielding each file's result as it finishes."""
+    total = len(file_paths)
+    if max_workers <= 1 or total <= 1:
+        for done, file_path in enumerate(file_paths, 1):
+            try:
+                extracted = extract_document(file_path)
+                report_problems(extracted)
+            except Exception as e:
+                logger.error(f"Error reading file '{file_path}': {e}")
+                extracted = ExtractedDocument.failed(file_path, e)
+            record_duration("extract", extracted.seconds, file=os.path.basename(file_path), chunks=extracted.chunk_count)
+            progress_callback(done, total, file_path)
+            yield extracted
+        return
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, total)) as executor:
+        futures = {executor.submit(extract_document, file_path): file_path for file_path in file_paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            file_path = futures[future]
+            try:
+                extracted = future.result()
+                report_problems(extracted)
+            except Exception as e:
+                logger.error(f"Error reading file '{file_path}': {e}")
+                extracted = ExtractedDocument.failed(file_path, e)
+            record_duration("extract", extracted.seconds, file=os.path.basename(file_path), chunks=extracted.chunk_count)
+            progress_callback(done, total, file_path)
+            yield extracted
+
+def extract_all_documents(
+    file_paths: list[str],
+    progress_callback: Callable[[int, int, str], None] = log_progress,
+    max_workers: int = EXTRACTION_WORKERS,
+) -> dict[str, ExtractedDocument]:
+    """Chunk every document, keyed by file path.
+
+    The "extraction" stage times the whole batch; each file is also recorded as an "extract" stage.
+    """
+    with span("extraction", files=len(file_paths)):
+        return {
+            extracted.file_path: extracted
+            for extracted in extract_documents(file_paths, max_workers=max_workers, progress_callback=progress_callback)
+        }
+
+def representative_snippets(documents: Iterable[ExtractedDocument], limit: int = COMPANY_NAME_LLM_SNIPPETS) -> list[str]:
+    """Opening text of the documents with the strongest company-name cues."""
+    ranked = sorted((doc for doc in documents if doc.preview), key=lambda doc: sum(doc.company_candidates.cues.values()) + sum(doc.company_candidates.mentions.values()), reverse=True)
+    return [doc.preview[:COMPANY_NAME_SNIPPET_CHARS] for doc in ranked[:limit]]
+
+def resolve_company_name(
+    candidates: Iterable[CompanyCandidates],
+    snippets: list[str],
+    threshold: float = COMPANY_NAME_CONFIDENCE_THRESHOLD,
+) -> CompanyGuess:
+    """Use the local guess when it is confident; otherwise ask the LLM once about a few snippets."""
+    guess = detect_company_name(candidates, threshold)
+    if guess.confidence >= threshold or not snippets:
+        return guess
+    logger.info(f"Local company name guess not confident; asking the LLM about {len(snippets)} snippets")
+    return CompanyGuess(extract_company_name(snippets), 1.0, "llm")
+
+def process_documents(data_folder: str, progress_callback: Callable[[int, int, str], None] = log_progress) -> tuple[list[Document], str]:
+    """Chunk all documents in the data folder and extract the company name."""
+    file_paths = [
+        os.path.join(data_folder, filename)
+        for filename in sorted(os.listdir(data_folder))
+        if filename.endswith(SUPPORTED_EXTENSIONS)
+    ]
+    extracted = extract_all_documents(file_paths, progress_callback)
+    documents = []
+    for file_path in file_paths:
+        for batch in extracted[file_path].iter_chunk_batches():
+            documents.extend(batch)
+        extracted[file_path].discard()
+
+    company = resolve_company_name(
+        (doc.company_candidates for doc in extracted.values()), representative_snippets(extracted.values())
+    )
+    logger.info(f"Extracted company name: {company.name} ({company.source})")
+    return documents, company.name
+
+@shared_resource("embeddings")
+def get_embeddings() -> CachedEmbeddings:
+    """Return the cached, rate-limited embedding client used to build and query vectorstores."""
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    backend = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=GOOGLE_API_KEY)
+    return CachedEmbeddings(backend, model=EMBEDDING_MODEL_NAME)
+
+def create_vectorstore(documents: list[Document]) -> "FAISS":
+    """Create a FAISS vectorstore from chunk documents, keeping their metadata."""
+    from langchain.vectorstores import FAISS
+
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=GOOGLE_API_KEY)
-        vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
+        embeddings = get_embeddings()
+        with span("embed", chunks=len(documents)):
+            vectorstore = FAISS.from_documents(documents=documents, embedding=embeddings)
         logger.info("Vectorstore created successfully")
         return vectorstore
     except Exception as e:
         logger.error(f"Error creating vectorstore: {e}")
-        st.error(f"Error creating vectorstore: {e}")
         raise
\ No newline at end of file
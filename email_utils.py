@@ -1,44 +1,321 @@
+import os
+import re
+import time
 import smtplib
+import sqlite3
+import threading
 import logging
 from email.mime.text import MIMEText
-from config import GMAIL_SENDER_EMAIL, GMAIL_APP_PASSWORD,EMAIL_RECIPIENT
+from typing import Callable, Dict, List, Optional
+from resources import shared_resource
+from rate_limiter import TokenBucket, backoff_delay
+from config import (
+    GMAIL_SENDER_EMAIL, GMAIL_APP_PASSWORD, EMAIL_RECIPIENT, SMTP_HOST, SMTP_PORT, SMTP_USE_SSL,
+    SMTP_IDLE_TIMEOUT_SECONDS, OUTBOX_DB_PATH, OUTBOX_MAX_ATTEMPTS, OUTBOX_SEND_LEASE_SECONDS,
+    EMAIL_SENDS_PER_MINUTE, SUPPORT_TICKET_SUMMARY
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def send_support_email(user_email: str, user_concern: str, recipient_email: str = EMAIL_RECIPIENT) -> dict:
+EMAIL_PATTERN = re.compile(r"^[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}$")
+
+def is_valid_email(address: str) -> bool:
+    """Validate an email address locally."""
+    return bool(EMAIL_PATTERN.match(address.strip()))
+
+def build_support_message(
+    user_email: str,
+    user_concern: str,
+    recipient_email: str = EMAIL_RECIPIENT,
+    summary: Optional[str] = None
+) -> MIMEText:
+    """Build the support-team email for a user's concern."""
+    subject = f"Support Request from {user_email}"
+    body = f"User Email: {user_email}\n\nConcern:\n{user_concern}"
+    if summary:
+        body += f"\n\nConversation Summary:\n{summary}"
+    msg = MIMEText(body)
+    msg["Subject"] = subject
+    msg["From"] = GMAIL_SENDER_EMAIL
+    msg["To"] = recipient_email
+    return msg
+
+class SMTPConnection:
+    """A logged-in SMTP connection that is kept alive between messages and reopened when stale."""
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, use_ssl: bool = SMTP_USE_SSL, idle_timeout: float = SMTP_IDLE_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.idle_timeout = idle_timeout
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP_SSL(self.host, self.port) if self.use_ssl else smtplib.SMTP(self.host, self.port)
+        # Local stand-ins such as aiosmtpd do not offer AUTH.
+        if server.has_extn("auth") and GMAIL_APP_PASSWORD:
+            server.login(GMAIL_SENDER_EMAIL, GMAIL_APP_PASSWORD)
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return server
+
+    def _is_alive(self) -> bool:
+        if self._server is None or time.monotonic() - self._last_used > self.idle_timeout:
+            return False
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+
+    def send(self, msg: MIMEText) -> None:
+        """Send a message, reusing the open connection when it is still healthy."""
+        if not self._is_alive():
+            self.close()
+            self._server = self._connect()
+        try:
+            self._server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # The server dropped the idle connection; retry once on a fresh one.
+            self.close()
+            self._server = self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+class EmailOutbox:
+    """Durable SQLite queue of support emails drained by a background worker.
+
+    Requests are persisted before the UI returns, so a slow SMTP server or a
+    restart never loses an escalation. The worker sends over a single reused
+    connection, rate-limits deliveries and retries failures with backoff.
     """
-    Sends an email to the support team with the user's concern.
+
+    def __init__(
+        self,
+        db_path: str = OUTBOX_DB_PATH,
+        connection: Optional[SMTPConnection] = None,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        sends_per_minute: float = EMAIL_SENDS_PER_MINUTE,
+        enricher: Optional[Callable[[str, str], str]] = None,
+    ):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = connection or SMTPConnection()
+        self.max_attempts = max_attempts
+        self.enricher = enricher
+        self.rate_limiter = TokenBucket(rate=sends_per_minute / 60.0, capacity=max(1.0, sends_per_minute / 10.0))
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "session_id TEXT, "
+                "user_email TEXT NOT NULL, "
+                "user_concern TEXT NOT NULL, "
+                "recipient_email TEXT NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "next_attempt_at REAL NOT NULL, "
+                "last_error TEXT, "
+                "created_at REAL NOT NULL, "
+                "sent_at REAL, "
+                "conversation TEXT, "
+                "summary TEXT)"
+            )
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+            for column in ("conversation", "summary"):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+
+    def enqueue(
+        self,
+        user_email: str,
+        user_concern: str,
+        recipient_email: str = EMAIL_RECIPIENT,
+        session_id: Optional[str] = None,
+        conversation: Optional[str] = None
+    ) -> int:
+        """Persist a support request for delivery and return its outbox ID.
+
+        If a conversation transcript is given and the outbox has an enricher, the
+        worker adds a summary of it to the ticket before sending.
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (session_id, user_email, user_concern, recipient_email, next_attempt_at, created_at, conversation) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, user_email, user_concern, recipient_email, now, now, conversation)
+            )
+        self._wake.set()
+        logger.info(f"Queued support email {cursor.lastrowid} from {user_email}")
+        return cursor.lastrowid
+
+    def get_status(self, job_ids: List[int]) -> Dict[int, Dict[str, object]]:
+        """Return status, attempts and last error for the given outbox IDs."""
+        if not job_ids:
+            return {}
+        placeholders = ",".join("?" * len(job_ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id, status, attempts, last_error FROM outbox WHERE id IN ({placeholders})", list(job_ids)
+            ).fetchall()
+        return {row[0]: {"status": row[1], "attempts": row[2], "last_error": row[3]} for row in rows}
+
+    def _claim_due(self) -> Optional[tuple]:
+        """Lease the next due message. Several processes may share the outbox, so the claim is a compare-and-set.
+
+        A message whose sender died mid-send becomes due again once its lease expires.
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT id, user_email, user_concern, recipient_email, attempts, conversation, summary, status FROM outbox "
+                "WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = self.conn.execute(
+                "UPDATE outbox SET status = 'sending', next_attempt_at = ? WHERE id = ? AND status = ? AND next_attempt_at <= ?",
+                (now + OUTBOX_SEND_LEASE_SECONDS, row[0], row[7], now)
+            ).rowcount
+        return row[:7] if claimed else None
+
+    def _seconds_until_next_due(self) -> Optional[float]:
+        with self._lock:
+            row = self.conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def process_one(self) -> bool:
+        """Deliver the next due message, if any. Returns True if a message was attempted."""
+        row = self._claim_due()
+        if row is None:
+            return False
+        job_id, user_email, user_concern, recipient_email, attempts, conversation, summary = row
+        if summary is None and conversation and self.enricher is not None:
+            summary = self._enrich(job_id, user_concern, conversation)
+        self.rate_limiter.acquire()
+        try:
+            self.connection.send(build_support_message(user_email, user_concern, recipient_email, summary))
+        except Exception as e:
+            attempts += 1
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            retry_at = time.time() + backoff_delay(attempts, base_delay=5.0, max_delay=600.0)
+            with self._lock, self.conn:
+                self.conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (status, attempts, retry_at, str(e), job_id)
+                )
+            logger.error(f"Error sending support email {job_id} (attempt {attempts}): {e}")
+            return True
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL WHERE id = ?",
+                (attempts + 1, time.time(), job_id)
+            )
+        logger.info(f"Support email {job_id} sent to {recipient_email}")
+        return True
+
+    def _enrich(self, job_id: int, user_concern: str, conversation: str) -> str:
+        """Summarize the conversation for the ticket once; retries reuse the stored summary."""
+        try:
+            summary = self.enricher(user_concern, conversation)
+        except Exception as e:
+            logger.error(f"Error summarizing conversation for support email {job_id}: {e}")
+            summary = ""
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE outbox SET summary = ? WHERE id = ?", (summary, job_id))
+        return summary
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.process_one():
+                    continue
+                self.connection.close_if_idle()
+                wait = self._seconds_until_next_due()
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {e}")
+                wait = 5.0
+            self._wake.wait(timeout=min(wait, SMTP_IDLE_TIMEOUT_SECONDS) if wait is not None else SMTP_IDLE_TIMEOUT_SECONDS)
+            self._wake.clear()
+        self.connection.close()
+
+    def start(self) -> None:
+        """Start the background delivery worker if it is not already running."""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the worker and close the SMTP connection."""
+        self._stop.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+@shared_resource("email_outbox", close=EmailOutbox.stop)
+def get_outbox() -> EmailOutbox:
+    """Return the process-wide email outbox with its delivery worker running."""
+    from llm_utils import summarize_support_conversation
+
+    outbox = EmailOutbox(enricher=summarize_support_conversation if SUPPORT_TICKET_SUMMARY else None)
+    outbox.start()
+    return outbox
+
+def escalate_support_request(
+    user_email: str,
+    user_concern: str,
+    session_id: Optional[str] = None,
+    conversation: Optional[str] = None,
+    recipient_email: str = EMAIL_RECIPIENT
+) -> dict:
+    """
+    Validates and queues a support request without any LLM call on the request path.
 
     Args:
         user_email (str): The email address of the user.
         user_concern (str): The specific question or concern of the user.
+        session_id (Optional[str]): The chat session the request came from.
+        conversation (Optional[str]): Transcript used to enrich the ticket in the background.
         recipient_email (str): The support team's email address (default: EMAIL_RECIPIENT).
 
     Returns:
-        dict: Status of the email sending operation.
+        dict: Status of the request, with the outbox "job_id" when queued.
     """
+    if not is_valid_email(user_email):
+        return {"status": "error", "message": "Please provide a valid email address."}
+    if not user_concern.strip():
+        return {"status": "error", "message": "Please describe your concern so our support team can help."}
     try:
-        sender_email = GMAIL_SENDER_EMAIL
-        app_password = GMAIL_APP_PASSWORD
-
-        # Create email
-        subject = f"Support Request from {user_email}"
-        body = f"User Email: {user_email}\n\nConcern:\n{user_concern}"
-        msg = MIMEText(body)
-        msg["Subject"] = subject
-        msg["From"] = sender_email
-        msg["To"] = recipient_email
-
-        # Connect to Gmail SMTP server
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, app_password)
-            server.send_message(msg)
-
-        logger.info(f"Email sent successfully to {recipient_email}")
-        return {"status": "success", "message": "Email sent to support team."}
-
+        job_id = get_outbox().enqueue(user_email.strip(), user_concern.strip(), recipient_email, session_id, conversation)
+        return {
+            "status": "queued",
+            "job_id": job_id,
+            "message": "Thank you! Your request has been forwarded to our support team, and they will contact you by email."
+        }
     except Exception as e:
-        logger.error(f"Error sending email: {e}")
-        return {"status": "error", "message": f"Failed to send email: {str(e)}"}
\ No newline at end of file
+        logger.error(f"Error queueing support email: {e}")
+        return {"status": "error", "message": f"Failed to send email: {str(e)}"}
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import logging
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from langchain.embeddings.base import Embeddings
+from rate_limiter import TokenBucket, call_with_retries
+from metrics import record_cache, span
+
+from config import (
+    EMBEDDING_CACHE_PATH, EMBEDDING_BATCH_SIZE, EMBEDDING_CONCURRENCY,
+    EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_MAX_RETRIES, QUERY_EMBEDDING_CACHE_SIZE
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def text_hash(text: str) -> str:
+    """Return the cache key for a piece of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Persistent SQLite cache of document embedding vectors keyed by (model, task, text hash)."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, task TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, task, text_hash))"
+            )
+            # Older versions persisted every user question's embedding here; queries now stay in memory.
+            self._conn.execute("DELETE FROM embeddings WHERE task = 'query'")
+            self._conn.commit()
+
+    def get_many(self, model: str, task: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """Return cached vectors for the given hashes; misses are absent from the result."""
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND task = ? AND text_hash IN ({placeholders})",
+                    [model, task, *batch],
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, task: str, vectors: Dict[str, List[float]]) -> None:
+        """Store vectors keyed by text hash."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, task, text_hash, vector) VALUES (?, ?, ?, ?)",
+                [(model, task, key, array("f", vector).tobytes()) for key, vector in vectors.items()],
+            )
+            self._conn.commit()
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that deduplicates, caches, batches and rate-limits calls to a backend.
+
+    Identical texts are embedded once per call and never again while the cache
+    entry exists, so overlapping chunks and repeated boilerplate cost no quota.
+    Query vectors are kept in a bounded in-memory LRU instead, so user questions
+    are never written to disk.
+    """
+
+    def __init__(
+        self,
+        backend: Embeddings,
+        model: str,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        concurrency: int = EMBEDDING_CONCURRENCY,
+        requests_per_minute: float = EMBEDDING_REQUESTS_PER_MINUTE,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE,
+    ):
+        self.backend = backend
+        self.model = model
+        self.cache = cache or EmbeddingCache()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(rate=requests_per_minute / 60.0, capacity=max(1.0, concurrency))
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._query_lock = threading.Lock()
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        self.rate_limiter.acquire()
+        with span("embed_batch"):
+            return call_with_retries(self.backend.embed_documents, texts, max_retries=self.max_retries)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed document texts, calling the backend only for unseen texts."""
+        hashes = [text_hash(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+        vectors = self.cache.get_many(self.model, "document", list(unique))
+        missing = [key for key in unique if key not in vectors]
+        record_cache("embedding", hit=True, amount=len(texts) - len(missing))
+        record_cache("embedding", hit=False, amount=len(missing))
+        logger.info(f"Embedding {len(texts)} texts: {len(texts) - len(unique)} duplicates, {len(unique) - len(missing)} cached, {len(missing)} new")
+
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            results = executor.map(lambda batch: (batch, self._embed_batch([unique[key] for key in batch])), batches)
+            for batch, batch_vectors in results:
+                fresh = dict(zip(batch, batch_vectors))
+                # Persist each batch as it lands so an interrupted build keeps its progress.
+                self.cache.put_many(self.model, "document", fresh)
+                vectors.update(fresh)
+        return [vectors[key] for key in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a search query, reusing in-memory vectors for recently repeated questions."""
+        key = text_hash(text)
+        with self._query_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+        record_cache("query_embedding", hit=vector is not None)
+        if vector is not None:
+            return vector
+        self.rate_limiter.acquire()
+        with span("embed_query"):
+            vector = call_with_retries(self.backend.embed_query, text, max_retries=self.max_retries)
+        with self._query_lock:
+            self._query_cache[key] = vector
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
@@ -0,0 +1,305 @@
+import os
+import re
+import time
+import random
+import hashlib
+import textwrap
+import threading
+import socketserver
+import logging
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+import numpy as np
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult, get_buffer_string
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Offline, deterministic stand-ins for Gemini, its embeddings and the SMTP server, used by benchmark.py.
+FAKE_COMPANY_NAME = "Benchmark Corp Inc."
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+NEGATIVE_WORDS = {"frustrated", "useless", "terrible", "angry", "awful", "disappointed", "broken", "hate"}
+TOPICS = [
+    "password reset", "account login", "two-factor authentication", "billing cycle", "invoice download",
+    "refund policy", "subscription upgrade", "data export", "mobile app sync", "api rate limits",
+    "single sign-on", "shipping times", "order tracking", "warranty claims", "device pairing",
+    "notification settings", "team permissions", "audit logs", "storage quota", "offline mode",
+]
+VOCABULARY = (
+    "the customer can open settings then select account and follow the prompts to confirm the change "
+    "support agents review each request within one business day and reply by email with next steps "
+    "please make sure the latest version is installed before contacting support about sync issues "
+    "charges appear on the statement under the company name and are billed at the start of each cycle "
+    "administrators manage roles from the team page where each member can be granted read or write access"
+).split()
+
+def stable_seed(text: str) -> int:
+    """A seed that is identical across processes and runs (unlike `hash`)."""
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+def sleep(seconds: float) -> None:
+    if seconds > 0:
+        time.sleep(seconds)
+
+class FakeChatModel(BaseChatModel):
+    """Stand-in for ChatGoogleGenerativeAI: deterministic replies with a configurable latency and token rate.
+
+    The reply is derived from the prompt, so the same prompt always yields the same
+    answer. Answer prompts get the "TONE: <label>" header the QA prompt asks for.
+    """
+
+    first_token_latency: float = 0.4
+    tokens_per_second: float = 80.0
+    answer_tokens: int = 60
+    company_name: str = FAKE_COMPANY_NAME
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def reply(self, prompt: str) -> str:
+        if prompt.rstrip().endswith("Company Name:"):
+            return self.company_name
+        rng = random.Random(stable_seed(prompt))
+        words = [rng.choice(VOCABULARY) for _ in range(self.answer_tokens)]
+        if "TONE:" not in prompt:
+            # Summaries (memory, support tickets) are shorter than answers.
+            return " ".join(words[:max(1, self.answer_tokens // 3)])
+        question = prompt.rsplit("User:", 1)[-1].lower()
+        tone = "negative" if NEGATIVE_WORDS & set(WORD_PATTERN.findall(question)) else "neutral"
+        answer = " ".join(words)
+        return f"TONE: {tone}\n{answer[0].upper()}{answer[1:]}."
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = messages[0].content if len(messages) == 1 else get_buffer_string(messages)
+        return re.findall(r"\S+\s*", self.reply(prompt))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        sleep(self.first_token_latency + (len(tokens) - 1) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i:
+                sleep(1.0 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+class FakeEmbeddings(Embeddings):
+    """Stand-in for GoogleGenerativeAIEmbeddings with per-request and per-text latency.
+
+    Vectors are normalized sums of fixed per-word random vectors, so texts sharing
+    words are close and retrieval behaves plausibly.
+    """
+
+    def __init__(self, dimension: int = 768, request_latency: float = 0.05, seconds_per_text: float = 0.0005):
+        self.dimension = dimension
+        self.request_latency = request_latency
+        self.seconds_per_text = seconds_per_text
+        self._word_vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            vector = np.random.default_rng(stable_seed(word)).standard_normal(self.dimension).astype(np.float32)
+            with self._lock:
+                self._word_vectors[word] = vector
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            vector += self._word_vector(word)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _record(self, count: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.texts += count
+        sleep(self.request_latency + count * self.seconds_per_text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._record(len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._record(1)
+        return self._embed(text)
+
+class FakeGenerativeModel:
+    """Stand-in for genai.GenerativeModel as used by the Gemini tone fallback."""
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+
+    def generate_content(self, prompt: str) -> SimpleNamespace:
+        sleep(self.latency)
+        message = prompt.split("Message:", 1)[-1].lower()
+        return SimpleNamespace(text=str(bool(NEGATIVE_WORDS & set(WORD_PATTERN.findall(message)))))
+
+class SMTPSink:
+    """Local SMTP server that accepts every message and keeps it in memory, with an optional per-message delay."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.messages: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str) -> None:
+                self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+            def handle(self) -> None:
+                self.reply("220 localhost SMTP sink ready")
+                envelope: Dict[str, Any] = {"rcpt_tos": []}
+                data: Optional[List[str]] = None
+                for raw in self.rfile:
+                    line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                    if data is not None:
+                        if line == ".":
+                            sleep(sink.latency)
+                            sink.record(dict(envelope, data="\n".join(data), received_at=time.time()))
+                            envelope, data = {"rcpt_tos": []}, None
+                            self.reply("250 OK: queued")
+                        else:
+                            data.append(line[1:] if line.startswith(".") else line)
+                        continue
+                    command = line[:4].upper()
+                    if command in ("HELO", "EHLO"):
+                        self.reply("250 localhost")
+                    elif command == "MAIL":
+                        envelope["mail_from"] = line.partition(":")[2].strip()
+                        self.reply("250 OK")
+                    elif command == "RCPT":
+                        envelope["rcpt_tos"].append(line.partition(":")[2].strip())
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        data = []
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                    elif command in ("NOOP", "RSET"):
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, message: Dict[str, Any]) -> None:
+        with self._lock:
+            self.messages.append(message)
+
+    @property
+    def count(self) -> int:
+        with self._lock:
+            return len(self.messages)
+
+    def start(self) -> "SMTPSink":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        logger.info(f"SMTP sink listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+def synthetic_pages(rng: random.Random, doc_index: int, pages: int, words_per_page: int = 400) -> List[List[str]]:
+    """Help-desk style pages: a heading per topic, paragraphs and the odd error code."""
+    result = []
+    for page in range(pages):
+        topic = TOPICS[(doc_index + page) % len(TOPICS)]
+        lines = [topic.title()]
+        if page == 0:
+            lines.insert(0, f"Welcome to {FAKE_COMPANY_NAME}")
+        words = []
+        for i in range(words_per_page):
+            words.append(rng.choice(VOCABULARY) if i % 25 else f"ERR-{rng.randint(1000, 9999)}")
+        for start in range(0, len(words), 80):
+            sentence = " ".join(words[start:start + 80])
+            lines.append(sentence[0].upper() + sentence[1:] + ".")
+        result.append(lines)
+    return result
+
+def write_pdf(path: str, pages: List[List[str]], line_chars: int = 90) -> None:
+    """Write a minimal text-only PDF (Helvetica, one content stream per page)."""
+    def escape(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        wrapped = []
+        for line in lines:
+            wrapped.extend(textwrap.wrap(line, line_chars) or [""])
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({escape(line)}) Tj T*" for line in wrapped) + " ET"
+        content = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+
+def write_docx(path: str, pages: List[List[str]]) -> None:
+    from docx import Document as DocxDocument
+
+    document = DocxDocument()
+    for lines in pages:
+        for i, line in enumerate(lines):
+            if i == 0 or line.startswith("Welcome to"):
+                document.add_heading(line, level=1)
+            else:
+                document.add_paragraph(line)
+    document.save(path)
+
+def write_txt(path: str, pages: List[List[str]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\f".join("\n\n".join(lines) + "\n" for lines in pages))
+
+def write_corpus(folder: str, documents: int, pages_per_document: int = 5, seed: int = 0) -> List[str]:
+    """Write a deterministic mix of PDF, DOCX and TXT documents and return their paths."""
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    writers = ((".pdf", write_pdf), (".docx", write_docx), (".txt", write_txt))
+    paths = []
+    for i in range(documents):
+        extension, writer = writers[i % len(writers)]
+        path = os.path.join(folder, f"doc-{i:05d}{extension}")
+        writer(path, synthetic_pages(rng, i, pages_per_document))
+        paths.append(path)
+    return paths
+
+def synthetic_questions(count: int, seed: int = 0) -> List[str]:
+    """Help-desk questions about the synthetic corpus topics, some quoting an error code."""
+    rng = random.Random(seed)
+    templates = [
+        "How do I manage {topic}?", "What is your policy on {topic}?", "I need help with {topic}.",
+        "Why am I seeing error ERR-{code} with {topic}?", "Can you explain {topic} for my team?",
+    ]
+    return [rng.choice(templates).format(topic=rng.choice(TOPICS), code=rng.randint(1000, 9999)) for _ in range(count)]
@@ -0,0 +1,403 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+import logging
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Generator, Iterator, List, NamedTuple, Optional, Tuple
+
+from chat_history import ChatHistoryManager, get_chat_manager
+from email_utils import escalate_support_request, get_outbox, is_valid_email
+from tone_detector import get_tone_detector
+from resources import shared_resource
+from metrics import annotate, span, trace
+
+from config import (
+    DATA_FOLDER, INDEX_BUILD_IN_APP, ANSWER_CACHE_ENABLED, SUPPORT_TICKET_CONTEXT_MESSAGES, MEMORY_RECENT_TURNS,
+    INTRODUCTION_MESSAGE, WARM_UP_ON_START, MEMORY_FOLD_WORKERS
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# langchain, FAISS and the Gemini SDK take seconds to import. They are imported on
+# first use (or by `warm_up` in the background) so the UI and API start serving at once.
+if TYPE_CHECKING:
+    from index_manager import KnowledgeBase
+
+ESCALATION_PROMPT = (
+    "It seems like I may not be fully addressing your concern. To better assist you, "
+    "please provide your email address, and I'll connect you with our support team."
+)
+ASK_FOR_CONCERN = "Thank you! Please provide your specific question or concern, and I'll forward it to our support team."
+INVALID_EMAIL = "Please provide a valid email address."
+ERROR_RESPONSE = "Let me try that again - sometimes connections can be tricky!"
+DISSATISFACTION_LIMIT = 3
+
+class TurnEvent(NamedTuple):
+    """One step of a streamed turn.
+
+    "token" carries {"text"} as the answer is generated, "message" a finished
+    assistant message ({"content", "kind", ...}), and "done" closes the turn.
+    """
+
+    event: str
+    data: Dict[str, Any]
+
+class SessionState:
+    """Per-session conversation state, persisted between turns so any worker can continue a session."""
+
+    FIELDS = ("dissatisfaction_count", "awaiting_email", "awaiting_concern", "user_email", "support_requests")
+
+    def __init__(
+        self,
+        dissatisfaction_count: int = 0,
+        awaiting_email: bool = False,
+        awaiting_concern: bool = False,
+        user_email: Optional[str] = None,
+        support_requests: Optional[List[int]] = None
+    ):
+        self.dissatisfaction_count = dissatisfaction_count
+        self.awaiting_email = awaiting_email
+        self.awaiting_concern = awaiting_concern
+        self.user_email = user_email
+        self.support_requests = support_requests or []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SessionState":
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+    def rebase(self, base: "SessionState", current: "SessionState") -> "SessionState":
+        """Reapply this state's changes since `base` on top of `current`, saved meanwhile by another worker."""
+        merged = SessionState.from_dict(current.to_dict())
+        for field in self.FIELDS:
+            if field not in ("dissatisfaction_count", "support_requests") and getattr(self, field) != getattr(base, field):
+                setattr(merged, field, getattr(self, field))
+        if self.dissatisfaction_count != base.dissatisfaction_count:
+            # Concurrent negative turns add up; a reset wins.
+            merged.dissatisfaction_count = self.dissatisfaction_count and (
+                current.dissatisfaction_count + self.dissatisfaction_count - base.dissatisfaction_count
+            )
+        added = [job_id for job_id in self.support_requests if job_id not in base.support_requests]
+        removed = set(base.support_requests) - set(self.support_requests)
+        merged.support_requests = [job_id for job_id in current.support_requests if job_id not in removed] + [
+            job_id for job_id in added if job_id not in current.support_requests
+        ]
+        return merged
+
+class HelpDeskEngine:
+    """UI-agnostic help-desk core: retrieval, answering, tone tracking, escalation and history.
+
+    The engine holds no per-session objects between turns; each turn loads the
+    session's state and recent history from the shared store, so it can serve
+    many sessions from several worker processes.
+    """
+
+    def __init__(
+        self,
+        data_folder: str = DATA_FOLDER,
+        chat_manager: Optional[ChatHistoryManager] = None,
+        knowledge_base: Optional["KnowledgeBase"] = None,
+    ):
+        self.data_folder = data_folder
+        self._chat_manager = chat_manager
+        self._knowledge_base = knowledge_base
+        # A session's lock lives only while a turn holds it, so idle sessions cost nothing
+        self._session_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+        self._warm_up_thread: Optional[threading.Thread] = None
+        self._fold_executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+        # Sessions with a fold running, mapped to whether another was requested meanwhile
+        self._folding: Dict[str, bool] = {}
+
+    @property
+    def chat_manager(self) -> ChatHistoryManager:
+        return self._chat_manager or get_chat_manager()
+
+    @property
+    def knowledge_base(self) -> "KnowledgeBase":
+        from index_manager import get_knowledge_base
+
+        knowledge_base = self._knowledge_base or get_knowledge_base(self.data_folder)
+        knowledge_base.sync()
+        return knowledge_base
+
+    @property
+    def company_name(self) -> str:
+        return self.knowledge_base.company_name
+
+    def warm_up(self) -> None:
+        """Load the knowledge base and model clients on a background thread, once."""
+        with self._locks_guard:
+            if self._warm_up_thread is not None:
+                return
+            self._warm_up_thread = threading.Thread(target=self._warm_up, name="warm-up", daemon=True)
+        self._warm_up_thread.start()
+
+    def _warm_up(self) -> None:
+        try:
+            from llm_utils import get_chat_model
+            from answer_cache import get_answer_cache
+
+            self.knowledge_base
+            get_chat_model()
+            get_tone_detector()
+            if ANSWER_CACHE_ENABLED:
+                get_answer_cache()
+            logger.info("Help-desk engine warmed up")
+        except Exception as e:
+            logger.error(f"Error warming up help-desk engine: {e}")
+
+    def new_session_id(self) -> str:
+        return str(uuid.uuid4())
+
+    def get_history(self, session_id: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, str]]:
+        """Stored messages of a session, oldest first; a new session starts with the introduction."""
+        history = self.chat_manager.get_chat_history(session_id, limit, offset)
+        if not history and offset == 0:
+            return [{"role": "assistant", "content": INTRODUCTION_MESSAGE}]
+        return history
+
+    def get_history_page(self, session_id: str, limit: int, offset: int = 0) -> Tuple[List[Dict[str, str]], bool]:
+        """A page of stored messages, oldest first, ending `offset` messages before the newest.
+
+        Returns:
+            tuple: (messages, whether older messages exist)
+        """
+        messages = self.chat_manager.get_chat_history(session_id, limit + 1, offset)
+        has_older = len(messages) > limit
+        return (messages[1:] if has_older else messages), has_older
+
+    def refresh_knowledge_base(self, progress_callback: Optional[Callable[[int, int, str], None]] = None) -> "KnowledgeBase":
+        """Load the latest published index, or rebuild it in-process when INDEX_BUILD_IN_APP is set."""
+        knowledge_base = self.knowledge_base
+        if not INDEX_BUILD_IN_APP:
+            knowledge_base.load()
+        elif progress_callback is None:
+            knowledge_base.refresh()
+        else:
+            knowledge_base.refresh(progress_callback)
+        return knowledge_base
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def _reply(self, session_id: str, content: str, kind: str, **extra) -> TurnEvent:
+        with span("history_save"):
+            self.chat_manager.save_chat_message(session_id, "assistant", content)
+        annotate(kind=kind)
+        return TurnEvent("message", dict(content=content, kind=kind, **extra))
+
+    def _update_dissatisfaction(self, state: SessionState, is_negative: bool) -> bool:
+        """Track consecutive negative turns. Returns True when the user should now be asked for their email."""
+        state.dissatisfaction_count = state.dissatisfaction_count + 1 if is_negative else 0
+        if state.dissatisfaction_count >= DISSATISFACTION_LIMIT and not state.awaiting_email:
+            state.awaiting_email = True
+            return True
+        return False
+
+    def handle_turn(self, session_id: str, message: str) -> Iterator[TurnEvent]:
+        """Process one user message, yielding answer tokens and finished assistant messages.
+
+        Turns of the same session are serialized within a process. Across worker
+        processes the state is saved with a compare-and-set, merging in whatever a
+        concurrent turn saved meanwhile.
+        """
+        needs_fold = False
+        with trace("turn", session_id=session_id), self._session_lock(session_id):
+            with span("session_load"):
+                stored, version = self.chat_manager.get_session_state(session_id)
+                base, state = SessionState.from_dict(stored), SessionState.from_dict(stored)
+            try:
+                needs_fold = yield from self._handle_turn(session_id, message, state)
+            finally:
+                with span("session_save"):
+                    self._save_state(session_id, base, state, version)
+        if needs_fold:
+            self._schedule_fold(session_id)
+        yield TurnEvent("done", {"session_id": session_id})
+
+    def _save_state(self, session_id: str, base: SessionState, state: SessionState, version: int) -> None:
+        """Store a session's updated state, rebasing it on any state another worker saved since `base` was loaded."""
+        while not self.chat_manager.save_session_state(session_id, state.to_dict(), version):
+            logger.warning(f"Session {session_id} was updated by another worker meanwhile; merging the changes")
+            stored, version = self.chat_manager.get_session_state(session_id)
+            current = SessionState.from_dict(stored)
+            state, base = state.rebase(base, current), current
+
+    def _schedule_fold(self, session_id: str) -> None:
+        """Fold the session's evicted turns into its summary on a background thread, off the turn's path."""
+        with self._locks_guard:
+            if self._closed:
+                return
+            if session_id in self._folding:
+                self._folding[session_id] = True
+                return
+            self._folding[session_id] = False
+            if self._fold_executor is None:
+                self._fold_executor = ThreadPoolExecutor(max_workers=MEMORY_FOLD_WORKERS, thread_name_prefix="memory-fold")
+            self._fold_executor.submit(self._fold_memory, session_id)
+
+    def close(self) -> None:
+        """Wait for background memory folds to finish, before the stores they write to are closed."""
+        with self._locks_guard:
+            self._closed = True
+            executor = self._fold_executor
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _fold_memory(self, session_id: str) -> None:
+        """Fold every turn older than the recent window that the stored summary does not cover yet."""
+        try:
+            from llm_utils import create_memory
+
+            summary, folded_until = self.chat_manager.get_session_summary(session_id)
+            memory = create_memory(self.chat_manager.get_messages_after(session_id, folded_until))
+            memory.summary = summary
+            pending_until = memory.pending_until
+            if pending_until is not None and memory.fold():
+                if not self.chat_manager.save_session_summary(session_id, memory.summary, pending_until, folded_until):
+                    logger.info(f"Summary of session {session_id} was already updated elsewhere; dropping this fold")
+        except Exception as e:
+            logger.error(f"Error folding conversation memory for session {session_id}: {e}")
+        finally:
+            with self._locks_guard:
+                again = self._folding.pop(session_id)
+            if again:
+                self._schedule_fold(session_id)
+
+    def _handle_turn(self, session_id: str, message: str, state: SessionState) -> Generator[TurnEvent, None, bool]:
+        """Run one turn, yielding its events. Returns True when old turns are waiting to be summarized."""
+        with span("history_save"):
+            self.chat_manager.save_chat_message(session_id, "user", message)
+
+        if state.awaiting_email:
+            if is_valid_email(message):
+                state.user_email = message.strip()
+                state.awaiting_email = False
+                state.awaiting_concern = True
+                yield self._reply(session_id, ASK_FOR_CONCERN, "ask_concern")
+            else:
+                yield self._reply(session_id, INVALID_EMAIL, "ask_email")
+            return False
+
+        if state.awaiting_concern:
+            recent_messages = self.chat_manager.get_chat_history(session_id, limit=SUPPORT_TICKET_CONTEXT_MESSAGES)
+            conversation = "\n".join(
+                f"{'User' if entry['role'] == 'user' else 'Assistant'}: {entry['content']}" for entry in recent_messages
+            )
+            with span("escalation"):
+                result = escalate_support_request(
+                    user_email=state.user_email,
+                    user_concern=message,
+                    session_id=session_id,
+                    conversation=conversation
+                )
+            if result["status"] == "queued":
+                # Stay in concern mode on an empty concern or a failed hand-off so the user can try again
+                state.awaiting_concern = False
+                state.dissatisfaction_count = 0
+                state.support_requests.append(result["job_id"])
+            yield self._reply(session_id, result["message"], "support_request", status=result["status"], job_id=result.get("job_id"))
+            return False
+
+        # Check for negative tone locally; escalate before answering when the detector is sure
+        tone_detector = get_tone_detector()
+        with span("tone"):
+            tone = tone_detector.detect(message)
+        tone_is_confident = tone_detector.is_confident(tone)
+        if tone_is_confident and self._update_dissatisfaction(state, tone.is_negative):
+            yield self._reply(session_id, ESCALATION_PROMPT, "ask_email")
+            return False
+
+        knowledge_base = self.knowledge_base
+        if knowledge_base.is_empty:
+            yield self._reply(
+                session_id,
+                f"I'm still learning about {knowledge_base.company_name}. Please ensure our knowledge base is connected.",
+                "no_data"
+            )
+            return False
+
+        try:
+            from llm_utils import create_conversational_chain, create_memory
+            from answer_cache import get_answer_cache
+
+            # Rebuild the memory from the stored recent turns plus the persisted summary.
+            with span("memory_load"):
+                history = self.chat_manager.get_chat_history(session_id, limit=2 * MEMORY_RECENT_TURNS + 1)[:-1]
+                memory = create_memory(history)
+                memory.summary, _ = self.chat_manager.get_session_summary(session_id)
+            chain = create_conversational_chain(
+                knowledge_base,
+                knowledge_base.company_name,
+                get_answer_cache() if ANSWER_CACHE_ENABLED else None,
+                memory=memory
+            )
+            answer = chain.stream(message)
+            for token in answer:
+                yield TurnEvent("token", {"text": token})
+            annotate(tone=answer.tone, cached=answer.cached, prompt_tokens=answer.prompt_tokens)
+        except Exception as e:
+            logger.error(f"Error processing user input: {e}")
+            yield self._reply(session_id, ERROR_RESPONSE, "error", error=str(e))
+            return False
+        yield self._reply(
+            session_id, answer.answer, "answer", tone=answer.tone, sources=answer.sources, cached=answer.cached
+        )
+        if not tone_is_confident and answer.tone:
+            # Fall back to the tone label Gemini returned alongside the answer (cached answers carry none);
+            # an unsure local guess never counts
+            if self._update_dissatisfaction(state, answer.tone == "negative"):
+                yield self._reply(session_id, ESCALATION_PROMPT, "ask_email")
+        return bool(memory.pending)
+
+    async def astream_turn(self, session_id: str, message: str) -> AsyncIterator[TurnEvent]:
+        """Async view of `handle_turn`; the blocking turn runs on a worker thread."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def produce() -> None:
+            try:
+                for event in self.handle_turn(session_id, message):
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            except Exception as e:
+                logger.error(f"Error in turn for session {session_id}: {e}")
+                loop.call_soon_threadsafe(queue.put_nowait, TurnEvent("error", {"message": str(e)}))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(None, produce)
+        while (event := await queue.get()) is not done:
+            yield event
+        await producer
+
+    def poll_support_requests(self, session_id: str) -> List[Dict[str, Any]]:
+        """Return the session's support requests with their delivery status, forgetting finished ones."""
+        with self._session_lock(session_id):
+            stored, version = self.chat_manager.get_session_state(session_id)
+            base, state = SessionState.from_dict(stored), SessionState.from_dict(stored)
+            if not state.support_requests:
+                return []
+            statuses = get_outbox().get_status(state.support_requests)
+            requests = [
+                {"job_id": job_id, "status": statuses.get(job_id, {}).get("status", "pending")} for job_id in state.support_requests
+            ]
+            state.support_requests = [request["job_id"] for request in requests if request["status"] not in ("sent", "failed")]
+            self._save_state(session_id, base, state, version)
+        return requests
+
+@shared_resource("helpdesk_engine", close=HelpDeskEngine.close)
+def get_engine() -> HelpDeskEngine:
+    """Return the process-wide help-desk engine."""
+    engine = HelpDeskEngine()
+    if WARM_UP_ON_START:
+        engine.warm_up()
+    return engine
@@ -0,0 +1,472 @@
+import os
+import json
+import shutil
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from langchain.schema import BaseRetriever, Document
+from retrieval import BM25Index, hybrid_search
+from resources import shared_resource
+from metrics import span, trace
+from company_detector import CompanyCandidates, detect_company_name
+from vector_quantization import load_quantized_vectorstore, write_quantized_index
+from document_processor import (
+    SUPPORTED_EXTENSIONS, extract_all_documents, get_embeddings, log_progress, representative_snippets, resolve_company_name
+)
+
+from config import (
+    INDEX_DIR, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME, EXTRACTION_WORKERS, COMPANY_NAME_CONFIDENCE_THRESHOLD,
+    INDEX_BUILD_IN_APP, INDEX_RELOAD_INTERVAL_SECONDS, INDEX_QUANTIZATION, INDEX_KEEP_VERSIONS, INDEX_PRUNE_GRACE_SECONDS
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    from langchain.vectorstores import FAISS
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+PUBLISH_LOG_FILE = "published.json"
+
+def index_settings() -> Dict[str, Any]:
+    """Settings that invalidate every stored vector when they change."""
+    return {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "chunking": "document-pages-v1",
+    }
+
+def hash_file(file_path: str) -> str:
+    """Return the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compute_index_key(settings: Dict[str, Any], files: Dict[str, Dict[str, Any]]) -> str:
+    """Hash the chunking/embedding settings and per-file content hashes into an index version."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    for filename in sorted(files):
+        digest.update(f"{filename}\0{files[filename]['sha256']}\0".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def read_current_version(index_dir: str = INDEX_DIR) -> Optional[str]:
+    """Return the published index version, if any."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def load_index_version(
+    version: str, index_dir: str = INDEX_DIR, quantization: str = INDEX_QUANTIZATION
+) -> tuple[Optional["FAISS"], Dict[str, Any]]:
+    """Load a published index version and its manifest from disk.
+
+    With a quantization other than "none" the vectorstore is read-only: it searches the
+    compressed index and re-scores against the memory-mapped exact vectors.
+    """
+    index_path = os.path.join(index_dir, version)
+    with open(os.path.join(index_path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    vectorstore = None
+    if os.path.exists(os.path.join(index_path, "index.faiss")):
+        if quantization != "none":
+            vectorstore = load_quantized_vectorstore(index_path, get_embeddings(), quantization)
+        else:
+            from langchain.vectorstores import FAISS
+
+            vectorstore = FAISS.load_local(index_path, get_embeddings(), allow_dangerous_deserialization=True)
+    return vectorstore, manifest
+
+def scan_data_folder(data_folder: str, previous: Dict[str, Dict[str, Any]]) -> tuple[Dict[str, Dict[str, Any]], List[str], List[str]]:
+    """Stat the data folder against the previous manifest.
+
+    Files whose mtime and size are unchanged are trusted without re-hashing.
+
+    Returns:
+        tuple: (current file records, names of added or changed files, names of removed files)
+    """
+    current = {}
+    changed = []
+    for filename in sorted(os.listdir(data_folder)):
+        if not filename.endswith(SUPPORTED_EXTENSIONS):
+            continue
+        stat = os.stat(os.path.join(data_folder, filename))
+        record = previous.get(filename)
+        if record and record["mtime"] == stat.st_mtime and record["size"] == stat.st_size:
+            current[filename] = record
+            continue
+        sha256 = hash_file(os.path.join(data_folder, filename))
+        if record and record["sha256"] == sha256:
+            current[filename] = dict(record, mtime=stat.st_mtime, size=stat.st_size)
+            continue
+        current[filename] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256, "chunk_ids": [], "company_candidates": {}}
+        changed.append(filename)
+    removed = [filename for filename in previous if filename not in current]
+    return current, changed, removed
+
+def write_index_version(vectorstore: Optional["FAISS"], manifest: Dict[str, Any], index_dir: str = INDEX_DIR) -> str:
+    """Write an index version to a scratch directory and rename it into place. Returns the version."""
+    version = manifest["version"]
+    index_path = os.path.join(index_dir, version)
+    os.makedirs(index_dir, exist_ok=True)
+    if not os.path.exists(os.path.join(index_path, MANIFEST_FILE)):
+        staging_path = tempfile.mkdtemp(prefix=f".{version}-", dir=index_dir)
+        if vectorstore is not None:
+            vectorstore.save_local(staging_path)
+            with span("quantize", kind=INDEX_QUANTIZATION):
+                write_quantized_index(staging_path)
+        with open(os.path.join(staging_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        try:
+            os.replace(staging_path, index_path)
+        except OSError:
+            # Another process published the same version first; its copy is identical.
+            shutil.rmtree(staging_path, ignore_errors=True)
+    return version
+
+def read_publish_log(index_dir: str = INDEX_DIR) -> List[Dict[str, Any]]:
+    """Return the versions published so far, oldest first, as {"version", "published_at"} records."""
+    try:
+        with open(os.path.join(index_dir, PUBLISH_LOG_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading the index publish log: {e}")
+        return []
+
+def _write_publish_log(log: List[Dict[str, Any]], index_dir: str) -> None:
+    log_path = os.path.join(index_dir, f".{PUBLISH_LOG_FILE}.tmp")
+    with open(log_path, "w", encoding="utf-8") as f:
+        json.dump(log, f, indent=2)
+    os.replace(log_path, os.path.join(index_dir, PUBLISH_LOG_FILE))
+
+def set_current_version(version: str, index_dir: str = INDEX_DIR) -> None:
+    """Atomically point CURRENT at a written version, record it in the publish log and prune old versions."""
+    if not os.path.exists(os.path.join(index_dir, version, MANIFEST_FILE)):
+        raise FileNotFoundError(f"Index version {version} does not exist in {index_dir}")
+    pointer_path = os.path.join(index_dir, f".{CURRENT_FILE}.tmp")
+    with open(pointer_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer_path, os.path.join(index_dir, CURRENT_FILE))
+    log = read_publish_log(index_dir)
+    log.append({"version": version, "published_at": time.time()})
+    _write_publish_log(log, index_dir)
+    _prune_stale_versions(version, index_dir, log)
+
+def publish_index_version(vectorstore: Optional["FAISS"], manifest: Dict[str, Any], index_dir: str = INDEX_DIR) -> None:
+    """Write an index version, then atomically point CURRENT at it."""
+    set_current_version(write_index_version(vectorstore, manifest, index_dir), index_dir)
+
+def discard_index_version(version: str, index_dir: str = INDEX_DIR) -> None:
+    """Remove an unpublished version, e.g. one that failed verification."""
+    if version != read_current_version(index_dir):
+        shutil.rmtree(os.path.join(index_dir, version), ignore_errors=True)
+
+def verify_index_version(version: str, index_dir: str = INDEX_DIR) -> List[str]:
+    """Check a written version before it is published.
+
+    Returns:
+        List[str]: Problems found; empty when the version is consistent and searchable.
+    """
+    try:
+        vectorstore, manifest = load_index_version(version, index_dir, quantization="none")
+    except Exception as e:
+        return [f"Cannot load index version {version}: {e}"]
+    problems = []
+    files = manifest.get("files", {})
+    if manifest.get("version") != version:
+        problems.append(f"Manifest version {manifest.get('version')} does not match directory {version}")
+    if compute_index_key(manifest.get("settings", {}), files) != version:
+        problems.append("Manifest file hashes do not reproduce the version key")
+    if manifest.get("settings") != index_settings():
+        problems.append("Index was built with different chunking or embedding settings")
+    expected_ids = {chunk_id for record in files.values() for chunk_id in record.get("chunk_ids", [])}
+    if vectorstore is None:
+        if expected_ids:
+            problems.append(f"Manifest lists {len(expected_ids)} chunks but the version has no vectors")
+        return problems
+    stored_ids = set(vectorstore.index_to_docstore_id.values())
+    if stored_ids != expected_ids:
+        problems.append(
+            f"Vector ids differ from the manifest: {len(expected_ids - stored_ids)} missing, {len(stored_ids - expected_ids)} unexpected"
+        )
+    if vectorstore.index.ntotal != len(stored_ids):
+        problems.append(f"FAISS holds {vectorstore.index.ntotal} vectors for {len(stored_ids)} chunk ids")
+    documents = [vectorstore.docstore.search(chunk_id) for chunk_id in stored_ids]
+    missing = sum(not isinstance(doc, Document) for doc in documents)
+    if missing:
+        problems.append(f"{missing} chunk ids have no stored document")
+    elif documents and not vectorstore.similarity_search(documents[0].page_content[:200], k=1):
+        problems.append("Probe search returned no results")
+    if INDEX_QUANTIZATION != "none":
+        try:
+            served, _ = load_index_version(version, index_dir)
+        except Exception as e:
+            problems.append(f"Cannot load the {INDEX_QUANTIZATION} serving index: {e}")
+        else:
+            if documents and not served.similarity_search(documents[0].page_content[:200], k=1):
+                problems.append(f"Probe search of the {INDEX_QUANTIZATION} serving index returned no results")
+    return problems
+
+def _prune_stale_versions(
+    current_version: str,
+    index_dir: str,
+    log: List[Dict[str, Any]],
+    keep: int = INDEX_KEEP_VERSIONS,
+    grace_seconds: float = INDEX_PRUNE_GRACE_SECONDS
+) -> None:
+    """Remove old index versions, keeping the last `keep` published ones for rollback.
+
+    A version is only removed once it has been out of use for `grace_seconds`: since it
+    was superseded if it was ever published, or since it was written otherwise. Workers
+    still serving or loading it in the meantime are unaffected.
+    """
+    now = time.time()
+    superseded_at: Dict[str, float] = {}
+    for record, successor in zip(log, log[1:]):
+        superseded_at[record["version"]] = successor["published_at"]
+    kept = {current_version}
+    for record in reversed(log):
+        if len(kept) > keep:
+            break
+        kept.add(record["version"])
+    for entry in os.listdir(index_dir):
+        entry_path = os.path.join(index_dir, entry)
+        if entry in kept or entry.startswith(".") or not os.path.isdir(entry_path):
+            continue
+        try:
+            idle_since = superseded_at.get(entry) or os.path.getmtime(entry_path)
+        except OSError:
+            continue
+        if now - idle_since >= grace_seconds:
+            logger.info(f"Removing index version {entry}, unused for {(now - idle_since) / 3600:.1f}h")
+            shutil.rmtree(entry_path, ignore_errors=True)
+    retained = [record for record in log if os.path.isdir(os.path.join(index_dir, record["version"]))]
+    if len(retained) < len(log):
+        _write_publish_log(retained, index_dir)
+
+def resolve_index_company_name(files: Dict[str, Any], snippets: List[str], previous: Dict[str, Any]) -> Dict[str, str]:
+    """Resolve the company name for a new index version, reusing the previous answer when possible.
+
+    Local candidate scores are kept per file in the manifest, so only changed files
+    are re-scored. The LLM fallback runs at most once per update, and not at all
+    while the local best guess is the one the previous version already resolved.
+    """
+    guess = detect_company_name(CompanyCandidates.from_dict(record.get("company_candidates", {})) for record in files.values())
+    if guess.confidence >= COMPANY_NAME_CONFIDENCE_THRESHOLD:
+        name, source = guess.name, "local"
+    elif previous.get("company_name_guess") == guess.name and previous.get("company_name_source") == "llm":
+        name, source = previous["company_name"], "llm"
+    elif snippets:
+        company = resolve_company_name([], snippets)
+        name, source = company.name, company.source
+    elif previous.get("company_name"):
+        # Nothing new to show the LLM (e.g. only removals); keep the name we already had.
+        name, source = previous["company_name"], previous.get("company_name_source", "local")
+    else:
+        name, source = guess.name, "local"
+    return {"company_name": name, "company_name_source": source, "company_name_guess": guess.name}
+
+def update_index(
+    data_folder: str,
+    index_dir: str = INDEX_DIR,
+    progress_callback: Callable[[int, int, str], None] = log_progress,
+    publish: bool = True,
+    max_workers: int = EXTRACTION_WORKERS,
+) -> tuple[Optional["FAISS"], Dict[str, Any]]:
+    """Bring the persisted index in line with the data folder, re-embedding only what changed.
+
+    The update is applied to a private copy of the current version, so readers of the
+    live index are never exposed to a half-applied change. With `publish=False` the new
+    version is written but CURRENT is left alone, so it can be verified first.
+
+    Returns:
+        tuple: (vectorstore or None if the folder is empty, manifest of the published version)
+    """
+    settings = index_settings()
+    vectorstore, manifest = None, {"settings": settings, "files": {}}
+    version = read_current_version(index_dir)
+    if version:
+        with span("index_load"):
+            stored_vectorstore, stored_manifest = load_index_version(version, index_dir, quantization="none")
+        if stored_manifest.get("settings") == settings:
+            vectorstore, manifest = stored_vectorstore, stored_manifest
+        else:
+            logger.info("Index settings changed; rebuilding the knowledge base from scratch")
+
+    with span("scan"):
+        files, changed, removed = scan_data_folder(data_folder, manifest["files"])
+    if not changed and not removed and version == manifest.get("version"):
+        return vectorstore, manifest
+
+    stale_ids = [chunk_id for filename in removed for chunk_id in manifest["files"][filename]["chunk_ids"]]
+    stale_ids += [chunk_id for filename in changed if filename in manifest["files"] for chunk_id in manifest["files"][filename]["chunk_ids"]]
+    if vectorstore is not None and stale_ids:
+        vectorstore.delete(stale_ids)
+
+    changed_paths = [os.path.join(data_folder, filename) for filename in changed]
+    extracted = extract_all_documents(changed_paths, progress_callback, max_workers)
+    try:
+        for filename, file_path in zip(changed, changed_paths):
+            record, document = files[filename], extracted[file_path]
+            record["chunk_ids"] = [f"{filename}::{record['sha256'][:12]}::{i}" for i in range(document.chunk_count)]
+            record["company_candidates"] = document.company_candidates.to_dict()
+            record["problems"] = list(document.problems)
+            if not document.chunk_count:
+                continue
+            with span("embed", file=filename, chunks=document.chunk_count):
+                # Chunks come back from the spool one batch at a time, so a large file is never fully in memory.
+                start = 0
+                for batch in document.iter_chunk_batches():
+                    batch_ids = record["chunk_ids"][start:start + len(batch)]
+                    start += len(batch)
+                    if vectorstore is None:
+                        from langchain.vectorstores import FAISS
+
+                        vectorstore = FAISS.from_documents(documents=batch, embedding=get_embeddings(), ids=batch_ids)
+                    else:
+                        vectorstore.add_documents(batch, ids=batch_ids)
+    finally:
+        for document in extracted.values():
+            document.discard()
+
+    if not any(record["chunk_ids"] for record in files.values()):
+        vectorstore = None
+    company = resolve_index_company_name(files, representative_snippets(extracted.values()), manifest)
+    manifest = {
+        "version": compute_index_key(settings, files),
+        "settings": settings,
+        "company_name": company["company_name"],
+        "company_name_source": company["company_name_source"],
+        "company_name_guess": company["company_name_guess"],
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "files": files,
+    }
+    with span("publish"):
+        if publish:
+            publish_index_version(vectorstore, manifest, index_dir)
+        else:
+            write_index_version(vectorstore, manifest, index_dir)
+    logger.info(
+        f"{'Published' if publish else 'Wrote'} knowledge-base index {manifest['version']}: "
+        f"{len(changed)} added/changed, {len(removed)} removed, {len(files) - len(changed)} unchanged"
+    )
+    return vectorstore, manifest
+
+class KnowledgeBaseRetriever(BaseRetriever):
+    """Retriever that always searches the knowledge base's live vectorstore."""
+
+    knowledge_base: Any
+    search_kwargs: dict = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.knowledge_base.search(query, **self.search_kwargs)
+
+class KnowledgeBase:
+    """Process-wide handle on the persisted index that can be refreshed without a restart."""
+
+    def __init__(self, data_folder: str, index_dir: str = INDEX_DIR):
+        self.data_folder = data_folder
+        self.index_dir = index_dir
+        self.vectorstore: Optional["FAISS"] = None
+        self.keyword_index: Optional[BM25Index] = None
+        self.company_name = "our company"
+        self.version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._checked_at = float("-inf")
+
+    def refresh(self, progress_callback: Callable[[int, int, str], None] = log_progress) -> None:
+        """Apply data-folder changes to the index and swap the live vectorstore."""
+        with self._lock:
+            with trace("index_update", sample_rate=1.0, data_folder=self.data_folder):
+                try:
+                    vectorstore, manifest = update_index(self.data_folder, self.index_dir, progress_callback)
+                except Exception as e:
+                    logger.error(f"Error updating knowledge-base index: {e}")
+                    raise
+                self._swap(vectorstore, manifest)
+
+    def load(self) -> bool:
+        """Load the published version if it differs from the live one, without building anything.
+
+        Returns:
+            bool: True when a new version was swapped in.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            version = read_current_version(self.index_dir)
+            if version is None:
+                logger.warning(f"No published knowledge-base index in '{self.index_dir}'; run `python ingest.py` to build one")
+                return False
+            if version == self.version:
+                return False
+            with trace("index_load", sample_rate=1.0, version=version):
+                try:
+                    vectorstore, manifest = load_index_version(version, self.index_dir)
+                except Exception as e:
+                    logger.error(f"Error loading knowledge-base index {version}: {e}")
+                    raise
+                self._swap(vectorstore, manifest)
+            logger.info(f"Loaded knowledge-base index {version}")
+            return True
+
+    def sync(self, max_age: float = INDEX_RELOAD_INTERVAL_SECONDS) -> None:
+        """Pick up a newly published version at most every `max_age` seconds; never blocks behind a load in progress."""
+        if time.monotonic() - self._checked_at < max_age or self._lock.locked():
+            return
+        try:
+            self.load()
+        except Exception:
+            # Keep serving the live version; the error is logged and the next check retries.
+            pass
+
+    def _swap(self, vectorstore: Optional["FAISS"], manifest: Dict[str, Any]) -> None:
+        with span("keyword_index"):
+            keyword_index = BM25Index.from_vectorstore(vectorstore)
+        # Readers pick up the new store on their next query; in-flight queries finish on the old one.
+        self.keyword_index = keyword_index
+        self.vectorstore = vectorstore
+        self.company_name = manifest.get("company_name", "our company")
+        self.version = manifest.get("version")
+
+    @property
+    def is_empty(self) -> bool:
+        return self.vectorstore is None
+
+    def search(self, query: str, **search_kwargs) -> List[Document]:
+        """Hybrid keyword and vector search over the live index."""
+        return hybrid_search(query, self.vectorstore, self.keyword_index, **search_kwargs)
+
+    def as_retriever(self, **search_kwargs) -> KnowledgeBaseRetriever:
+        """Return a retriever that follows future refreshes of this knowledge base."""
+        return KnowledgeBaseRetriever(knowledge_base=self, search_kwargs=search_kwargs)
+
+@shared_resource("knowledge_base")
+def get_knowledge_base(data_folder: str) -> KnowledgeBase:
+    """Return the process-wide knowledge base shared by every session.
+
+    The published index is only loaded; building it is the job of `python ingest.py`
+    unless INDEX_BUILD_IN_APP is set.
+    """
+    knowledge_base = KnowledgeBase(data_folder)
+    try:
+        if INDEX_BUILD_IN_APP:
+            knowledge_base.refresh()
+        else:
+            knowledge_base.load()
+    except Exception as e:
+        logger.error(f"Error loading knowledge-base index: {e}")
+        raise
+    return knowledge_base
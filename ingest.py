@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import List, Optional
+from metrics import trace
+from document_processor import get_embeddings
+from vector_quantization import (
+    QUANTIZATION_KINDS, embed_queries, evaluate_quantization, held_out_queries, quantized_index_file, read_exact_index
+)
+from index_manager import (
+    MANIFEST_FILE, discard_index_version, read_current_version, read_publish_log, set_current_version, update_index,
+    verify_index_version
+)
+
+from config import DATA_FOLDER, INDEX_DIR, EXTRACTION_WORKERS, INDEX_QUANTIZATION
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def print_progress(done: int, total: int, file_path: str) -> None:
+    print(f"[{done}/{total}] {os.path.basename(file_path)}", flush=True)
+
+def build(args: argparse.Namespace) -> int:
+    """Build the index from the data folder, verify it, then publish it.
+
+    An interrupted build loses no embedding work: vectors are cached batch by
+    batch, and the live version is untouched until the new one has passed
+    verification, so re-running simply resumes.
+    """
+    if not os.path.isdir(args.data_folder):
+        logger.error(f"Data folder '{args.data_folder}' does not exist")
+        return 1
+    start = time.perf_counter()
+    with trace("index_build", sample_rate=1.0, data_folder=args.data_folder):
+        _, manifest = update_index(args.data_folder, args.index_dir, print_progress, publish=False, max_workers=args.workers)
+    version = manifest["version"]
+    problems = verify_index_version(version, args.index_dir)
+    if problems:
+        for problem in problems:
+            logger.error(f"Verification of index {version} failed: {problem}")
+        discard_index_version(version, args.index_dir)
+        return 1
+    for filename, record in manifest["files"].items():
+        for problem in record.get("problems", []):
+            logger.warning(f"{filename}: {problem}")
+    if args.no_publish:
+        print(f"Built and verified index {version} in {time.perf_counter() - start:.1f}s (not published)")
+        return 0
+    set_current_version(version, args.index_dir)
+    chunks = sum(len(record["chunk_ids"]) for record in manifest["files"].values())
+    print(
+        f"Published index {version}: {len(manifest['files'])} files, {chunks} chunks, "
+        f"company '{manifest.get('company_name')}' in {time.perf_counter() - start:.1f}s"
+    )
+    return 0
+
+def verify(args: argparse.Namespace) -> int:
+    version = args.version or read_current_version(args.index_dir)
+    if version is None:
+        logger.error(f"No published index in '{args.index_dir}'")
+        return 1
+    problems = verify_index_version(version, args.index_dir)
+    for problem in problems:
+        logger.error(f"Index {version}: {problem}")
+    if not problems:
+        print(f"Index {version} is consistent")
+    return 1 if problems else 0
+
+def publish(args: argparse.Namespace) -> int:
+    """Point the live index at an already built version, after verifying it."""
+    problems = verify_index_version(args.version, args.index_dir)
+    if problems:
+        for problem in problems:
+            logger.error(f"Refusing to publish index {args.version}: {problem}")
+        return 1
+    set_current_version(args.version, args.index_dir)
+    print(f"Published index {args.version}")
+    return 0
+
+def status(args: argparse.Namespace) -> int:
+    version = read_current_version(args.index_dir)
+    if version is None:
+        print(f"No published index in '{args.index_dir}'")
+        return 1
+    with open(os.path.join(args.index_dir, version, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    print(json.dumps({
+        "version": version,
+        "updated_at": manifest.get("updated_at"),
+        "company_name": manifest.get("company_name"),
+        "files": len(manifest.get("files", {})),
+        "chunks": sum(len(record["chunk_ids"]) for record in manifest.get("files", {}).values()),
+        "settings": manifest.get("settings"),
+        "problems": {filename: record["problems"] for filename, record in manifest.get("files", {}).items() if record.get("problems")},
+        "quantization": INDEX_QUANTIZATION,
+        "quantized_indexes": [
+            kind for kind in QUANTIZATION_KINDS[1:] if os.path.exists(os.path.join(args.index_dir, version, quantized_index_file(kind)))
+        ],
+        "rollback_versions": list(dict.fromkeys(
+            record["version"] for record in reversed(read_publish_log(args.index_dir))
+            if record["version"] != version and os.path.isdir(os.path.join(args.index_dir, record["version"]))
+        )),
+    }, indent=2))
+    return 0
+
+def recall(args: argparse.Namespace) -> int:
+    """Report recall@k of each quantization against exact search, to choose INDEX_QUANTIZATION.
+
+    Queries come from --queries (one question per line, embedded with the live model) or,
+    by default, are stored chunk vectors held out from their own results.
+    """
+    version = args.version or read_current_version(args.index_dir)
+    if version is None:
+        logger.error(f"No published index in '{args.index_dir}'")
+        return 1
+    index_path = os.path.join(args.index_dir, version)
+    if not os.path.exists(os.path.join(index_path, "index.faiss")):
+        logger.error(f"Index {version} has no vectors")
+        return 1
+    exact = read_exact_index(index_path)
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        queries, exclude = embed_queries(get_embeddings(), questions), None
+    else:
+        queries, exclude = held_out_queries(exact, args.sample)
+    report = evaluate_quantization(exact, queries, args.k, args.kinds, exclude)
+    print(json.dumps({"version": version, "vectors": exact.ntotal, "queries": len(queries), "k": args.k, "results": report}, indent=2))
+    return 0
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build and publish the help-desk knowledge-base index outside the web app.")
+    parser.add_argument("--data-folder", default=DATA_FOLDER)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    commands = parser.add_subparsers(dest="command")
+
+    build_parser = commands.add_parser("build", help="Build, verify and publish the index (default)")
+    build_parser.add_argument("--workers", type=int, default=EXTRACTION_WORKERS, help="Document extraction processes (default: all cores)")
+    build_parser.add_argument("--no-publish", action="store_true", help="Build and verify without switching the live version")
+    build_parser.set_defaults(handler=build)
+
+    verify_parser = commands.add_parser("verify", help="Check a built version (default: the published one)")
+    verify_parser.add_argument("--version")
+    verify_parser.set_defaults(handler=verify)
+
+    publish_parser = commands.add_parser("publish", help="Publish an already built version")
+    publish_parser.add_argument("version")
+    publish_parser.set_defaults(handler=publish)
+
+    commands.add_parser("status", help="Describe the published version").set_defaults(handler=status)
+
+    recall_parser = commands.add_parser("recall", help="Compare quantized indexes with exact search")
+    recall_parser.add_argument("--version")
+    recall_parser.add_argument("--kinds", nargs="+", choices=QUANTIZATION_KINDS[1:], default=list(QUANTIZATION_KINDS[1:]))
+    recall_parser.add_argument("--k", type=int, default=10)
+    recall_parser.add_argument("--queries", help="File of held-out questions, one per line")
+    recall_parser.add_argument("--sample", type=int, default=200, help="Stored vectors to use as queries without --queries")
+    recall_parser.set_defaults(handler=recall)
+    parser.set_defaults(handler=build, workers=EXTRACTION_WORKERS, no_publish=False)
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,365 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-import streamlit as st
+from langchain.schema import BaseRetriever, Document, get_buffer_string
+from conversation_memory import RollingSummaryMemory, estimate_tokens
+from resources import shared_resource
+from metrics import record_duration, record_llm_call, record_tokens, span
+from rate_limiter import TokenBucket, backoff_delay, is_quota_error, is_retryable_error
+import time
+import itertools
+import threading
+import contextvars
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 import logging
+import re
 
-from config import GOOGLE_API_KEY, GEMINI_MODEL_NAME
+from config import (
+    GOOGLE_API_KEY, GEMINI_MODEL_NAME, CONDENSE_QUESTION_WITH_LLM, LLM_MAX_CONCURRENT_REQUESTS, LLM_REQUESTS_PER_MINUTE,
+    LLM_MODEL_LIMITS, LLM_DEFAULT_MODEL_LIMITS, LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-print("Sample log: ", GOOGLE_API_KEY)
-def extract_company_name(text: str) -> str:
-    """Extract the company name from the document text using an LLM."""
-    llm = ChatGoogleGenerativeAI(
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+TONE_LABELS = ("negative", "neutral", "positive")
+TONE_HEADER_PATTERN = re.compile(r"^\s*TONE:\s*(\w+)\s*$", re.IGNORECASE)
+MAX_TONE_HEADER_CHARS = 40
+FOLLOW_UP_WORDS = {"it", "its", "that", "this", "those", "these", "they", "them", "there", "he", "she", "one"}
+# Gateway lanes in priority order: answers a user is waiting for go ahead of background work.
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+T = TypeVar("T")
+
+def model_name(client: Any) -> str:
+    """Short model name of a LangChain chat model or Gemini SDK model, e.g. "gemini-2.0-flash"."""
+    name = getattr(client, "model", None) or getattr(client, "model_name", None) or type(client).__name__
+    return str(name).split("/")[-1]
+
+class SharedCall:
+    """One in-flight gateway call whose result, or stream of chunks, is shared by identical requests."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.chunks: List[Any] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+    def put(self, chunk: Any) -> None:
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            self.result, self.error, self.done = result, error, True
+            self._condition.notify_all()
+
+    def wait(self) -> Any:
+        with self._condition:
+            while not self.done:
+                self._condition.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def iter_chunks(self) -> Iterator[Any]:
+        """Replay the chunks produced so far, then follow the stream until it ends."""
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.chunks) and not self.done:
+                    self._condition.wait()
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            yield chunk
+
+class LLMGateway:
+    """Process-wide scheduler that every LLM call goes through.
+
+    Calls are admitted in lane priority order, subject to a concurrency cap, a global
+    requests-per-minute bucket and per-model request and token buckets. Transient
+    failures are retried with jittered exponential backoff, and a quota error pauses
+    every caller of that model for the backoff. Identical prompts already in flight
+    share one call. Queue wait and call latency are recorded per purpose.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENT_REQUESTS,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        model_limits: Dict[str, Dict[str, float]] = LLM_MODEL_LIMITS,
+        default_model_limits: Dict[str, float] = LLM_DEFAULT_MODEL_LIMITS,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits
+        self.default_model_limits = default_model_limits
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._requests = TokenBucket(rate=requests_per_minute / 60.0, capacity=max(1.0, max_concurrency))
+        self._model_buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._cooldown_until: Dict[str, float] = {}
+        self._condition = threading.Condition()
+        self._waiting: Dict[Tuple[int, int], Tuple[str, float]] = {}
+        self._sequence = itertools.count()
+        self._active = 0
+        self._in_flight: Dict[Tuple[str, str, str], SharedCall] = {}
+        self._in_flight_lock = threading.Lock()
+
+    def _buckets(self, model: str) -> Tuple[TokenBucket, TokenBucket]:
+        """(requests, tokens) buckets for a model, created on first use. Call with the condition held."""
+        if model not in self._model_buckets:
+            limits = self.model_limits.get(model, self.default_model_limits)
+            self._model_buckets[model] = (
+                TokenBucket(rate=limits["requests_per_minute"] / 60.0, capacity=max(1.0, self.max_concurrency)),
+                TokenBucket(rate=limits["tokens_per_minute"] / 60.0),
+            )
+        return self._model_buckets[model]
+
+    def _ready_in(self, model: str, cost: float) -> float:
+        """Seconds until a call to `model` costing `cost` tokens could be admitted, ignoring the concurrency cap."""
+        requests, tokens = self._buckets(model)
+        return max(
+            self._cooldown_until.get(model, 0.0) - time.monotonic(),
+            self._requests.wait_time(),
+            requests.wait_time(),
+            tokens.wait_time(min(cost, tokens.capacity)),
+        )
+
+    def _admit(self, model: str, cost: float, lane: str, purpose: str) -> None:
+        """Block until this call is the highest-priority one that can run, then take its slot and tokens."""
+        start = time.perf_counter()
+        with self._condition:
+            ticket = (LANES.index(lane), next(self._sequence))
+            self._waiting[ticket] = (model, cost)
+            try:
+                while True:
+                    timeout = None
+                    if self._active < self.max_concurrency:
+                        for candidate in sorted(self._waiting):
+                            delay = self._ready_in(*self._waiting[candidate])
+                            if delay <= 0:
+                                break
+                            timeout = delay if timeout is None else min(timeout, delay)
+                        else:
+                            candidate = None
+                        if candidate == ticket:
+                            break
+                        if candidate is not None:
+                            # A higher-priority or older call can go first; let it take the slot.
+                            self._condition.notify_all()
+                    self._condition.wait(timeout)
+            finally:
+                del self._waiting[ticket]
+            requests, tokens = self._buckets(model)
+            self._requests.try_acquire()
+            requests.try_acquire()
+            tokens.try_acquire(min(cost, tokens.capacity))
+            self._active += 1
+            self._condition.notify_all()
+        record_duration("llm_queue", time.perf_counter() - start, lane=lane, purpose=purpose)
+
+    def _release(self) -> None:
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def _back_off(self, model: str, error: Exception, attempt: int, lane: str, purpose: str) -> None:
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        logger.warning(f"Retrying {purpose} call to {model} in {delay:.1f}s after error: {error}")
+        record_llm_call(purpose, lane, "retry")
+        if is_quota_error(error):
+            # Admission waits out the cooldown, so every caller of this model backs off together.
+            with self._condition:
+                self._cooldown_until[model] = max(self._cooldown_until.get(model, 0.0), time.monotonic() + delay)
+                self._condition.notify_all()
+        else:
+            time.sleep(delay)
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        return attempt < self.max_retries and is_retryable_error(error)
+
+    def _join(self, key: Optional[Tuple[str, str, str]]) -> Tuple[SharedCall, bool]:
+        """Return the in-flight call for `key` and whether the caller must run it (is its leader)."""
+        with self._in_flight_lock:
+            if key is not None and key in self._in_flight:
+                return self._in_flight[key], False
+            shared = SharedCall()
+            if key is not None:
+                self._in_flight[key] = shared
+            return shared, True
+
+    def _finish(self, key: Optional[Tuple[str, str, str]], shared: SharedCall, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._in_flight_lock:
+            if key is not None and self._in_flight.get(key) is shared:
+                del self._in_flight[key]
+        shared.finish(result, error)
+
+    def call(
+        self,
+        func: Callable[[], T],
+        model: str,
+        prompt: str = "",
+        lane: str = INTERACTIVE,
+        purpose: str = "llm",
+        coalesce: bool = True,
+    ) -> T:
+        """Run one LLM request through the gateway and return its result.
+
+        Args:
+            prompt (str): Used to estimate the token cost and, with `coalesce`, to share
+                the result with identical requests already in flight.
+        """
+        key = ("call", model, prompt) if coalesce and prompt else None
+        shared, leader = self._join(key)
+        if not leader:
+            record_llm_call(purpose, lane, "coalesced")
+            return shared.wait()
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                self._admit(model, estimate_tokens(prompt), lane, purpose)
+                try:
+                    result = func()
+                    break
+                except Exception as e:
+                    if not self._should_retry(e, attempt):
+                        raise
+                    error = e
+                finally:
+                    self._release()
+                self._back_off(model, error, attempt, lane, purpose)
+                attempt += 1
+        except BaseException as e:
+            record_llm_call(purpose, lane, "error")
+            self._finish(key, shared, error=e)
+            raise
+        record_duration(f"llm_{purpose}", time.perf_counter() - start, model=model, lane=lane, attempts=attempt + 1)
+        record_llm_call(purpose, lane, "ok")
+        self._finish(key, shared, result=result)
+        return result
+
+    def stream(
+        self,
+        func: Callable[[], Iterable[T]],
+        model: str,
+        prompt: str = "",
+        lane: str = INTERACTIVE,
+        purpose: str = "llm",
+        coalesce: bool = True,
+    ) -> Iterator[T]:
+        """Run a streaming LLM request through the gateway, yielding its chunks.
+
+        The request is driven on its own thread so that every caller sharing it sees the
+        same chunks at their own pace. It is retried only if it fails before its first chunk.
+        """
+        key = ("stream", model, prompt) if coalesce and prompt else None
+        shared, leader = self._join(key)
+        if leader:
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._drive_stream, func, key, shared, model, prompt, lane, purpose),
+                name=f"llm-{purpose}",
+                daemon=True,
+            ).start()
+        else:
+            record_llm_call(purpose, lane, "coalesced")
+        return shared.iter_chunks()
+
+    def _drive_stream(
+        self, func: Callable[[], Iterable[Any]], key: Optional[Tuple[str, str, str]], shared: SharedCall, model: str, prompt: str, lane: str, purpose: str
+    ) -> None:
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                self._admit(model, estimate_tokens(prompt), lane, purpose)
+                try:
+                    for chunk in func():
+                        shared.put(chunk)
+                    break
+                except Exception as e:
+                    if shared.chunks or not self._should_retry(e, attempt):
+                        raise
+                    error = e
+                finally:
+                    self._release()
+                self._back_off(model, error, attempt, lane, purpose)
+                attempt += 1
+        except BaseException as e:
+            record_llm_call(purpose, lane, "error")
+            self._finish(key, shared, error=e)
+            return
+        record_duration(f"llm_{purpose}", time.perf_counter() - start, model=model, lane=lane, attempts=attempt + 1)
+        record_llm_call(purpose, lane, "ok")
+        self._finish(key, shared)
+
+    def client(self, llm: Any, lane: str = INTERACTIVE, purpose: str = "llm") -> "GatedChatModel":
+        return GatedChatModel(llm, self, lane, purpose)
+
+class GatedChatModel:
+    """Chat-model facade whose `invoke` and `stream` calls go through the LLM gateway."""
+
+    def __init__(self, llm: Any, gateway: LLMGateway, lane: str = INTERACTIVE, purpose: str = "llm"):
+        self.llm = llm
+        self.gateway = gateway
+        self.lane = lane
+        self.purpose = purpose
+        self.model = model_name(llm)
+
+    def invoke(self, prompt: str, purpose: Optional[str] = None) -> Any:
+        return self.gateway.call(lambda: self.llm.invoke(prompt), self.model, prompt, self.lane, purpose or self.purpose)
+
+    def stream(self, prompt: str, purpose: Optional[str] = None) -> Iterator[Any]:
+        return self.gateway.stream(lambda: self.llm.stream(prompt), self.model, prompt, self.lane, purpose or self.purpose)
+
+@shared_resource("llm_gateway")
+def get_llm_gateway() -> LLMGateway:
+    """Return the process-wide LLM gateway."""
+    return LLMGateway()
+
+@shared_resource("chat_model")
+def get_chat_model() -> "ChatGoogleGenerativeAI":
+    """Return the Gemini chat client shared by every session in this process."""
+    # The Gemini SDK takes about a second to import, so it loads on first use rather than at startup.
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
         model=GEMINI_MODEL_NAME,
         google_api_key=GOOGLE_API_KEY,
         convert_system_message_to_human=True
     )
-    
-    first_paragraphs = text[:1000]  # Limit to first 1000 characters
+
+def extract_company_name(snippets: List[str]) -> str:
+    """Identify the company name from a few representative document snippets in a single LLM call."""
+    llm = get_llm_gateway().client(get_chat_model(), BACKGROUND, "company_name")
+
+    excerpts = "\n\n".join(f"Excerpt {i}:\n{snippet}" for i, snippet in enumerate(snippets, 1))
     prompt = (
-        "You are an expert at extracting information from text. Given the following text from a company document, "
+        "You are an expert at extracting information from text. Given the following excerpts from one company's documents, "
         "identify the name of the company. The company name may appear in titles, introductions, or as part of phrases "
         "like 'About [Company]', 'Welcome to [Company]', or as a proper noun with terms like 'Inc.', 'LLC', 'Corp', etc. "
         "Return only the company name as a string. If no company name is found, return 'our company'.\n\n"
-        f"Text: {first_paragraphs}\n\n"
+        f"{excerpts}\n\n"
         "Company Name:"
     )
-    
+
     try:
         response = llm.invoke(prompt)
         company_name = response.content.strip()
@@ -37,17 +368,224 @@ def extract_company_name(text: str) -> str:
         return "our company"
     except Exception as e:
         logger.error(f"Error extracting company name with LLM: {e}")
-        st.error(f"Error extracting company name with LLM: {e}")
         return "our company"
 
-def create_conversational_chain(vectorstore, company_name: str) -> ConversationalRetrievalChain:
-    """Create a conversational retrieval chain for the chatbot."""
-    llm = ChatGoogleGenerativeAI(
-        model=GEMINI_MODEL_NAME,
-        google_api_key=GOOGLE_API_KEY,
-        convert_system_message_to_human=True
+def split_tone_header(text: str) -> tuple[Optional[str], str]:
+    """Split a leading "TONE: <label>" line off a response.
+
+    Returns:
+        tuple: (tone label or None if the header is missing, remaining text)
+    """
+    line, _, rest = text.partition("\n")
+    match = TONE_HEADER_PATTERN.match(line)
+    if match and match.group(1).lower() in TONE_LABELS:
+        return match.group(1).lower(), rest.lstrip()
+    return None, text
+
+def is_follow_up(question: str) -> bool:
+    """Whether a question is short or refers back to earlier turns."""
+    words = re.findall(r"[a-z']+", question.lower())
+    return len(words) <= 6 or bool(FOLLOW_UP_WORDS.intersection(words))
+
+def local_condense_question(question: str, chat_messages: List[Any]) -> str:
+    """Build a standalone retrieval query for follow-ups without an LLM call.
+
+    Short questions and questions that refer back ("how do I reset it?") are
+    searched together with the user's previous question.
+    """
+    previous_question = next((message.content for message in reversed(chat_messages) if message.type == "human"), "")
+    if previous_question and is_follow_up(question):
+        return f"{previous_question}\n{question}"
+    return question
+
+def describe_source(metadata: Dict[str, Any]) -> str:
+    """Human-readable citation for a chunk, e.g. "pricing.pdf, page 3 (Refunds)"."""
+    label = metadata.get("source") or ""
+    if metadata.get("page") is not None:
+        label += f", page {metadata['page']}"
+    if metadata.get("heading"):
+        label += f" ({metadata['heading']})"
+    return label
+
+def format_context(docs: List[Document]) -> str:
+    """Join retrieved chunks for the QA prompt, each labelled with its source."""
+    sections = []
+    for doc in docs:
+        label = describe_source(doc.metadata)
+        sections.append(f"[Source: {label}]\n{doc.page_content}" if label else doc.page_content)
+    return "\n\n".join(sections)
+
+class AnswerStream:
+    """Iterable over answer tokens that exposes the parsed tone label and full answer once consumed."""
+
+    def __init__(
+        self,
+        chunks: Iterator[str],
+        on_complete: Callable[["AnswerStream"], None],
+        tone: Optional[str] = None,
+        cached: bool = False,
+        prompt_tokens: int = 0,
+        sources: Optional[List[str]] = None
+    ):
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self.tone = tone
+        self.cached = cached
+        self.prompt_tokens = prompt_tokens
+        self.sources = sources or []
+        self.answer = ""
+
+    def __iter__(self) -> Iterator[str]:
+        header = ""
+        # Cached answers were stored without their TONE header.
+        header_done = self.cached
+        answer_parts = []
+        for chunk in self._chunks:
+            if not header_done:
+                header += chunk
+                if "\n" not in header and len(header) < MAX_TONE_HEADER_CHARS:
+                    continue
+                self.tone, chunk = split_tone_header(header)
+                header_done = True
+                if not chunk:
+                    continue
+            answer_parts.append(chunk)
+            yield chunk
+        if not header_done and header:
+            self.tone, chunk = split_tone_header(header)
+            if chunk:
+                answer_parts.append(chunk)
+                yield chunk
+        self.answer = "".join(answer_parts).strip()
+        self._on_complete(self)
+
+class ConversationalChain:
+    """Retrieval-augmented help-desk chain that answers and classifies tone in one streamed LLM call.
+
+    The QA prompt asks the model to lead with a "TONE: <label>" line, which is
+    parsed off the stream. Follow-up questions are condensed locally unless
+    `condense_with_llm` is set.
+    """
+
+    def __init__(
+        self,
+        llm: GatedChatModel,
+        retriever: BaseRetriever,
+        qa_prompt: PromptTemplate,
+        memory: RollingSummaryMemory,
+        condense_with_llm: bool = CONDENSE_QUESTION_WITH_LLM,
+        answer_cache=None,
+        index_version: Callable[[], Optional[str]] = lambda: None
+    ):
+        self.llm = llm
+        self.retriever = retriever
+        self.qa_prompt = qa_prompt
+        self.memory = memory
+        self.condense_with_llm = condense_with_llm
+        self.answer_cache = answer_cache
+        self.index_version = index_version
+
+    def _condense_question(self, question: str, chat_messages: List[Any]) -> str:
+        """Rewrite a follow-up question as a standalone search query."""
+        if not chat_messages:
+            return question
+        if not self.condense_with_llm:
+            return local_condense_question(question, chat_messages)
+        from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+
+        response = self.llm.invoke(
+            CONDENSE_QUESTION_PROMPT.format(chat_history=get_buffer_string(chat_messages), question=question), purpose="condense"
+        )
+        return response.content.strip() or question
+
+    def _build_prompt(self, question: str, chat_messages: List[Any]) -> tuple[str, List[Document]]:
+        with span("condense"):
+            query = self._condense_question(question, chat_messages)
+        with span("retrieval"):
+            docs = self.retriever.get_relevant_documents(query)
+        prompt = self.qa_prompt.format(
+            chat_history=get_buffer_string(chat_messages),
+            context=format_context(docs),
+            question=question
+        )
+        return prompt, docs
+
+    def _generate(self, prompt: str) -> Iterator[str]:
+        start = time.perf_counter()
+        first_token_at = None
+        completion_chars = 0
+        usage = None
+        for chunk in self.llm.stream(prompt):
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    record_duration("generation_first_token", first_token_at - start)
+                completion_chars += len(chunk.content)
+                yield chunk.content
+        record_duration("generation", time.perf_counter() - start)
+        if usage:
+            record_tokens("generation", usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+        else:
+            record_tokens("generation", estimate_tokens(prompt), (completion_chars + 3) // 4)
+
+    def stream(self, question: str) -> AnswerStream:
+        """Stream answer tokens; the tone label is available and the turn saved to memory once consumed.
+
+        Standalone questions are served from the answer cache when a near-duplicate
+        was answered against the same knowledge-base version. Only answers whose prompt
+        carried no chat history and whose asker sounded neutral are stored, and a cached
+        answer carries no tone, so one user's conversation never shapes another's turn.
+        """
+        chat_messages = self.memory.load_memory_variables({})["chat_history"]
+        cacheable = self.answer_cache is not None and not (chat_messages and is_follow_up(question))
+        version = self.index_version() if cacheable else None
+
+        def on_complete(result: AnswerStream) -> None:
+            self.memory.save_context({"question": question}, {"answer": result.answer})
+            if cacheable and not result.cached and not chat_messages and result.tone == "neutral":
+                try:
+                    self.answer_cache.store(question, result.answer, version)
+                except Exception as e:
+                    logger.error(f"Error caching answer: {e}")
+
+        if cacheable:
+            try:
+                with span("answer_cache"):
+                    cached = self.answer_cache.lookup(question, version)
+            except Exception as e:
+                logger.error(f"Error looking up answer cache: {e}")
+                cached = None
+            if cached is not None:
+                return AnswerStream(iter([cached.answer]), on_complete, cached=True)
+        prompt, docs = self._build_prompt(question, chat_messages)
+        prompt_tokens = estimate_tokens(prompt)
+        logger.info(f"Prompt size: ~{prompt_tokens} tokens (history ~{self.memory.token_count()} tokens)")
+        sources = list(dict.fromkeys(describe_source(doc.metadata) for doc in docs if doc.metadata.get("source")))
+        return AnswerStream(self._generate(prompt), on_complete, prompt_tokens=prompt_tokens, sources=sources)
+
+    def __call__(self, inputs: Dict[str, Any]) -> Dict[str, Optional[str]]:
+        """Answer without streaming, returning {"answer": ..., "tone": ...}."""
+        result = self.stream(inputs["question"])
+        for _ in result:
+            pass
+        return {"answer": result.answer, "tone": result.tone}
+
+def summarize_support_conversation(user_concern: str, conversation: str) -> str:
+    """Summarize a help-desk conversation for the support ticket."""
+    llm = get_llm_gateway().client(get_chat_model(), BACKGROUND, "support_summary")
+    prompt = (
+        "You are preparing a support ticket. Summarize the following help-desk conversation for a support agent "
+        "in at most five bullet points: what the user needs, what they already tried or were told, and what is still unresolved.\n\n"
+        f"User's concern: {user_concern}\n\n"
+        f"Conversation:\n{conversation}\n\n"
+        "Summary:"
     )
-    
+    return llm.invoke(prompt).content.strip()
+
+@lru_cache(maxsize=16)
+def build_qa_prompt(company_name: str) -> PromptTemplate:
+    """Build the help-desk QA prompt for a company."""
     custom_template = f"""You are the primary AI assistant for {company_name}, designed to deliver exceptional support with accuracy and emotional intelligence.
 
 # Core Responsibilities
@@ -73,6 +611,9 @@ def create_conversational_chain(vectorstore, company_name: str) -> Conversationa
 # Current Interaction
 User: {{question}}
 
+# Response Format
+Begin your reply with exactly one line of the form "TONE: <label>", where <label> is "negative" if the user's current message expresses frustration, dissatisfaction, anger, confusion, or disappointment, "positive" if it is clearly satisfied or appreciative, and "neutral" otherwise. Then write your response to the user on the following lines. Do not mention the TONE line in your response.
+
 # Response Strategy
 1. **Analyze Tone and Satisfaction**:
    - Detect the user's emotional state (e.g., satisfied, neutral, frustrated) based on their message.
@@ -86,28 +627,44 @@ User: {{question}}
 
 Response:"""
     
-    QA_PROMPT = PromptTemplate(
-        template=custom_template, 
+    return PromptTemplate(
+        template=custom_template,
         input_variables=["chat_history", "context", "question"]
     )
-    
-    memory = ConversationBufferMemory(
-        memory_key='chat_history',
-        return_messages=True,
-        output_key='answer',
-        input_key='question'
-    )
-    
+
+def create_memory(chat_history: Optional[List[Dict[str, str]]] = None) -> RollingSummaryMemory:
+    """Create a session's conversation memory, seeded with its stored history.
+
+    Summary folds only run from the engine's background fold threads, never inside
+    a user's turn, so they take the background lane.
+    """
+    memory = RollingSummaryMemory(get_llm_gateway().client(get_chat_model(), BACKGROUND, "memory_summary"))
+    memory.seed(chat_history)
+    return memory
+
+def create_conversational_chain(
+    knowledge_base,
+    company_name: str,
+    answer_cache=None,
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    memory: Optional[RollingSummaryMemory] = None
+) -> ConversationalChain:
+    """Create a conversational retrieval chain over the live knowledge base.
+
+    The chain only binds shared resources to a session's memory, so it is cheap
+    to build per turn; pass `memory` to continue an existing conversation.
+    """
     try:
-        chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=vectorstore.as_retriever(),
-            memory=memory,
-            combine_docs_chain_kwargs={"prompt": QA_PROMPT}
+        chain = ConversationalChain(
+            llm=get_llm_gateway().client(get_chat_model(), INTERACTIVE, "answer"),
+            retriever=knowledge_base.as_retriever(),
+            qa_prompt=build_qa_prompt(company_name),
+            memory=memory if memory is not None else create_memory(chat_history),
+            answer_cache=answer_cache,
+            index_version=lambda: knowledge_base.version
         )
-        logger.info("Conversational chain created successfully")
+        logger.debug("Conversational chain created successfully")
         return chain
     except Exception as e:
         logger.error(f"Error creating conversational chain: {e}")
-        st.error(f"Error creating conversational chain: {e}")
         raise
\ No newline at end of file
@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import METRICS_ENABLED, METRICS_SAMPLE_RATE, METRICS_TRACE_LOG_PATH, METRICS_LATENCY_BUCKETS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = "helpdesk_stage_seconds"
+TOKENS_TOTAL = "helpdesk_tokens_total"
+CACHE_REQUESTS_TOTAL = "helpdesk_cache_requests_total"
+LLM_CALLS_TOTAL = "helpdesk_llm_calls_total"
+DESCRIPTIONS = {
+    STAGE_SECONDS: "Latency of help-desk pipeline stages in seconds.",
+    TOKENS_TOTAL: "Estimated LLM tokens by stage and direction.",
+    CACHE_REQUESTS_TOTAL: "Cache lookups by cache and result.",
+    LLM_CALLS_TOTAL: "LLM gateway calls by purpose, lane and outcome (ok, error, retry, coalesced).",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{escape_label(value)}"' for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style."""
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile (upper bound of the bucket holding it, or the largest observation past the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, exportable as Prometheus text or JSON."""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly snapshot with per-series count, mean and approximate p50/p95/p99."""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "timestamp": time.time(),
+                "counters": {
+                    name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [
+                        {
+                            "labels": dict(labels),
+                            "count": histogram.count,
+                            "sum": histogram.sum,
+                            "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                            "p50": histogram.quantile(0.5),
+                            "p95": histogram.quantile(0.95),
+                            "p99": histogram.quantile(0.99),
+                        }
+                        for labels, histogram in series.items()
+                    ]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+METRICS = MetricsRegistry()
+
+class Trace:
+    """Spans, token counts and attributes of one traced operation (a chat turn or an index update)."""
+
+    def __init__(self, name: str, sampled: bool, **attributes):
+        self.name = name
+        self.sampled = sampled
+        self.attributes = attributes
+        self.spans: List[Dict[str, Any]] = []
+        self.tokens: Dict[str, int] = {}
+        self.started_at = time.time()
+
+    def to_dict(self, duration: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": self.attributes,
+            "spans": self.spans,
+            "tokens": self.tokens,
+        }
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_log_lock = threading.Lock()
+
+def _recording() -> bool:
+    """Whether spans in the current context should be recorded."""
+    if not METRICS_ENABLED:
+        return False
+    current = _current_trace.get()
+    return current is None or current.sampled
+
+@contextmanager
+def trace(name: str, sample_rate: float = METRICS_SAMPLE_RATE, **attributes) -> Iterator[Trace]:
+    """Trace an operation. Only a `sample_rate` fraction of traces records spans, keeping production overhead low.
+
+    Sampled traces are appended as JSON lines to METRICS_TRACE_LOG_PATH.
+    """
+    current = Trace(name, METRICS_ENABLED and random.random() < sample_rate, **attributes)
+    previous = _current_trace.get()
+    _current_trace.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        # Restore by value rather than token: generators may finish in another context.
+        _current_trace.set(previous)
+        if current.sampled:
+            duration = time.perf_counter() - start
+            METRICS.observe(STAGE_SECONDS, duration, stage=name)
+            write_trace(current.to_dict(duration))
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[None]:
+    """Time a pipeline stage into the stage-latency histogram and the current trace."""
+    if not _recording():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_duration(stage, time.perf_counter() - start, **attributes)
+
+def record_duration(stage: str, seconds: float, **attributes) -> None:
+    """Record a stage duration measured elsewhere (e.g. in a worker process or across yields)."""
+    if not _recording():
+        return
+    METRICS.observe(STAGE_SECONDS, seconds, stage=stage)
+    current = _current_trace.get()
+    if current is not None:
+        current.spans.append({"stage": stage, "ms": round(seconds * 1000, 3), **attributes})
+
+def record_tokens(stage: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+    if not METRICS_ENABLED:
+        return
+    if prompt_tokens:
+        METRICS.inc(TOKENS_TOTAL, prompt_tokens, stage=stage, direction="prompt")
+    if completion_tokens:
+        METRICS.inc(TOKENS_TOTAL, completion_tokens, stage=stage, direction="completion")
+    current = _current_trace.get()
+    if current is not None and current.sampled:
+        current.tokens[f"{stage}_prompt"] = current.tokens.get(f"{stage}_prompt", 0) + prompt_tokens
+        current.tokens[f"{stage}_completion"] = current.tokens.get(f"{stage}_completion", 0) + completion_tokens
+
+def record_cache(cache: str, hit: bool, amount: int = 1) -> None:
+    """Count cache hits and misses. Counters are always kept, sampled or not."""
+    if METRICS_ENABLED and amount:
+        METRICS.inc(CACHE_REQUESTS_TOTAL, amount, cache=cache, result="hit" if hit else "miss")
+
+def record_llm_call(purpose: str, lane: str, outcome: str) -> None:
+    """Count LLM gateway calls. Counters are always kept, sampled or not."""
+    if METRICS_ENABLED:
+        METRICS.inc(LLM_CALLS_TOTAL, purpose=purpose, lane=lane, outcome=outcome)
+
+def annotate(**attributes) -> None:
+    """Attach attributes (e.g. cached=True, tone="negative") to the current trace."""
+    current = _current_trace.get()
+    if current is not None and current.sampled:
+        current.attributes.update(attributes)
+
+def write_trace(record: Dict[str, Any], path: Optional[str] = METRICS_TRACE_LOG_PATH) -> None:
+    if not path:
+        return
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps(record, default=str)
+        with _log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logger.error(f"Error writing trace log: {e}")
@@ -0,0 +1,111 @@
+import time
+import random
+import threading
+import logging
+from typing import Callable, TypeVar
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "TimeoutError",
+    "ConnectionError",
+}
+RETRYABLE_ERROR_MARKERS = ("429", "quota", "rate limit", "resource exhausted", "503", "unavailable", "timed out")
+QUOTA_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests"}
+QUOTA_ERROR_MARKERS = ("429", "quota", "rate limit", "resource exhausted")
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` tokens per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if they are available right now."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` would be available, without taking them."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until tokens are available and take them.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+def is_retryable_error(error: Exception) -> bool:
+    """Whether an API error is a transient quota, availability or network failure."""
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RETRYABLE_ERROR_MARKERS)
+
+def is_quota_error(error: Exception) -> bool:
+    """Whether an API error means the caller is over its rate or quota (HTTP 429)."""
+    if type(error).__name__ in QUOTA_ERROR_NAMES:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in QUOTA_ERROR_MARKERS)
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 30.0) -> float:
+    """Exponential backoff with full jitter for the given zero-based attempt."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def call_with_retries(
+    func: Callable[..., T],
+    *args,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    retry_on: Callable[[Exception], bool] = is_retryable_error,
+    **kwargs,
+) -> T:
+    """Call `func`, retrying transient failures with exponential backoff and jitter."""
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not retry_on(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"Retrying {getattr(func, '__name__', func)} in {delay:.1f}s after error: {e}")
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,103 @@
+import atexit
+import threading
+import logging
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ResourceRegistry:
+    """Process-wide registry of heavy, thread-safe resources (LLM clients, stores, indexes).
+
+    Each resource is created lazily on first use, exactly once per process and
+    argument tuple, and shared by every session and worker thread. `reload`
+    disposes an instance so the next `get` builds a fresh one, and `close_all`
+    runs the registered close hooks at shutdown.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[..., Any]] = {}
+        self._closers: Dict[str, Optional[Callable[[Any], None]]] = {}
+        self._reload_hooks: Dict[str, List[Callable[[], None]]] = {}
+        self._instances: Dict[Tuple[str, tuple], Any] = {}
+        self._creation_locks: Dict[Tuple[str, tuple], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self, name: str, factory: Callable[..., Any], close: Optional[Callable[[Any], None]] = None, replace: bool = True
+    ) -> None:
+        """Register a resource factory. With `replace=False` an existing registration (e.g. a test override) wins."""
+        with self._lock:
+            if not replace and name in self._factories:
+                return
+            self._factories[name] = factory
+            self._closers[name] = close
+
+    def get(self, name: str, *args) -> Any:
+        """Return the shared instance, creating it on first use."""
+        key = (name, args)
+        instance = self._instances.get(key)
+        if instance is not None:
+            return instance
+        with self._lock:
+            creation_lock = self._creation_locks.setdefault(key, threading.Lock())
+        # Creation happens outside the registry lock so slow factories don't block other resources.
+        with creation_lock:
+            instance = self._instances.get(key)
+            if instance is None:
+                logger.info(f"Initializing shared resource '{name}'")
+                instance = self._factories[name](*args)
+                self._instances[key] = instance
+        return instance
+
+    def is_initialized(self, name: str, *args) -> bool:
+        return (name, args) in self._instances
+
+    def on_reload(self, name: str, callback: Callable[[], None]) -> None:
+        """Run a callback whenever the named resource is reloaded."""
+        with self._lock:
+            self._reload_hooks.setdefault(name, []).append(callback)
+
+    def close(self, name: str) -> None:
+        """Dispose every instance of a resource."""
+        with self._lock:
+            instances = [(key, self._instances.pop(key)) for key in list(self._instances) if key[0] == name]
+            closer = self._closers.get(name)
+        for key, instance in instances:
+            if closer is None:
+                continue
+            try:
+                closer(instance)
+            except Exception as e:
+                logger.error(f"Error closing shared resource '{name}': {e}")
+
+    def reload(self, name: str) -> None:
+        """Dispose a resource so the next access rebuilds it, then notify reload hooks."""
+        self.close(name)
+        for callback in self._reload_hooks.get(name, []):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in reload hook for '{name}': {e}")
+        logger.info(f"Reloaded shared resource '{name}'")
+
+    def close_all(self) -> None:
+        for name in list(self._factories):
+            self.close(name)
+
+registry = ResourceRegistry()
+atexit.register(registry.close_all)
+
+def shared_resource(name: str, close: Optional[Callable[[Any], None]] = None) -> Callable:
+    """Decorator turning a factory into a getter for a lazily created, process-wide resource."""
+    def decorator(factory: Callable[..., Any]) -> Callable[..., Any]:
+        # Modules are imported lazily, so an override may be registered before its defining module loads.
+        registry.register(name, factory, close, replace=False)
+
+        @wraps(factory)
+        def getter(*args) -> Any:
+            return registry.get(name, *args)
+        return getter
+    return decorator
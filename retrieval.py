@@ -0,0 +1,166 @@
+import re
+import math
+import logging
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from langchain.schema import Document
+
+from config import (
+    RETRIEVAL_K, RETRIEVAL_FETCH_K, RETRIEVAL_USE_MMR, RETRIEVAL_MMR_LAMBDA,
+    RETRIEVAL_RRF_K, RETRIEVAL_RERANK, RETRIEVAL_MODE
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    from langchain.vectorstores import FAISS
+
+# Keeps identifiers such as "ERR-1042", "PX-200" or "v2.3" intact as single tokens.
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in", "is",
+    "it", "me", "my", "of", "on", "or", "our", "the", "to", "was", "we", "what", "when", "where", "which", "who",
+    "why", "will", "with", "you", "your",
+}
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase keyword tokens; compound identifiers also contribute their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-_./]", token) if part and part not in STOPWORDS)
+    return tokens
+
+def is_identifier(token: str) -> bool:
+    """Whether a token looks like a product code, error number or policy ID."""
+    if token.isdigit():
+        return len(token) >= 3
+    return any(ch.isdigit() for ch in token) and any(ch.isalpha() or ch in "-_./" for ch in token)
+
+def document_key(doc: Document) -> Tuple[Optional[str], str]:
+    return doc.metadata.get("source"), doc.page_content
+
+def matches_filter(doc: Document, metadata_filter: Optional[Dict[str, Any]]) -> bool:
+    """Whether a chunk's metadata matches every key of the filter (a list value matches any of its items)."""
+    if not metadata_filter:
+        return True
+    for key, expected in metadata_filter.items():
+        value = doc.metadata.get(key)
+        if isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+class BM25Index:
+    """In-process Okapi BM25 inverted index over the knowledge-base chunks."""
+
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths: List[int] = []
+        for doc_index, doc in enumerate(documents):
+            counts = Counter(tokenize(doc.page_content))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings[term].append((doc_index, frequency))
+        self.average_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: Optional["FAISS"]) -> "BM25Index":
+        """Index the chunks stored in a FAISS vectorstore's docstore."""
+        if vectorstore is None:
+            return cls([])
+        documents = [vectorstore.docstore.search(doc_id) for doc_id in vectorstore.index_to_docstore_id.values()]
+        return cls([doc for doc in documents if isinstance(doc, Document)])
+
+    def search(self, query: str, k: int, metadata_filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Return the top-k chunks by BM25 score, restricted to chunks matching the metadata filter."""
+        if not self.documents:
+            return []
+        scores: Dict[int, float] = defaultdict(float)
+        total = len(self.documents)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, frequency in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_index] / (self.average_length or 1)
+                scores[doc_index] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if metadata_filter:
+            ranked = [(doc_index, score) for doc_index, score in ranked if matches_filter(self.documents[doc_index], metadata_filter)]
+        return [(self.documents[doc_index], score) for doc_index, score in ranked[:k]]
+
+def rerank(query: str, documents: List[Document], fused_scores: Dict[Tuple[Optional[str], str], float]) -> List[Document]:
+    """Lightweight local reranker: fused score boosted by query-term coverage and exact identifier matches."""
+    query_terms = set(tokenize(query))
+    if not query_terms:
+        return documents
+    identifiers = {term for term in query_terms if is_identifier(term)}
+
+    def score(doc: Document) -> float:
+        doc_terms = set(tokenize(doc.page_content))
+        coverage = len(query_terms & doc_terms) / len(query_terms)
+        identifier_hits = len(identifiers & doc_terms)
+        return fused_scores[document_key(doc)] * (1 + coverage) + 0.05 * identifier_hits
+
+    return sorted(documents, key=score, reverse=True)
+
+def hybrid_search(
+    query: str,
+    vectorstore: Optional["FAISS"],
+    keyword_index: Optional[BM25Index],
+    k: int = RETRIEVAL_K,
+    fetch_k: int = RETRIEVAL_FETCH_K,
+    use_mmr: bool = RETRIEVAL_USE_MMR,
+    mmr_lambda: float = RETRIEVAL_MMR_LAMBDA,
+    rrf_k: int = RETRIEVAL_RRF_K,
+    use_rerank: bool = RETRIEVAL_RERANK,
+    mode: str = RETRIEVAL_MODE,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+) -> List[Document]:
+    """Fuse dense FAISS results with BM25 keyword results using reciprocal-rank fusion.
+
+    Args:
+        mode (str): "hybrid", "dense" or "keyword".
+        metadata_filter (dict, optional): Restrict results to chunks whose metadata matches,
+            e.g. {"source": "pricing.pdf"} or {"page": [3, 4]}.
+
+    Returns:
+        List[Document]: The top-k chunks after fusion and optional reranking.
+    """
+    if vectorstore is None:
+        return []
+    ranked_lists: List[List[Document]] = []
+    if mode in ("hybrid", "dense"):
+        if use_mmr:
+            dense = vectorstore.max_marginal_relevance_search(
+                query, k=fetch_k, fetch_k=fetch_k * 2, lambda_mult=mmr_lambda, filter=metadata_filter
+            )
+        else:
+            dense = vectorstore.similarity_search(query, k=fetch_k, filter=metadata_filter, fetch_k=fetch_k * 2)
+        ranked_lists.append(dense)
+    if mode in ("hybrid", "keyword") and keyword_index is not None:
+        ranked_lists.append([doc for doc, _ in keyword_index.search(query, fetch_k, metadata_filter)])
+
+    fused_scores: Dict[Tuple[Optional[str], str], float] = defaultdict(float)
+    documents: Dict[Tuple[Optional[str], str], Document] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            key = document_key(doc)
+            fused_scores[key] += 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+    candidates = sorted(documents.values(), key=lambda doc: fused_scores[document_key(doc)], reverse=True)
+    if use_rerank:
+        candidates = rerank(query, candidates, fused_scores)
+    return candidates[:k]
@@ -0,0 +1,182 @@
+import re
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import NamedTuple
+from resources import shared_resource
+from metrics import record_cache
+
+from config import GOOGLE_API_KEY, GEMINI_MODEL_NAME, TONE_CONFIDENCE_THRESHOLD, TONE_CACHE_SIZE, TONE_GEMINI_FALLBACK
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Words and phrases that merely describe a problem ("broken", "not working", "wrong") are left out:
+# they are what help-desk questions are about, not a sign the user is unhappy.
+NEGATIVE_TERMS = {
+    "frustrated": 2.0, "frustrating": 2.0, "annoyed": 2.0, "annoying": 2.0, "angry": 2.0, "furious": 2.5,
+    "useless": 2.5, "terrible": 2.5, "awful": 2.5, "horrible": 2.5, "worst": 2.5, "ridiculous": 2.0,
+    "disappointed": 2.0, "disappointing": 2.0, "unhelpful": 2.0, "unacceptable": 2.0, "pathetic": 2.5,
+    "hate": 2.0, "stupid": 2.0, "waste": 1.5, "confused": 1.0, "confusing": 1.0, "upset": 1.5,
+    "ugh": 1.5, "nonsense": 2.0, "irrelevant": 1.5, "unhappy": 2.0, "dissatisfied": 2.0,
+}
+NEGATIVE_PHRASES = {
+    "didn't help": 2.0, "did not help": 2.0, "not helpful": 2.0, "makes no sense": 2.0, "not what i asked": 2.0,
+    "you don't understand": 2.0, "fed up": 2.0, "waste of time": 2.5, "not answering": 2.0, "still not": 1.0,
+}
+POSITIVE_TERMS = {
+    "thanks": 2.0, "thank": 2.0, "great": 1.5, "perfect": 2.0, "awesome": 2.0, "helpful": 2.0,
+    "excellent": 2.0, "appreciate": 2.0, "love": 1.5, "nice": 1.0, "good": 1.0, "works": 1.0,
+    "solved": 1.5, "resolved": 1.5, "cool": 1.0, "glad": 1.5, "happy": 2.0, "satisfied": 2.0, "pleased": 2.0,
+}
+NEGATIONS = {"not", "no", "never", "nothing", "isn't", "wasn't", "don't", "doesn't", "didn't", "hardly"}
+# Polite refusals read as negated thanks word by word; they are removed before scoring.
+POLITE_REFUSALS = re.compile(r"\b(?:no|nothing(?: else)?),?\s+(?:thanks|thank you)\b")
+# Only a cue at least this strong makes a negative result confident; weaker ones are left to the fallback.
+FRUSTRATION_CUE_WEIGHT = 2.0
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+class ToneResult(NamedTuple):
+    """Tone classification for a single user message."""
+
+    label: str
+    confidence: float
+    source: str
+
+    @property
+    def is_negative(self) -> bool:
+        return self.label == "negative"
+
+class LexiconToneDetector:
+    """Fast, offline tone classifier scoring weighted sentiment terms with negation handling.
+
+    Messages without any sentiment cue (most questions) are confidently neutral;
+    mixed or weak cues, including negatives without a clear frustration cue,
+    get low confidence so a fallback can decide.
+    """
+
+    def detect(self, message: str) -> ToneResult:
+        text = POLITE_REFUSALS.sub(" ", message.lower())
+        words = WORD_PATTERN.findall(text)
+        cues = [weight for phrase, weight in NEGATIVE_PHRASES.items() if phrase in text]
+        positive = 0.0
+        for i, word in enumerate(words):
+            negated = any(previous in NEGATIONS for previous in words[max(0, i - 2):i])
+            if word in NEGATIVE_TERMS:
+                if negated:
+                    positive += NEGATIVE_TERMS[word] * 0.5
+                else:
+                    cues.append(NEGATIVE_TERMS[word])
+            elif word in POSITIVE_TERMS:
+                if negated:
+                    cues.append(POSITIVE_TERMS[word])
+                else:
+                    positive += POSITIVE_TERMS[word]
+        negative = sum(cues)
+        if negative:
+            # Shouting and repeated punctuation intensify an already negative message.
+            if re.search(r"[!?]{2,}", message):
+                negative += 0.5
+            if any(len(token) >= 3 and token.isupper() for token in message.split()):
+                negative += 0.5
+
+        score = negative - positive
+        if not negative and not positive:
+            return ToneResult("neutral", 0.8, "lexicon")
+        if score >= 1.0:
+            label = "negative"
+        elif score <= -1.0:
+            label = "positive"
+        else:
+            label = "neutral"
+        if negative and positive:
+            confidence = 0.4
+        elif label == "neutral" or (label == "negative" and max(cues) < FRUSTRATION_CUE_WEIGHT):
+            confidence = 0.5
+        else:
+            confidence = min(0.95, 0.6 + 0.1 * abs(score))
+        return ToneResult(label, confidence, "lexicon")
+
+class GeminiToneDetector:
+    """Tone classifier backed by a Gemini call, for messages the local detector is unsure about."""
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME, model=None):
+        from llm_utils import get_llm_gateway
+
+        self.gateway = get_llm_gateway()
+        self.model_name = model_name
+        if model is not None:
+            self.model = model
+            return
+        import google.generativeai as genai
+
+        genai.configure(api_key=GOOGLE_API_KEY)
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            system_instruction=(
+                "You are an expert in sentiment analysis. Analyze the sentiment of the provided message and determine if it has a negative tone. "
+                "A negative tone includes expressions of frustration, dissatisfaction, anger, confusion, or disappointment. "
+                "Return only 'True' if the tone is negative, or 'False' if it is neutral or positive."
+            )
+        )
+
+    def detect(self, message: str) -> ToneResult:
+        prompt = (
+            f"Analyze the sentiment of the following message and return 'True' if the tone is negative, or 'False' if it is neutral or positive:\n\n"
+            f"Message: {message}\n\n"
+            "Sentiment (True/False):"
+        )
+        try:
+            response = self.gateway.call(lambda: self.model.generate_content(prompt), self.model_name, prompt, purpose="tone")
+            sentiment = response.text.strip()
+        except Exception as e:
+            logger.error(f"Error detecting negative tone with LLM: {e}")
+            return ToneResult("neutral", 0.0, "gemini")
+        if sentiment not in ["True", "False"]:
+            logger.error(f"Invalid sentiment response: {sentiment}")
+            return ToneResult("neutral", 0.0, "gemini")
+        return ToneResult("negative" if sentiment == "True" else "neutral", 0.9, "gemini")
+
+class ToneDetector:
+    """Local-first tone detection with an optional fallback and a memo cache for repeated messages."""
+
+    def __init__(self, primary=None, fallback=None, threshold: float = TONE_CONFIDENCE_THRESHOLD, cache_size: int = TONE_CACHE_SIZE):
+        self.primary = primary or LexiconToneDetector()
+        self.fallback = fallback
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, ToneResult]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_confident(self, result: ToneResult) -> bool:
+        return result.confidence >= self.threshold
+
+    def detect(self, message: str) -> ToneResult:
+        """Classify a message, consulting the fallback only when the local result is not confident."""
+        # Keep case: the lexicon scores all-caps words as shouting
+        key = " ".join(message.split())
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                record_cache("tone", hit=True)
+                return self._cache[key]
+        record_cache("tone", hit=False)
+        result = self.primary.detect(message)
+        if not self.is_confident(result) and self.fallback is not None:
+            fallback_result = self.fallback.detect(message)
+            if fallback_result.confidence > result.confidence:
+                result = fallback_result
+        digest = hashlib.sha256(message.encode("utf-8")).hexdigest()[:12]
+        logger.info(f"Tone for message {digest} ({len(message)} chars): {result.label} ({result.source}, {result.confidence:.2f})")
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+@shared_resource("tone_detector")
+def get_tone_detector() -> ToneDetector:
+    """Return the process-wide tone detector."""
+    return ToneDetector(fallback=GeminiToneDetector() if TONE_GEMINI_FALLBACK else None)
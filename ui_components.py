@@ -1,76 +1,26 @@
+import os
 import streamlit as st
 import logging
 import uuid
-import chromadb
-import json
-from chromadb.config import Settings
-import speech_recognition as sr
-import google.generativeai as genai
-from config import INTRODUCTION_MESSAGE, GOOGLE_API_KEY, PAGE_ICON,PAGE_TITLE,CSS_FILE, GMAIL_SENDER_EMAIL, GMAIL_APP_PASSWORD,EMAIL_RECIPIENT,DATA_FOLDER
-from email_utils import send_support_email
-from document_processor import process_documents, create_text_chunks, create_vectorstore
-from llm_utils import create_conversational_chain
+from config import PAGE_ICON, PAGE_TITLE, CSS_FILE, CHAT_HISTORY_PAGE_SIZE, INTRODUCTION_MESSAGE, SUPPORT_STATUS_POLL_SECONDS
+import time
+from helpdesk_engine import HelpDeskEngine
+from metrics import record_duration
 
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Chroma DB client
-chroma_client = chromadb.Client(Settings())
-
-# Initialize Gemini client
-genai.configure(api_key=GOOGLE_API_KEY)
-
 def get_or_create_session_id() -> str:
     """Get the session ID from query params or create and store a new one."""
-    session_id = st.query_params.get("session_id", [None])[0]
+    session_id = st.query_params.get("session_id")
     if not session_id:
         session_id = str(uuid.uuid4())
         st.query_params["session_id"] = session_id
     st.session_state.session_id = session_id
     return session_id
 
-def ensure_collection_exists(collection_name: str) -> None:
-    """Ensure that the collection exists in Chroma DB."""
-    if collection_name not in [col.name for col in chroma_client.list_collections()]:
-        chroma_client.create_collection(collection_name)
-
-def save_chat_message(session_id: str, message: dict) -> None:
-    """Save a chat message to Chroma DB with the session ID."""
-    collection_name = "chat_history"
-    ensure_collection_exists(collection_name)
-    collection = chroma_client.get_collection(collection_name)
-    collection.add(
-        documents=[json.dumps(message)],
-        metadatas={"session_id": session_id, "role": message["role"]},
-        ids=[str(uuid.uuid4())]
-    )
-
-def retrieve_chat_history(session_id):
-    """Retrieve chat history from Chroma DB."""
-    collection_name = "chat_history"
-    ensure_collection_exists(collection_name)
-    collection = chroma_client.get_collection(collection_name)
-    results = collection.get(
-        where={"session_id": session_id},
-        include=["documents", "metadatas"]
-    )
-    messages = []
-    for doc, meta in zip(results["documents"], results["metadatas"]):
-        if isinstance(doc, str):
-            try:
-                doc_content = json.loads(doc)
-                if isinstance(doc_content, dict):
-                    messages.append(doc_content)
-                else:
-                    messages.append({"role": meta["role"], "content": str(doc)})
-            except json.JSONDecodeError:
-                messages.append({"role": meta["role"], "content": str(doc)})
-        else:
-            messages.append({"role": meta["role"], "content": str(doc)})
-    return messages
-
 def load_css(file_path: str) -> None:
     """Load and apply CSS styles."""
     try:
@@ -81,22 +31,73 @@ def load_css(file_path: str) -> None:
         logger.error(f"Error loading CSS file '{file_path}': {e}")
         st.error(f"Error loading CSS file '{file_path}': {e}")
 
-def display_chat_messages() -> None:
-    """Display chat messages in the Streamlit app."""
+def message_html(role: str, content: str) -> str:
+    """Build the chat bubble HTML for a message."""
+    role_class = "user" if role == "user" else "assistant"
+    prefix = "👤  " if role == "user" else "🤖  "
+    return (
+        f'<div class="{role_class}-message">'
+        f'<div class="{role_class}-bubble"><strong>{prefix}</strong>{content}</div>'
+        f'</div>'
+    )
+
+def rendered(message: dict) -> dict:
+    """A chat message with its bubble HTML built once, so reruns don't rebuild it."""
+    return dict(message, html=message_html(message["role"], message["content"]))
+
+def append_message(role: str, content: str) -> None:
+    """Add a message the engine has just stored to the visible window."""
+    st.session_state.messages.append(rendered({"role": role, "content": content}))
+    st.session_state.stored_messages_loaded += 1
+
+def load_history(engine: HelpDeskEngine, session_id: str) -> None:
+    """Show the newest page of a session's history; older pages load on demand."""
+    page, has_older = engine.get_history_page(session_id, CHAT_HISTORY_PAGE_SIZE)
+    messages = page or [{"role": "assistant", "content": INTRODUCTION_MESSAGE}]
+    st.session_state.messages = [rendered(message) for message in messages]
+    st.session_state.stored_messages_loaded = len(page)
+    st.session_state.has_older_messages = has_older
+
+def load_older_messages(engine: HelpDeskEngine, session_id: str) -> None:
+    """Prepend the next page of older stored messages to the visible window."""
+    page, has_older = engine.get_history_page(session_id, CHAT_HISTORY_PAGE_SIZE, st.session_state.stored_messages_loaded)
+    st.session_state.messages = [rendered(message) for message in page] + st.session_state.messages
+    st.session_state.stored_messages_loaded += len(page)
+    st.session_state.has_older_messages = has_older
+
+def display_chat_messages(engine: HelpDeskEngine, session_id: str) -> None:
+    """Display the loaded window of chat messages, with a control to load older ones."""
+    if st.session_state.get("has_older_messages"):
+        control = st.empty()
+        if control.button("Load older messages"):
+            start = time.perf_counter()
+            load_older_messages(engine, session_id)
+            record_duration("history_page", time.perf_counter() - start)
+            if not st.session_state.has_older_messages:
+                control.empty()
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
-            role_class = "user" if message["role"] == "user" else "assistant"
-            prefix = "👤  " if message["role"] == "user" else "🤖  "
-            st.markdown(
-                f'<div class="{role_class}-message">'
-                f'<div class="{role_class}-bubble"><strong>{prefix}</strong>{message["content"]}</div>'
-                f'</div>',
-                unsafe_allow_html=True
-            )
+            st.markdown(message["html"], unsafe_allow_html=True)
+    st.session_state.history_rendered = len(st.session_state.messages)
+
+@st.fragment
+def chat_panel(engine: HelpDeskEngine) -> None:
+    """Chat input and the turns sent since the last full rerun.
+
+    Sending a message reruns only this fragment, so the history window drawn by
+    `display_chat_messages` stays on screen instead of being redrawn every turn.
+    """
+    for message in st.session_state.messages[st.session_state.history_rendered:]:
+        with st.chat_message(message["role"]):
+            st.markdown(message["html"], unsafe_allow_html=True)
+    if prompt := st.chat_input("Ask me anything about the company!"):
+        handle_user_input(prompt, engine, st.session_state.session_id)
 
 def handle_voice_input():
     """Handles voice input from the user."""
     if st.sidebar.button("Speak"):
+        import speech_recognition as sr
+
         r = sr.Recognizer()
         with sr.Microphone() as source:
             st.sidebar.info("Say something!")
@@ -113,243 +114,85 @@ def handle_voice_input():
                 st.sidebar.error(f"Could not request results from Google Speech Recognition service; {e}")
     return None
 
-def detect_negative_tone(message: str) -> bool:
-    """Detect negative tone using Gemini LLM."""
-    try:
-        # Initialize the model
-        model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            system_instruction=(
-                "You are an expert in sentiment analysis. Analyze the sentiment of the provided message and determine if it has a negative tone. "
-                "A negative tone includes expressions of frustration, dissatisfaction, anger, confusion, or disappointment. "
-                "Return only 'True' if the tone is negative, or 'False' if it is neutral or positive."
-            )
-        )
-
-        # Create a prompt for sentiment analysis
-        prompt = (
-            f"Analyze the sentiment of the following message and return 'True' if the tone is negative, or 'False' if it is neutral or positive:\n\n"
-            f"Message: {message}\n\n"
-            "Sentiment (True/False):"
-        )
-
-        # Generate content
-        response = model.generate_content(prompt)
-        sentiment = response.text.strip()
-
-        logger.info(f"Sentiment analysis for message '{message}': {sentiment}")
-
-        # Validate response
-        if sentiment in ["True", "False"]:
-            return sentiment == "True"
-        else:
-            logger.error(f"Invalid sentiment response: {sentiment}")
-            return False  # Default to False if response is invalid
-
-    except Exception as e:
-        logger.error(f"Error detecting negative tone with LLM: {e}")
-        st.error(f"Error analyzing sentiment: {e}")
-        return False  # Default to False on error
-
-def handle_user_input(prompt: str, chat_manager, session_id) -> None:
-    """Handle user input and generate assistant response."""
+def handle_user_input(prompt: str, engine: HelpDeskEngine, session_id) -> None:
+    """Send user input to the help-desk engine and render its streamed reply."""
     session_id = get_or_create_session_id()
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    save_chat_message(session_id, {"role": "user", "content": prompt})
-
+    append_message("user", prompt)
     with st.chat_message("user"):
-        st.markdown(
-            f'<div class="user-message">'
-            f'<div class="user-bubble"><strong>👤  </strong>{prompt}</div>'
-            f'</div>',
-            unsafe_allow_html=True
-        )
-
-    # Initialize session state variables
-    if "dissatisfaction_count" not in st.session_state:
-        st.session_state.dissatisfaction_count = 0
-    if "awaiting_email" not in st.session_state:
-        st.session_state.awaiting_email = False
-    if "awaiting_concern" not in st.session_state:
-        st.session_state.awaiting_concern = False
-    if "user_email" not in st.session_state:
-        st.session_state.user_email = None
-
-    # Check for negative tone
-    if detect_negative_tone(prompt):
-        st.session_state.dissatisfaction_count += 1
-    else:
-        st.session_state.dissatisfaction_count = 0  # Reset if positive/neutral
-
-    # Prompt for email after 3 consecutive negative responses
-    if st.session_state.dissatisfaction_count >= 3 and not st.session_state.awaiting_email:
-        response = (
-            "It seems like I may not be fully addressing your concern. To better assist you, "
-            "please provide your email address, and I'll connect you with our support team."
-        )
-        st.session_state.awaiting_email = True
-        with st.chat_message("assistant"):
-            st.markdown(
-                f'<div class="assistant-message">'
-                f'<div class="assistant-bubble"><strong>🤖 </strong>{response}</div>'
-                f'</div>',
-                unsafe_allow_html=True
-            )
-            st.session_state.messages.append({"role": "assistant", "content": response})
-            save_chat_message(session_id, {"role": "assistant", "content": response})
-        return
-
-    # Handle email input
-    if st.session_state.awaiting_email:
-        if "@" in prompt and "." in prompt:  # Basic email validation
-            st.session_state.user_email = prompt
-            st.session_state.awaiting_email = False
-            st.session_state.awaiting_concern = True
-            response = "Thank you! Please provide your specific question or concern, and I'll forward it to our support team."
+        st.markdown(message_html("user", prompt), unsafe_allow_html=True)
+
+    container = placeholder = None
+    answer_parts = []
+    render_seconds = 0.0
+    for event in engine.handle_turn(session_id, prompt):
+        render_start = time.perf_counter()
+        if event.event == "token":
+            if placeholder is None:
+                container = st.chat_message("assistant")
+                placeholder = container.empty()
+            answer_parts.append(event.data["text"])
+            placeholder.markdown(message_html("assistant", "".join(answer_parts) + "▌"), unsafe_allow_html=True)
+        elif event.event == "message":
+            content = event.data["content"]
+            if placeholder is None:
+                container = st.chat_message("assistant")
+                placeholder = container.empty()
+            placeholder.markdown(message_html("assistant", content), unsafe_allow_html=True)
+            if event.data.get("sources"):
+                container.caption("Sources: " + "; ".join(event.data["sources"]))
+            if event.data["kind"] == "error":
+                st.error(f"Error: {event.data.get('error')}")
+            append_message("assistant", content)
+            container = placeholder = None
+            answer_parts = []
+        render_seconds += time.perf_counter() - render_start
+    record_duration("render", render_seconds)
+
+@st.fragment(run_every=SUPPORT_STATUS_POLL_SECONDS)
+def report_support_request_status(engine: HelpDeskEngine, session_id: str) -> None:
+    """Tell the user once each queued support email has been delivered or has failed.
+
+    Runs as its own periodically rerun fragment, so the status stays current while
+    chat turns only rerun `chat_panel`. Call it inside the sidebar.
+    """
+    pending = False
+    for request in engine.poll_support_requests(session_id):
+        if request["status"] == "sent":
+            st.toast("Your support request was delivered to our team.", icon="✅")
+        elif request["status"] == "failed":
+            # Finished requests are forgotten once polled; keep the failure on screen.
+            st.session_state.support_request_failed = True
         else:
-            response = "Please provide a valid email address."
-        with st.chat_message("assistant"):
-            st.markdown(
-                f'<div class="assistant-message">'
-                f'<div class="assistant-bubble"><strong>🤖 </strong>{response}</div>'
-                f'</div>',
-                unsafe_allow_html=True
-            )
-            st.session_state.messages.append({"role": "assistant", "content": response})
-            save_chat_message(session_id, {"role": "assistant", "content": response})
-        return
-
-    # Handle concern input and send email
-    if st.session_state.awaiting_concern:
-        user_concern = prompt
-        st.session_state.awaiting_concern = False
-        st.session_state.dissatisfaction_count = 0  # Reset counter
-
-        # Define the function schema for Gemini
-        function_declarations = [
-            genai.protos.FunctionDeclaration(
-                name="send_support_email",
-                description="Sends an email to the support team with the user's concern.",
-                parameters=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "user_email": genai.protos.Schema(type=genai.protos.Type.STRING),
-                        "user_concern": genai.protos.Schema(type=genai.protos.Type.STRING),
-                        "recipient_email": genai.protos.Schema(type=genai.protos.Type.STRING),
-                    },
-                    required=["user_email", "user_concern"]
-                )
-            )
-        ]
-
-        # Create a Tool object
-        tool = genai.protos.Tool(function_declarations=function_declarations)
-
-        # Initialize the model
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            tools=[tool],
-            system_instruction="You are an assistant that sends support emails using provided tools."
-        )
-
-        try:
-            # Generate content with function calling
-            response = model.generate_content(
-                f"Send a support email from {st.session_state.user_email} with the concern: {user_concern}"
-            )
-
-            # Process the response for function calls
-            if response.candidates and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if part.function_call and part.function_call.name == "send_support_email":
-                        args = dict(part.function_call.args)
-                        result = send_support_email(
-                            user_email=args.get("user_email", st.session_state.user_email),
-                            user_concern=args.get("user_concern", user_concern),
-                            recipient_email=args.get("recipient_email", EMAIL_RECIPIENT)
-                        )
-                        response_text = result["message"]
-                        break
-                else:
-                    response_text = "Failed to process the email request."
-            else:
-                response_text = "Failed to process the email request."
-
-        except Exception as e:
-            logger.error(f"Error with Gemini function calling: {e}")
-            response_text = f"Failed to send email due to an error: {str(e)}"
+            pending = True
+    if st.session_state.get("support_request_failed"):
+        st.error("We could not deliver your support request. Please contact support directly.")
+    if pending:
+        st.info("Your support request is queued for delivery.")
 
-        with st.chat_message("assistant"):
-            st.markdown(
-                f'<div class="assistant-message">'
-                f'<div class="assistant-bubble"><strong>🤖 </strong>{response_text}</div>'
-                f'</div>',
-                unsafe_allow_html=True
-            )
-            st.session_state.messages.append({"role": "assistant", "content": response_text})
-            save_chat_message(session_id, {"role": "assistant", "content": response_text})
-        return
-
-    # Normal response handling
-    if "conversational_chain" in st.session_state:
-        try:
-            response_with_docs = st.session_state.conversational_chain({
-                "question": prompt,
-                "chat_history": st.session_state.messages
-            })
-            response = response_with_docs['answer'].strip()
-            with st.chat_message("assistant"):
-                st.markdown(
-                    f'<div class="assistant-message">'
-                    f'<div class="assistant-bubble"><strong>🤖 </strong>{response}</div>'
-                    f'</div>',
-                    unsafe_allow_html=True
-                )
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                save_chat_message(session_id, {"role": "assistant", "content": response})
-        except Exception as e:
-            error_response = "Let me try that again - sometimes connections can be tricky!"
-            logger.error(f"Error processing user input: {e}")
-            st.error(f"Error: {e}")
-            with st.chat_message("assistant"):
-                st.markdown(
-                    f'<div class="assistant-message">'
-                    f'<div class="assistant-bubble"><strong>🤖 </strong>{error_response}</div>'
-                    f'</div>',
-                    unsafe_allow_html=True
-                )
-                st.session_state.messages.append({"role": "assistant", "content": error_response})
-                save_chat_message(session_id, {"role": "assistant", "content": error_response})
-    else:
-        no_data_response = f"I'm still learning about {st.session_state.company_name}. Please ensure our knowledge base is connected."
-        with st.chat_message("assistant"):
-            st.markdown(
-                f'<div class="assistant-message">'
-                f'<div class="assistant-bubble"><strong>🤖 </strong>{no_data_response}</div>'
-                f'</div>',
-                unsafe_allow_html=True
-            )
-        st.session_state.messages.append({"role": "assistant", "content": no_data_response})
-        save_chat_message(session_id, {"role": "assistant", "content": no_data_response})
-
-def initialize_ui(chat_manager) -> None:
+def initialize_ui(engine: HelpDeskEngine) -> None:
     """Initialize the Streamlit UI."""
     
     st.set_page_config(page_title=PAGE_TITLE, page_icon=PAGE_ICON)
     load_css(CSS_FILE)
     session_id = get_or_create_session_id()
     if "messages" not in st.session_state:
-        st.session_state.messages = retrieve_chat_history(session_id)
+        load_history(engine, session_id)
     if "company_name" not in st.session_state:
-        
-        all_text, company_name = process_documents(DATA_FOLDER)
-        st.session_state.company_name = company_name
-        # st.title(f"🏢 {company_name} Help Desk")
-        if not st.session_state.messages:
-            st.session_state.messages.append({"role": "assistant", "content": INTRODUCTION_MESSAGE})
-        if all_text:
-            text_chunks = create_text_chunks(all_text)
-            vectorstore = create_vectorstore(text_chunks)
-            st.session_state.conversational_chain = create_conversational_chain(vectorstore, company_name)
+        with st.spinner("Loading knowledge base..."):
+            st.session_state.company_name = engine.company_name
+    st.sidebar.title("Knowledge Base")
+    if st.sidebar.button("Refresh knowledge base"):
+        progress_bar = st.sidebar.progress(0.0, text="Loading knowledge base...")
+        try:
+            knowledge_base = engine.refresh_knowledge_base(
+                lambda done, total, file_path: progress_bar.progress(done / total, text=f"Parsed {os.path.basename(file_path)}")
+            )
+            progress_bar.empty()
+            st.session_state.company_name = knowledge_base.company_name
+            st.sidebar.success(f"Knowledge base updated (version {knowledge_base.version}).")
+        except Exception as e:
+            st.sidebar.error(f"Error refreshing knowledge base: {e}")
+    with st.sidebar:
+        report_support_request_status(engine, session_id)
     st.sidebar.title("Voice Input")
-    st.sidebar.markdown("Click the button below to speak.")
\ No newline at end of file
+    st.sidebar.markdown("Click the button below to speak.")
@@ -0,0 +1,222 @@
+import os
+import math
+import time
+import pickle
+import tempfile
+import logging
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from config import INDEX_QUANTIZATION, INDEX_RESCORE_FACTOR, INDEX_IVF_NPROBE, INDEX_PQ_SUBQUANTIZERS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    import faiss
+    from langchain.vectorstores import FAISS
+
+QUANTIZATION_KINDS = ("none", "fp16", "int8", "ivfpq")
+EXACT_INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+# Training 256 product-quantizer centroids well takes ~39 vectors each; below that int8 is smaller and faster.
+IVFPQ_MIN_VECTORS = 39 * 256
+
+def quantized_index_file(kind: str) -> str:
+    return f"index.{kind}.faiss"
+
+def index_factory_string(kind: str, dimension: int, count: int) -> str:
+    """FAISS index-factory description of the compressed index for `count` vectors."""
+    if kind == "fp16":
+        return "SQfp16"
+    if kind == "int8" or (kind == "ivfpq" and count < IVFPQ_MIN_VECTORS):
+        return "SQ8"
+    if kind == "ivfpq":
+        nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+        subquantizers = max(m for m in range(1, min(INDEX_PQ_SUBQUANTIZERS, dimension) + 1) if dimension % m == 0)
+        return f"IVF{nlist},PQ{subquantizers}x8"
+    raise ValueError(f"Unknown index quantization '{kind}'; expected one of {', '.join(QUANTIZATION_KINDS)}")
+
+def build_quantized_index(exact: "faiss.Index", kind: str) -> "faiss.Index":
+    """Train and fill a compressed copy of an exact index; vector positions are preserved."""
+    import faiss
+
+    if kind == "ivfpq" and exact.ntotal < IVFPQ_MIN_VECTORS:
+        logger.warning(f"Only {exact.ntotal} vectors, too few to train IVF-PQ well; using int8 instead")
+    vectors = exact.reconstruct_n(0, exact.ntotal)
+    index = faiss.index_factory(exact.d, index_factory_string(kind, exact.d, exact.ntotal), exact.metric_type)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+def read_exact_index(index_path: str) -> "faiss.Index":
+    """Memory-map a version's float32 index, so only the rows actually read are paged in."""
+    import faiss
+
+    return faiss.read_index(os.path.join(index_path, EXACT_INDEX_FILE), faiss.IO_FLAG_MMAP_IFC)
+
+def load_quantized_index(index_path: str, kind: str, exact: "faiss.Index") -> "faiss.Index":
+    """Read a version's compressed index, building and saving it next to the exact one on first use."""
+    import faiss
+
+    file_path = os.path.join(index_path, quantized_index_file(kind))
+    if os.path.exists(file_path):
+        return faiss.read_index(file_path)
+    index = build_quantized_index(exact, kind)
+    try:
+        fd, staging_path = tempfile.mkstemp(prefix=".quantized-", dir=index_path)
+        os.close(fd)
+        faiss.write_index(index, staging_path)
+        os.replace(staging_path, file_path)
+    except OSError as e:
+        logger.warning(f"Could not save the {kind} index to '{index_path}', it will be rebuilt on the next load: {e}")
+    return index
+
+def write_quantized_index(index_path: str, kind: str = INDEX_QUANTIZATION) -> None:
+    """Write the compressed serving index for a version directory, unless serving is exact."""
+    if kind != "none" and os.path.exists(os.path.join(index_path, EXACT_INDEX_FILE)):
+        load_quantized_index(index_path, kind, read_exact_index(index_path))
+
+class RescoringIndex:
+    """Search a compressed in-memory index, then re-rank its candidates at full precision.
+
+    Implements the read-only part of the faiss.Index interface that LangChain's FAISS
+    store uses to search (`search`, `reconstruct`, `ntotal`, `d`). The exact vectors stay
+    memory-mapped on disk and only the candidates' rows are read.
+    """
+
+    def __init__(self, compressed: "faiss.Index", exact: "faiss.Index", rescore_factor: int = INDEX_RESCORE_FACTOR):
+        import faiss
+
+        if compressed.ntotal != exact.ntotal or compressed.d != exact.d:
+            raise ValueError(
+                f"Compressed index holds {compressed.ntotal}x{compressed.d} vectors but the exact one {exact.ntotal}x{exact.d}"
+            )
+        self.compressed = compressed
+        self.exact = exact
+        self.rescore_factor = max(1, rescore_factor)
+        self._inner_product = exact.metric_type == faiss.METRIC_INNER_PRODUCT
+        ivf = faiss.try_extract_index_ivf(compressed)
+        if ivf is not None:
+            ivf.nprobe = min(INDEX_IVF_NPROBE, ivf.nlist)
+
+    @property
+    def ntotal(self) -> int:
+        return self.exact.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.exact.d
+
+    @property
+    def metric_type(self) -> int:
+        return self.exact.metric_type
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        return self.exact.reconstruct(key)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Same contract as faiss.Index.search: (distances, labels), padded with -1 labels."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        _, candidates = self.compressed.search(queries, min(self.ntotal, k * self.rescore_factor))
+        distances = np.full((len(queries), k), -np.inf if self._inner_product else np.inf, dtype=np.float32)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            ids = ids[ids >= 0]
+            if not len(ids):
+                continue
+            vectors = self.exact.reconstruct_batch(ids)
+            if self._inner_product:
+                scores = vectors @ query
+                order = np.argsort(-scores)[:k]
+            else:
+                scores = ((vectors - query) ** 2).sum(axis=1)
+                order = np.argsort(scores)[:k]
+            distances[row, :len(order)] = scores[order]
+            labels[row, :len(order)] = ids[order]
+        return distances, labels
+
+def load_quantized_vectorstore(index_path: str, embeddings: Embeddings, kind: str = INDEX_QUANTIZATION) -> "FAISS":
+    """Load a version directory as a read-only vectorstore served from its compressed index."""
+    from langchain.vectorstores import FAISS
+
+    exact = read_exact_index(index_path)
+    index = RescoringIndex(load_quantized_index(index_path, kind, exact), exact)
+    with open(os.path.join(index_path, DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def index_bytes(index: "faiss.Index") -> int:
+    import faiss
+
+    return len(faiss.serialize_index(index))
+
+def _search_excluding(index: Any, queries: np.ndarray, k: int, exclude: Optional[np.ndarray]) -> np.ndarray:
+    """Top-k labels per query, leaving out each query's own vector when `exclude` is given."""
+    if exclude is None:
+        return index.search(queries, k)[1]
+    labels = index.search(queries, k + 1)[1]
+    return np.array([[label for label in row if label != own][:k] for row, own in zip(labels, exclude)], dtype=np.int64)
+
+def recall_at_k(expected: np.ndarray, found: np.ndarray) -> float:
+    """Fraction of the exact top-k neighbours that the approximate search also returned."""
+    hits = sum(len(set(e[e >= 0].tolist()) & set(f[f >= 0].tolist())) for e, f in zip(expected, found))
+    return hits / max(1, int((expected >= 0).sum()))
+
+def evaluate_quantization(
+    exact: "faiss.Index",
+    queries: np.ndarray,
+    k: int,
+    kinds: Sequence[str] = QUANTIZATION_KINDS[1:],
+    exclude: Optional[np.ndarray] = None,
+    compressed: Optional[Dict[str, "faiss.Index"]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Compare each quantization against exact search on the same queries.
+
+    Args:
+        exclude (np.ndarray, optional): Per-query vector position to leave out of every result,
+            for held-out queries drawn from the index itself.
+        compressed (dict, optional): Already built compressed indexes by kind; others are built here.
+
+    Returns:
+        dict: Per kind, recall@k with and without full-precision rescoring, query latency and size.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    expected = _search_excluding(exact, queries, k, exclude)
+    exact_bytes = exact.ntotal * exact.d * 4
+    report: Dict[str, Dict[str, Any]] = {}
+    for kind in kinds:
+        start = time.perf_counter()
+        index = (compressed or {}).get(kind)
+        if index is None:
+            index = build_quantized_index(exact, kind)
+        build_seconds = time.perf_counter() - start
+        rescoring = RescoringIndex(index, exact)
+        start = time.perf_counter()
+        found = _search_excluding(rescoring, queries, k, exclude)
+        search_seconds = time.perf_counter() - start
+        size = index_bytes(index)
+        report[kind] = {
+            "factory": index_factory_string(kind, exact.d, exact.ntotal),
+            f"recall@{k}": round(recall_at_k(expected, found), 4),
+            f"recall@{k}_without_rescoring": round(recall_at_k(expected, _search_excluding(index, queries, k, exclude)), 4),
+            "query_ms": round(1000 * search_seconds / max(1, len(queries)), 3),
+            "build_seconds": round(build_seconds, 2),
+            "bytes": size,
+            "compression": round(exact_bytes / max(1, size), 2),
+        }
+    return report
+
+def held_out_queries(exact: "faiss.Index", sample: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Sample stored vectors as leave-one-out queries.
+
+    Returns:
+        tuple: (query vectors, their positions, to exclude from results)
+    """
+    positions = np.random.default_rng(seed).choice(exact.ntotal, size=min(sample, exact.ntotal), replace=False)
+    return exact.reconstruct_batch(positions.astype(np.int64)), positions
+
+def embed_queries(embeddings: Embeddings, queries: List[str]) -> np.ndarray:
+    return np.array([embeddings.embed_query(query) for query in queries], dtype=np.float32)